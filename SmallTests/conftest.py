@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Test against the scripts in the repository root rather than the copies kept in SmallTests.
+# vm_process is imported here so the SmallTests copy of the same name cannot shadow it later.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vm_process  # noqa: E402,F401
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+import subprocess
+from async_exec import ResourceClass, CommandEngine, CommandStalled, classify_command, run_command, run_parallel
+
+SLEEP = [sys.executable, '-c', 'import time; time.sleep(0.3)']
+
+class TestCommandEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = CommandEngine({ResourceClass.DISK: 1, ResourceClass.NETWORK: 2})
+
+    def tearDown(self):
+        self.engine.loop.call_soon_threadsafe(self.engine.loop.stop)
+
+    def run_together(self, commands, resource):
+        import asyncio
+
+        async def gather():
+            return await asyncio.gather(*(self.engine.run(command, resource) for command in commands))
+
+        start = time.perf_counter()
+        self.engine.call(gather())
+        return time.perf_counter() - start
+
+    def test_resource_limit_serialises_commands(self):
+        self.assertGreater(self.run_together([SLEEP, SLEEP], ResourceClass.DISK), 0.55)
+        self.assertLess(self.run_together([SLEEP, SLEEP], ResourceClass.NETWORK), 0.55)
+
+    def test_output_is_streamed_per_line(self):
+        lines = []
+        command = [sys.executable, '-c', 'import sys; print("10%"); print("oops", file=sys.stderr); print("100%")']
+        result = self.engine.call(self.engine.run(command, on_line=lambda stream, line: lines.append((stream, line))))
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.split(), ['10%', '100%'])
+        self.assertIn(('stderr', 'oops'), lines)
+
+    def test_timeout_kills_command(self):
+        command = [sys.executable, '-c', 'import time; time.sleep(10)']
+        start = time.perf_counter()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.engine.call(self.engine.run(command, timeout=0.2))
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_timeout_kills_child_processes(self):
+        # The grandchild inherits the output pipes; killing only the direct child would leave them open.
+        command = [sys.executable, '-c', 'import subprocess, sys, time; '
+                   'subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]); time.sleep(30)']
+        start = time.perf_counter()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.engine.call(self.engine.run(command, timeout=0.5))
+        self.assertLess(time.perf_counter() - start, 10)
+
+    def test_silent_command_is_killed_as_stalled(self):
+        command = [sys.executable, '-c', 'print("started", flush=True); import time; time.sleep(30)']
+        start = time.perf_counter()
+        with self.assertRaises(CommandStalled) as raised:
+            self.engine.call(self.engine.run(command, stall_timeout=0.4))
+        self.assertIn('started', raised.exception.stdout)
+        self.assertLess(time.perf_counter() - start, 10)
+
+    def test_growing_file_keeps_command_alive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.ova')
+            command = [sys.executable, '-c', 'import sys, time\nwith open(sys.argv[1], "wb") as f:\n'
+                       '    for _ in range(8):\n        f.write(b"x"); f.flush(); time.sleep(0.15)', path]
+            result = self.engine.call(self.engine.run(command, stall_timeout=0.4, watch_path=path))
+        self.assertEqual(result.returncode, 0)
+
+    def test_stall_is_detected_while_the_loop_executor_is_busy(self):
+        release = threading.Event()
+        for _ in range(min(32, (os.cpu_count() or 1) + 4)):
+            self.engine.loop.call_soon_threadsafe(self.engine.loop.run_in_executor, None, release.wait)
+        command = [sys.executable, '-c', 'import time; time.sleep(5)']
+        try:
+            with tempfile.TemporaryDirectory() as directory, self.assertRaises(CommandStalled):
+                self.engine.call(self.engine.run(command, stall_timeout=0.4, watch_path=os.path.join(directory, 'export.ova')))
+        finally:
+            release.set()
+
+    def test_classify_command(self):
+        self.assertEqual(classify_command(['VBoxManage', 'export']), ResourceClass.VIRTUALBOX)
+        self.assertEqual(classify_command(['xcopy', 'C:\\a', '\\\\NAS\\b']), ResourceClass.NETWORK)
+        self.assertEqual(classify_command(['xcopy', 'C:\\a', 'D:\\b']), ResourceClass.DISK)
+
+    def test_run_parallel_returns_results_and_exceptions(self):
+        def fail():
+            raise ValueError("boom")
+        results = run_parallel([(max, (1, 2)), (fail, ())])
+        self.assertEqual(results[0], 2)
+        self.assertIsInstance(results[1], ValueError)
+
+    def test_run_parallel_does_not_exhaust_the_loop_executor(self):
+        # More calls than the loop's default executor has threads, each running a command.
+        count = min(32, (os.cpu_count() or 1) + 4) + 2
+        results = []
+        worker = threading.Thread(target=lambda: results.extend(run_parallel([(run_command, ([sys.executable, '-c', 'pass'],))] * count)),
+                                  daemon=True)
+        worker.start()
+        worker.join(60)
+        self.assertFalse(worker.is_alive(), "run_parallel did not finish")
+        self.assertEqual([result.returncode for result in results], [0] * count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from backup_catalog import Catalog
+from storage_targets import LocalTarget
+
+class TestBackupCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(os.path.join(self.directory.name, 'catalog.sqlite'))
+        self.target = LocalTarget('office365', os.path.join(self.directory.name, 'Daily'))
+        self.source = os.path.join(self.directory.name, 'vm.ova')
+        with open(self.source, 'wb') as f:
+            f.write(b'export')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_verification_is_kept_until_the_file_changes(self):
+        self.catalog.record(self.target, 'vm.ova', self.source)
+        self.catalog.mark_verified(self.target, 'vm.ova')
+        self.catalog.record(self.target, 'vm.ova', self.source)
+        self.assertIsNotNone(self.catalog.lookup(self.target, 'vm.ova')['verified'])
+        with open(self.source, 'ab') as f:
+            f.write(b' changed')
+        self.catalog.record(self.target, 'vm.ova', self.source)
+        row = self.catalog.lookup(self.target, 'vm.ova')
+        self.assertEqual((row['target'], row['size'], row['verified']), ('office365', 14, None))
+        self.assertEqual([row['key'] for row in self.catalog.find(target='office365')], ['vm.ova'])
+        self.catalog.remove(self.target.root, 'vm.ova')
+        self.assertIsNone(self.catalog.lookup(self.target, 'vm.ova'))
+
+if __name__ == '__main__':
+    unittest.main()
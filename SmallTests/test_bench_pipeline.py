@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+from bench_pipeline import SCRIPT_DIRECTORY, build_environment
+from backup_catalog import Catalog
+
+class TestPipelineAgainstSimulator(unittest.TestCase):
+
+    @unittest.skipIf(os.name == 'nt', "shims are POSIX shell scripts")
+    def test_full_run_exports_copies_and_restarts(self):
+        with tempfile.TemporaryDirectory() as root:
+            environment, summary_directory = build_environment(root, vm_count=2, latency={'export': 0, 'snapshot': 0})
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vm_process.py')],
+                           env=environment, cwd=root, check=True, capture_output=True)
+            with open(environment['FAKE_VBOX_STATE']) as f:
+                vms = json.load(f)['vms']
+            self.assertEqual({vm['state'] for vm in vms.values()}, {'running'})
+            self.assertTrue(all(vm['snapshots'] for vm in vms.values()))
+            self.assertEqual(len(os.listdir(os.path.join(root, 'nas', 'Daily'))), 2)
+            exports = set(os.listdir(os.path.join(root, 'onedrive', 'Daily')))
+            self.assertEqual(len(exports), 2)
+            catalog = Catalog(os.path.join(root, 'catalog.sqlite'))
+            self.assertTrue(exports <= {row['key'] for row in catalog.find(target='office365')})
+            summary_file, = os.listdir(summary_directory)
+            with open(os.path.join(summary_directory, summary_file)) as f:
+                exports = [phase for phase in json.load(f)['phases'] if phase['phase'] == 'export']
+            self.assertEqual([phase['status'] for phase in exports], ['ok', 'ok'])
+            # the run logs below [Paths] logs_location and keeps its lock next to its config.ini
+            log_files = os.listdir(os.path.join(root, 'VM_Management', 'logs', 'vmmaintenance'))
+            self.assertTrue(any(name.endswith('_vmmaintenance.log') for name in log_files))
+            self.assertFalse(os.path.exists(os.path.join(root, 'vmmaintenance.lock')))
+
+    @unittest.skipIf(os.name == 'nt', "shims are POSIX shell scripts")
+    def test_export_to_nas_is_replicated_from_the_target(self):
+        with tempfile.TemporaryDirectory() as root:
+            environment, summary_directory = build_environment(root, vm_count=2, latency={'export': 0, 'snapshot': 0},
+                                                               settings={('Export', 'target'): 'nas'})
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vm_process.py')],
+                           env=environment, cwd=root, check=True, capture_output=True)
+            for directory in (os.path.join('nas', 'Daily'), os.path.join('local', 'Daily'), os.path.join('onedrive', 'Daily')):
+                self.assertEqual(len(os.listdir(os.path.join(root, directory))), 2, directory)
+            summary_file, = os.listdir(summary_directory)
+            with open(os.path.join(summary_directory, summary_file)) as f:
+                phases = json.load(f)['phases']
+            sources = {phase['labels']['source'] for phase in phases if phase['phase'] == 'copy' and phase['labels']['source'].endswith('Daily')}
+            self.assertEqual(sources, {os.path.join(root, 'nas', 'Daily')})
+
+    @unittest.skipIf(os.name == 'nt', "shims are POSIX shell scripts")
+    def test_exports_reach_an_extra_s3_target(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = os.path.join(root, 'minio')
+            environment, _ = build_environment(root, vm_count=2, latency={'export': 0, 'snapshot': 0}, settings={
+                ('Target offsite', 'type'): 's3', ('Target offsite', 'bucket'): 'backups',
+                ('Target offsite', 'endpoint_url'): 'file://' + store, ('Target offsite', 'streams'): '2'})
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vm_process.py')],
+                           env=environment, cwd=root, check=True, capture_output=True)
+            self.assertEqual(sorted(os.listdir(os.path.join(store, 'backups'))), sorted(os.listdir(os.path.join(root, 'local', 'Daily'))))
+
+    @unittest.skipIf(os.name == 'nt', "shims are POSIX shell scripts")
+    def test_segmented_exports_reassemble(self):
+        with tempfile.TemporaryDirectory() as root:
+            environment, _ = build_environment(root, vm_count=1, latency={'export': 0, 'snapshot': 0}, export_size_mb=3,
+                                               settings={('Segments', 'enabled'): 'true', ('Segments', 'segment_size_mb'): '1'})
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vm_process.py')],
+                           env=environment, cwd=root, check=True, capture_output=True)
+            export_name, = os.listdir(os.path.join(root, 'local', 'Daily'))
+            for destination in ('nas', 'onedrive'):
+                segments_directory = os.path.join(root, destination, 'Daily', export_name + '.segments')
+                self.assertEqual(sorted(os.listdir(segments_directory)), ['manifest.json', 'part0001', 'part0002', 'part0003'])
+            output_file = os.path.join(root, 'restored.ova')
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vmbackup.py'), 'reassemble', segments_directory,
+                            '--output', output_file], check=True, capture_output=True)
+            self.assertEqual(os.path.getsize(output_file), os.path.getsize(os.path.join(root, 'local', 'Daily', export_name)))
+
+    @unittest.skipIf(os.name == 'nt', "shims are POSIX shell scripts")
+    def test_restore_imports_the_newest_verified_export(self):
+        with tempfile.TemporaryDirectory() as root:
+            environment, _ = build_environment(root, vm_count=1, latency={'export': 0, 'snapshot': 0, 'import': 0})
+            vmbackup = [sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vmbackup.py')]
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vm_process.py')],
+                           env=environment, cwd=root, check=True, capture_output=True)
+            unverified = subprocess.run(vmbackup + ['restore', 'BenchVM000', '--source', 'nas'], env=environment, cwd=root, capture_output=True)
+            self.assertEqual(unverified.returncode, 1)
+            subprocess.run(vmbackup + ['verify'], env=environment, cwd=root, check=True, capture_output=True)
+            restored = subprocess.run(vmbackup + ['restore', 'BenchVM000', '--source', 'nas', '--name', 'Restored'],
+                                      env=environment, cwd=root, check=True, capture_output=True, text=True)
+            self.assertIn(os.path.join(root, 'nas', 'Daily'), restored.stdout)
+            self.assertIn('total', restored.stdout)
+            with open(environment['FAKE_VBOX_STATE']) as f:
+                vms = json.load(f)['vms']
+            self.assertEqual(vms['Restored']['state'], 'poweroff')
+            self.assertFalse(os.path.exists(os.path.join(root, 'local', 'Restore', 'Restored')))
+
+class TestColdStart(unittest.TestCase):
+
+    def test_quick_commands_do_not_import_the_command_engine(self):
+        probe = "import sys, checkvmrunning, vm_watchdog; print(sorted(set(sys.modules) & {'asyncio', 'sqlite3', 'zipfile'}))"
+        output = subprocess.run([sys.executable, '-c', probe], cwd=SCRIPT_DIRECTORY, check=True, capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+from async_exec import CommandEngine
+from io_devices import get_device, get_command_paths
+
+SLEEP = [sys.executable, '-c', 'import time; time.sleep(0.3)']
+
+class TestIODevices(unittest.TestCase):
+
+    def test_device_of_paths(self):
+        self.assertEqual(get_device('\\\\NAS\\Backups\\Daily\\vm.ova'), '\\\\nas\\backups')
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(get_device(os.path.join(directory, 'not', 'created', 'yet')), get_device(directory))
+
+    def test_command_paths(self):
+        self.assertEqual(get_command_paths(['xcopy', 'C:\\Daily', '\\\\NAS\\Daily', '/E', '/I', '/Y']), ['C:\\Daily', '\\\\NAS\\Daily'])
+        self.assertEqual(get_command_paths(['VBoxManage', 'export', 'vm', '--output=C:\\Daily\\vm.ova']), ['C:\\Daily\\vm.ova'])
+        self.assertEqual(get_command_paths(['VBoxManage', 'startvm', 'vm']), [])
+
+    def test_device_budget_queues_streams(self):
+        engine = CommandEngine(device_streams={'disk': 1}, device_overrides={'fast': 2})
+        self.addCleanup(lambda: engine.loop.call_soon_threadsafe(engine.loop.stop))
+
+        def run_together(devices):
+            async def gather():
+                await asyncio.gather(*(engine.run(SLEEP, devices=[device]) for device in devices))
+            start = time.perf_counter()
+            engine.call(gather())
+            return time.perf_counter() - start
+
+        self.assertGreater(run_together(['slow', 'slow']), 0.55)
+        self.assertLess(run_together(['fast', 'fast']), 0.55)
+        report = engine.device_report()
+        self.assertEqual(report['slow']['max_streams'], 1)
+        self.assertEqual(report['fast']['max_streams'], 2)
+        self.assertGreater(report['slow']['wait_seconds'], 0.2)
+        self.assertGreater(report['slow']['busy_seconds'], 0.55)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import gzip
+import zipfile
+import datetime
+import tempfile
+import unittest
+from vm_config import LogArchiveConfig
+from log_archive import archive_logs, search_logs, read_index, prune_archives
+
+TODAY = datetime.date(2024, 3, 3)
+
+class TestLogArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logs = self.directory.name
+        self.script_logs = os.path.join(self.logs, 'vmmaintenance')
+        os.makedirs(self.script_logs)
+        for day in ('2024-02-28', '2024-03-01', '2024-03-02', '2024-03-03'):
+            with open(os.path.join(self.script_logs, f'{day}_vmmaintenance.log'), 'w') as f:
+                f.write(f"{day} 22:00:00,000 [INFO]: started\n")
+                f.write(f"{day} 23:00:00,000 [ERROR]: export failed on {day}\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_compresses_finished_logs_and_packs_older_days(self):
+        counts = archive_logs(self.logs, LogArchiveConfig(pack_after_days=2), TODAY)
+        self.assertEqual(counts, {'compressed': 3, 'packed': 2, 'pruned': 0})
+        self.assertEqual(sorted(os.listdir(self.script_logs)),
+                         ['2024-03-02_vmmaintenance.log.gz', '2024-03-03_vmmaintenance.log'])
+        archive = os.path.join(self.logs, 'archive', 'vmmaintenance')
+        with zipfile.ZipFile(os.path.join(archive, '2024-02.zip')) as packed:
+            member = packed.getinfo('2024-02-28_vmmaintenance.log.gz')
+            self.assertEqual(member.compress_type, zipfile.ZIP_STORED)
+            self.assertIn(b'export failed', gzip.decompress(packed.read(member)))
+        index = read_index(os.path.join(archive, '2024-03.index.json'))
+        self.assertEqual(index['2024-03-01_vmmaintenance.log.gz']['errors'], 1)
+        self.assertEqual(index['2024-03-01_vmmaintenance.log.gz']['lines'], 2)
+        # a second pass changes nothing
+        self.assertEqual(archive_logs(self.logs, LogArchiveConfig(pack_after_days=2), TODAY),
+                         {'compressed': 0, 'packed': 0, 'pruned': 0})
+
+    def test_leaves_logs_of_the_running_process_alone(self):
+        # A run started before midnight still writes yesterday's log and events.
+        running = os.path.join(self.script_logs, '2024-03-02_vmmaintenance.log')
+        events = os.path.join(self.script_logs, '2024-03-02_vmmaintenance.events.jsonl')
+        with open(events, 'w') as f:
+            f.write('{}\n')
+        old = datetime.datetime(2024, 3, 1, 23).timestamp()
+        os.utime(os.path.join(self.script_logs, '2024-03-01_vmmaintenance.log'), (old, old))
+        os.utime(os.path.join(self.script_logs, '2024-02-28_vmmaintenance.log'), (old, old))
+        counts = archive_logs(self.logs, LogArchiveConfig(pack_after_days=5), TODAY, active_paths=[running],
+                              modified_since=datetime.datetime(2024, 3, 2, 22).timestamp())
+        self.assertEqual(counts['compressed'], 2)
+        self.assertTrue(os.path.exists(running))
+        self.assertTrue(os.path.exists(events))
+
+    def test_does_not_replace_an_existing_compressed_log(self):
+        path = os.path.join(self.script_logs, '2024-03-01_vmmaintenance.log')
+        with gzip.open(path + '.gz', 'wb') as f:
+            f.write(b'first-half\n')
+        archive_logs(self.logs, LogArchiveConfig(pack_after_days=5), TODAY)
+        self.assertTrue(os.path.exists(path))
+        with gzip.open(path + '.gz') as f:
+            self.assertEqual(f.read(), b'first-half\n')
+
+    def test_search_reads_plain_compressed_and_archived_logs(self):
+        archive_logs(self.logs, LogArchiveConfig(pack_after_days=2), TODAY)
+        found = [line for _, line in search_logs(self.logs, r'\[ERROR\]')]
+        self.assertEqual([line[:10] for line in found], ['2024-02-28', '2024-03-01', '2024-03-02', '2024-03-03'])
+        since = [line for _, line in search_logs(self.logs, 'export failed', since=datetime.date(2024, 3, 2))]
+        self.assertEqual(len(since), 2)
+        self.assertEqual(list(search_logs(self.logs, 'started', name='restart')), [])
+
+    def test_prunes_archives_older_than_keep_months(self):
+        archive_logs(self.logs, LogArchiveConfig(pack_after_days=2), TODAY)
+        archive = os.path.join(self.logs, 'archive')
+        self.assertEqual(prune_archives(archive, 1, datetime.date(2024, 4, 10)), 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(archive, 'vmmaintenance'))), ['2024-03.index.json', '2024-03.zip'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import json
+import datetime
+import tempfile
+import unittest
+from vm_config import LogArchiveConfig
+from log_archive import archive_logs
+from log_index import update_index, query_index
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logs = os.path.join(self.directory.name, 'logs')
+        self.database = os.path.join(self.directory.name, 'index.sqlite')
+        os.makedirs(os.path.join(self.logs, 'vmmaintenance'))
+        self.log_file = os.path.join(self.logs, 'vmmaintenance', '2024-03-01_vmmaintenance.log')
+        with open(self.log_file, 'w') as f:
+            f.write("2024-03-01 22:00:00,000 [INFO]: Processing VM: 'Windows11P6'\n")
+            f.write("2024-03-01 22:05:00,000 [ERROR]: Export of 'Windows11P6' failed: disk full\n")
+            f.write("Traceback (most recent call last):\n")
+            f.write("2024-03-01 22:06:00,000 [WARNING]: Copy to NAS was slow\n")
+        events = [
+            {'time': '2024-03-01T22:05:00', 'vm': 'Windows11P6', 'phase': 'export', 'status': 'failed', 'error': 'disk full', 'labels': {}},
+            {'time': '2024-03-01T22:05:00', 'vm': None, 'phase': 'log', 'status': 'error', 'error': 'duplicate of the text log', 'labels': {}},
+            {'time': '2024-03-01T22:30:00', 'vm': 'Ubuntu', 'phase': 'export', 'status': 'ok', 'error': None, 'labels': {}},
+        ]
+        with open(os.path.join(self.logs, 'vmmaintenance', '2024-03-01_vmmaintenance.events.jsonl'), 'w') as f:
+            f.writelines(json.dumps(event) + '\n' for event in events)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_filters_by_text_vm_phase_level_and_date(self):
+        self.assertEqual(update_index(self.database, self.logs, ['Windows11P6', 'Ubuntu'])['entries'], 5)
+        self.assertCountEqual([entry['message'] for entry in query_index(self.database, 'disk AND full', level='ERROR')],
+                         ["Export of 'Windows11P6' failed: disk full\nTraceback (most recent call last):", 'export failed disk full'])
+        self.assertEqual(len(query_index(self.database, vm='Windows11P6')), 3)
+        self.assertEqual([entry['vm'] for entry in query_index(self.database, phase='export')], ['Windows11P6', 'Ubuntu'])
+        self.assertEqual(len(query_index(self.database, level='warning')), 3)
+        self.assertEqual(query_index(self.database, since=datetime.date(2024, 3, 2)), [])
+        self.assertEqual(len(query_index(self.database, until=datetime.date(2024, 3, 1))), 5)
+
+    def test_updates_are_incremental_and_survive_archiving(self):
+        update_index(self.database, self.logs)
+        with open(self.log_file, 'a') as f:
+            f.write("2024-03-01 23:00:00,000 [INFO]: Finished\n2024-03-01 23:00:01,000 [INFO]: half writ")
+        self.assertEqual(update_index(self.database, self.logs)['entries'], 1)
+        with open(self.log_file, 'a') as f:
+            f.write("ten\n")
+        archive_logs(self.logs, LogArchiveConfig(pack_after_days=1), datetime.date(2024, 3, 3))
+        self.assertEqual(update_index(self.database, self.logs), {'sources': 2, 'entries': 1, 'removed': 0})
+        self.assertEqual(query_index(self.database, 'written')[0]['message'], 'half written')
+        self.assertEqual(update_index(self.database, self.logs), {'sources': 0, 'entries': 0, 'removed': 0})
+        self.assertEqual(len(query_index(self.database)), 7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import queue
+import logging
+import tempfile
+import unittest
+from log_pipeline import BoundedQueueHandler, SampledLog, start_logging, flush_logging, stop_logging
+
+class TestLogPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        stop_logging()
+        self.directory.cleanup()
+
+    def test_repeated_start_keeps_one_handler(self):
+        log_file_path = os.path.join(self.directory.name, 'run.log')
+        self.assertTrue(start_logging(log_file_path))
+        self.assertFalse(start_logging(log_file_path))
+        queue_handlers = [handler for handler in logging.getLogger().handlers if isinstance(handler, BoundedQueueHandler)]
+        self.assertEqual(len(queue_handlers), 1)
+        logging.info("written once")
+        flush_logging()
+        with open(log_file_path) as f:
+            self.assertEqual(f.read().count("written once"), 1)
+
+    def test_full_queue_drops_info_but_keeps_warnings(self):
+        handler = BoundedQueueHandler(queue.Queue(1))
+        handler.enqueue(logging.makeLogRecord({'levelno': logging.INFO, 'msg': 'first'}))
+        handler.enqueue(logging.makeLogRecord({'levelno': logging.INFO, 'msg': 'dropped'}))
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.queue.get_nowait().msg, 'first')
+        handler.enqueue(logging.makeLogRecord({'levelno': logging.WARNING, 'msg': 'kept'}))
+        self.assertEqual(handler.queue.get_nowait().msg, 'kept')
+
+    def test_sampled_log_summarises_items(self):
+        with self.assertLogs(level='DEBUG') as logs:
+            with SampledLog("Files checked", every=2) as checked:
+                for name in ('a', 'b', 'c'):
+                    checked.item(f"Checking {name}")
+        info = [record.getMessage() for record in logs.records if record.levelno == logging.INFO]
+        self.assertEqual(info, ["Files checked: 2 so far, latest: Checking b", "Files checked: 3 in total."])
+        self.assertEqual(len([record for record in logs.records if record.levelno == logging.DEBUG]), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import time
+import tempfile
+import unittest
+import threading
+import socketserver
+from dataclasses import dataclass
+from notifications import Outbox, Dispatcher, SMTPChannel, FileChannel, create_message, deliver_due, get_retry_delay
+
+@dataclass
+class Settings:
+    max_attempts: int = 3
+    retry_seconds: int = 60
+    max_retry_seconds: int = 600
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough SMTP to accept mail without TLS or login.
+    """
+
+    def reply(self, text):
+        self.wfile.write(text.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        for line in self.rfile:
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    data.append(data_line)
+                self.server.messages.append(b''.join(data))
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+class TestNotifications(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.outbox = Outbox(os.path.join(self.directory.name, 'outbox'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_smtp_batch_reuses_one_connection(self):
+        server = FakeSMTPServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            channel = SMTPChannel('127.0.0.1', server.server_address[1], from_email='a@example.com',
+                                  to_email='b@example.com', starttls=False, timeout=5)
+            self.outbox.add(create_message('smtp', 'Digest', 'body', '<b>body</b>', [('run.log.gz', b'\x1f\x8b')]))
+            self.outbox.add(create_message('smtp', 'Alert', 'VM stopped'))
+            self.assertEqual(deliver_due(self.outbox, {'smtp': channel}, Settings()), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 2)
+        self.assertIn(b'filename="run.log.gz"', server.messages[0])
+        self.assertEqual(self.outbox.messages(), [])
+
+    def test_failed_delivery_backs_off_then_gives_up(self):
+        channel = SMTPChannel('127.0.0.1', 1, starttls=False, timeout=1)  # nothing listens on port 1
+        self.outbox.add(create_message('smtp', 'Digest', 'body'))
+        now = time.time()
+        self.assertEqual(deliver_due(self.outbox, {'smtp': channel}, Settings(), now), 0)
+        message, = self.outbox.messages()
+        self.assertEqual((message['attempts'], message['next_attempt']), (1, now + 60))
+        self.assertEqual(deliver_due(self.outbox, {'smtp': channel}, Settings(), now + 1), 0)  # not due yet
+        self.assertEqual(self.outbox.messages()[0]['attempts'], 1)
+        deliver_due(self.outbox, {'smtp': channel}, Settings(), now + 60)
+        deliver_due(self.outbox, {'smtp': channel}, Settings(), now + 1000)
+        self.assertEqual(self.outbox.messages(), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.outbox.directory, 'failed'))), 1)
+        self.assertEqual([get_retry_delay(attempts, Settings()) for attempts in (1, 2, 5)], [60, 120, 600])
+
+    def test_background_dispatcher_delivers_to_file_channel(self):
+        target = os.path.join(self.directory.name, 'delivered')
+        dispatcher = Dispatcher(self.outbox, {'file': FileChannel(target)}, Settings())
+        message = create_message('file', 'Digest', 'body', attachments=[('run.log.gz', b'data')])
+        self.outbox.add(message)
+        dispatcher.wake()
+        self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(sorted(os.listdir(target)), [f"{message['id']}.txt", f"{message['id']}_run.log.gz"])
+
+    def test_message_is_sent_by_only_one_process(self):
+        target = os.path.join(self.directory.name, 'delivered')
+        other = Outbox(self.outbox.directory, owner='other')
+        message = create_message('file', 'Digest', 'body')
+        self.outbox.add(message)
+        claimed = other.claim(message)
+        self.assertEqual(claimed['id'], message['id'])
+        self.assertIsNone(self.outbox.claim(message))
+        self.assertEqual(deliver_due(self.outbox, {'file': FileChannel(target)}, Settings()), 0)
+        self.assertEqual(deliver_due(other, {'file': FileChannel(target)}, Settings()), 0)  # already claimed
+        other.remove(claimed)
+        self.assertEqual(self.outbox.messages(), [])
+
+    def test_stale_claim_returns_to_outbox(self):
+        message = create_message('file', 'Digest', 'body')
+        self.outbox.add(message)
+        Outbox(self.outbox.directory, owner='died').claim(message)
+        self.assertEqual(self.outbox.messages(), [])
+        self.assertEqual(self.outbox.release_stale_claims(time.time() + 60), 0)
+        self.assertEqual(self.outbox.release_stale_claims(time.time() + 3600), 1)
+        self.assertEqual([m['id'] for m in self.outbox.messages()], [message['id']])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from ova_segments import (SegmentError, build_manifest, get_segments_directory, start_segmented_copy, finish_segmented_copy,
+                          write_segment, is_complete, reassemble, find_missing_segments)
+
+class TestOvaSegments(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        self.export_file = os.path.join(self.root, 'VM_2024-01-31.ova')
+        with open(self.export_file, 'wb') as f:
+            f.write(os.urandom(2500))
+        self.segments_directory = get_segments_directory(os.path.join(self.root, 'nas'), 'VM_2024-01-31.ova')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def copy_all(self, manifest):
+        for segment in start_segmented_copy(self.segments_directory, manifest):
+            write_segment(self.export_file, segment, self.segments_directory)
+        finish_segmented_copy(self.segments_directory)
+
+    def test_split_and_reassemble(self):
+        manifest = build_manifest(self.export_file, 1000)
+        self.assertEqual([segment['size'] for segment in manifest['segments']], [1000, 1000, 500])
+        self.assertFalse(is_complete(self.segments_directory))
+        self.copy_all(manifest)
+        self.assertTrue(is_complete(self.segments_directory, 2500))
+        output_file = os.path.join(self.root, 'restored.ova')
+        self.assertEqual(reassemble(self.segments_directory, output_file), 2500)
+        with open(self.export_file, 'rb') as original, open(output_file, 'rb') as restored:
+            self.assertEqual(original.read(), restored.read())
+
+    def test_only_missing_segments_are_copied_again(self):
+        manifest = build_manifest(self.export_file, 1000)
+        first, second, third = start_segmented_copy(self.segments_directory, manifest)
+        write_segment(self.export_file, first, self.segments_directory)
+        write_segment(self.export_file, third, self.segments_directory)
+        self.assertFalse(is_complete(self.segments_directory))  # no manifest until finished
+        self.assertEqual(start_segmented_copy(self.segments_directory, manifest), [second])
+
+    def test_a_different_export_starts_over(self):
+        self.copy_all(build_manifest(self.export_file, 1000))
+        with open(self.export_file, 'r+b') as f:
+            f.write(b'changed')
+        manifest = build_manifest(self.export_file, 1000)
+        self.assertEqual(len(start_segmented_copy(self.segments_directory, manifest)), 3)
+        self.assertFalse(is_complete(self.segments_directory))
+
+    def test_damaged_segment_fails_reassembly(self):
+        manifest = build_manifest(self.export_file, 1000)
+        self.copy_all(manifest)
+        with open(os.path.join(self.segments_directory, 'part0002'), 'r+b') as f:
+            f.write(b'x')
+        self.assertEqual(find_missing_segments(manifest, self.segments_directory), [])  # same size
+        output_file = os.path.join(self.root, 'restored.ova')
+        with self.assertRaises(SegmentError):
+            reassemble(self.segments_directory, output_file)
+        self.assertFalse(os.path.exists(output_file))
+        self.assertFalse(os.path.exists(output_file + '.partial'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from progress import OutputBuffer, VBoxProgressParser, CopyProgressParser
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestOutputBuffer(unittest.TestCase):
+
+    def test_keeps_only_recent_lines(self):
+        buffer = OutputBuffer(max_lines=3)
+        completed = buffer.feed('a\nb\r\nc\nd\ne')
+        self.assertEqual(completed, ['a', 'b', 'c', 'd'])
+        self.assertEqual(buffer.close(), ['e'])
+        self.assertEqual(buffer.dropped_lines, 2)
+        self.assertEqual(buffer.text(), '[... 2 earlier lines not kept ...]\nc\nd\ne\n')
+
+    def test_lines_split_across_chunks(self):
+        buffer = OutputBuffer()
+        self.assertEqual(buffer.feed('hel'), [])
+        self.assertEqual(buffer.feed('lo\nwor'), ['hello'])
+        self.assertEqual(buffer.close(), ['wor'])
+
+class TestProgressParsers(unittest.TestCase):
+
+    def test_vbox_progress_reports_steps_with_eta(self):
+        clock, events = FakeClock(), []
+        parser = VBoxProgressParser('export', report=events.append, min_step=20, clock=clock)
+        clock.now = 10
+        parser.feed_text('0%...10%...')
+        clock.now = 20
+        parser.feed_text('20%...30')
+        self.assertEqual([event.percent for event in events], [20])
+        self.assertAlmostEqual(events[0].eta, 80)
+        parser.feed_text('%...100%\n')
+        self.assertEqual(events[-1].percent, 100)
+        self.assertIsNone(events[-1].eta)
+
+    def test_copy_progress_counts_bytes(self):
+        events = []
+        parser = CopyProgressParser('copy', {'a.ova': 300, 'b.ova': 100}, report=events.append, min_step=1)
+        parser.feed_line('C:\\Daily\\A.ova -> D:\\Daily\\A.ova')
+        parser.feed_line('1 File(s) copied')
+        self.assertEqual([event.percent for event in events], [75])
+
+    def test_copy_progress_counts_same_named_files_in_subdirectories(self):
+        events = []
+        with tempfile.TemporaryDirectory() as directory:
+            for subdirectory, size in (('Logs', 100), ('Snapshots', 300)):
+                os.makedirs(os.path.join(directory, subdirectory))
+                with open(os.path.join(directory, subdirectory, 'VBox.log'), 'wb') as f:
+                    f.write(b'x' * size)
+            parser = CopyProgressParser.for_directory('copy', directory, report=events.append, min_step=1)
+        self.assertEqual(parser.total_bytes, 400)
+        parser.feed_line('C:\\VMs\\Snapshots\\VBox.log -> D:\\VMs\\Snapshots\\VBox.log')
+        parser.feed_line('C:\\VMs\\Logs\\VBox.log -> D:\\VMs\\Logs\\VBox.log')
+        self.assertEqual([event.percent for event in events], [75, 100])
+
+    def test_copy_progress_looks_up_paths_below_the_source(self):
+        events = []
+        with tempfile.TemporaryDirectory() as directory:
+            for index in range(2000):
+                os.makedirs(os.path.join(directory, str(index)))
+                with open(os.path.join(directory, str(index), 'run.log'), 'wb') as f:
+                    f.write(b'x')
+            parser = CopyProgressParser.for_directory('copy', directory, report=events.append, min_step=50)
+            for index in reversed(range(2000)):
+                parser.feed_line(f"{os.path.join(directory, str(index), 'run.log')} -> D:\\logs\\{index}\\run.log")
+        self.assertEqual((parser.copied_bytes, parser.file_sizes), (2000, {}))
+        self.assertEqual([event.percent for event in events], [50, 100])
+
+if __name__ == '__main__':
+    unittest.main()
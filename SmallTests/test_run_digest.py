@@ -0,0 +1,50 @@
+import os
+import gzip
+import tempfile
+import unittest
+from run_digest import tail_lines, gzip_file, build_digest
+
+SUMMARY = {
+    'status': 'failed', 'duration_ms': 3723000,
+    'vms': {'A': {'status': 'ok', 'duration_ms': 60000, 'bytes': 2 * 1024 ** 3, 'phases': {'export': 'ok'}},
+            'B': {'status': 'failed', 'duration_ms': 1000, 'bytes': 0, 'phases': {'power_off': 'ok', 'export': 'failed'}}},
+    'copies': {'count': 4, 'failed': 1, 'bytes': 1024 ** 2},
+    'failed_phases': ['export vm=B'], 'regressions': [], 'errors': ["Export of B failed"],
+}
+
+class TestRunDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file_path = os.path.join(self.directory.name, 'run.log')
+        with open(self.log_file_path, 'w') as f:
+            f.writelines(f"line {number}\n" for number in range(20000))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_tail_reads_only_the_end(self):
+        self.assertEqual(tail_lines(self.log_file_path, 3), ['line 19997', 'line 19998', 'line 19999'])
+        self.assertEqual(len(tail_lines(self.log_file_path, 5000)), 5000)
+
+    def test_gzip_round_trip_and_size_limit(self):
+        with open(self.log_file_path, 'rb') as f:
+            self.assertEqual(gzip.decompress(gzip_file(self.log_file_path)), f.read())
+        self.assertIsNone(gzip_file(self.log_file_path, max_bytes=10))
+
+    def test_digest_lists_errors_before_the_vm_table(self):
+        subject, text, page = build_digest(SUMMARY, ['last line'], "Log file for 2024-01-31")
+        self.assertEqual(subject, "Log file for 2024-01-31: FAILED")
+        self.assertLess(text.index("Export of B failed"), text.index("VM "))
+        self.assertIn("2.00 GB", text)
+        self.assertIn("1:02:03", text)
+        self.assertIn("<td>export</td>", page)
+        self.assertTrue(text.endswith('last line'))
+
+    def test_digest_without_summary_uses_error_lines(self):
+        subject, text, _ = build_digest(None, ["2024 [INFO]: fine", "2024 [ERROR]: broke"], "Restart")
+        self.assertEqual(subject, "Restart: ERRORS")
+        self.assertIn("Errors:\n  2024 [ERROR]: broke", text)
+
+if __name__ == '__main__':
+    unittest.main()
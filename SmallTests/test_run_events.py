@@ -0,0 +1,54 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+from run_metrics import RunMetrics
+from run_events import start_event_log, stop_event_log, build_run_summary, write_run_summary, read_run_summary, get_event_paths
+
+class TestRunEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file_path = os.path.join(self.directory.name, '2024-01-31_vmmaintenance.log')
+        self.metrics = RunMetrics()
+        self.event_log = start_event_log(self.log_file_path, self.metrics)
+
+    def tearDown(self):
+        stop_event_log()
+        self.directory.cleanup()
+
+    def read_events(self):
+        with open(get_event_paths(self.log_file_path)[0]) as f:
+            return [json.loads(line) for line in f]
+
+    def test_phases_and_errors_become_events(self):
+        with self.metrics.phase('export', vm='A') as phase:
+            phase['bytes'] = 100
+        with self.assertRaises(RuntimeError):
+            with self.metrics.phase('copy', source='C:\\Daily', destination='N:\\Daily'):
+                raise RuntimeError("share went away")
+        logging.error("Something broke")
+        export, copy, error = self.read_events()
+        self.assertEqual((export['vm'], export['phase'], export['status'], export['bytes']), ('A', 'export', 'ok', 100))
+        self.assertIsInstance(export['duration_ms'], int)
+        self.assertEqual((copy['status'], copy['error'], copy['labels']['destination']), ('failed', "share went away", 'N:\\Daily'))
+        self.assertEqual((error['phase'], error['error']), ('log', "Something broke"))
+
+    def test_summary_reports_vm_outcomes(self):
+        with self.metrics.phase('export', vm='A'):
+            pass
+        with self.metrics.phase('export', vm='B') as phase:
+            phase['status'] = 'failed'
+        with self.metrics.phase('copy', source='C:\\Daily', destination='N:\\Daily') as phase:
+            phase['bytes'] = 50
+        summary = build_run_summary(self.metrics.summary(), self.event_log)
+        self.assertEqual(summary['status'], 'failed')
+        self.assertEqual({vm: entry['status'] for vm, entry in summary['vms'].items()}, {'A': 'ok', 'B': 'failed'})
+        self.assertEqual(summary['copies'], {'count': 1, 'failed': 0, 'bytes': 50})
+        self.assertEqual(summary['failed_phases'], ['export vm=B'])
+        write_run_summary(self.log_file_path, summary)
+        self.assertEqual(read_run_summary(self.log_file_path), summary)
+
+if __name__ == '__main__':
+    unittest.main()
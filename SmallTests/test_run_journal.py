@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+import datetime
+from run_journal import RunJournal, read_entries, start_journal, find_unfinished_journal, is_resumable
+
+class TestRunJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_steps_are_written_to_disk(self):
+        journal = start_journal(self.directory.name, keep_runs=5)
+        with journal.step('export', 'VM1'):
+            pass
+        with self.assertRaises(RuntimeError):
+            with journal.step('export', 'VM2'):
+                raise RuntimeError("hung")
+        entries = read_entries(journal.path)
+        self.assertEqual([(e['vm'], e['step'], e['status']) for e in entries[1:]],
+                         [('VM1', 'export', 'started'), ('VM1', 'export', 'done'),
+                          ('VM2', 'export', 'started'), ('VM2', 'export', 'failed')])
+
+    def test_resume_finds_vms_left_off_and_ignores_torn_line(self):
+        journal = start_journal(self.directory.name, keep_runs=5)
+        for vm in ('VM1', 'VM2'):
+            journal.record('power_off', 'done', vm)
+        journal.record('export', 'done', 'VM1')
+        journal.record('power_on', 'done', 'VM1')
+        with open(journal.path, 'a') as f:
+            f.write('{"time": "2024-01-31T2')
+        resumed = find_unfinished_journal(self.directory.name)
+        self.assertEqual(resumed.path, journal.path)
+        self.assertEqual(resumed.vms_left_off(), ['VM2'])
+        self.assertTrue(resumed.is_done('export', 'VM1'))
+        self.assertFalse(resumed.is_done('export', 'VM2'))
+        self.assertEqual(len(read_entries(journal.path)), 5)  # finding it does not write to it
+        resumed.resume()
+        self.assertEqual(read_entries(journal.path)[-1]['status'], 'resumed')
+
+    def test_finished_run_is_not_resumed(self):
+        journal = start_journal(self.directory.name, keep_runs=5)
+        journal.record('run', 'done')
+        self.assertIsNone(find_unfinished_journal(self.directory.name))
+
+    def test_only_recent_runs_are_resumable(self):
+        journal = RunJournal(os.path.join(self.directory.name, '2024-01-31_220000.jsonl'))
+        self.assertTrue(is_resumable(journal, datetime.datetime(2024, 1, 31, 23, 0)))
+        self.assertTrue(is_resumable(journal, datetime.datetime(2024, 2, 1, 7, 0)))
+        self.assertFalse(is_resumable(journal, datetime.datetime(2024, 2, 2, 7, 0)))
+        self.assertFalse(is_resumable(RunJournal(os.path.join(self.directory.name, 'copy.jsonl'))))
+
+    def test_old_journals_are_removed(self):
+        for index in range(4):
+            open(os.path.join(self.directory.name, f"2024-01-0{index + 1}_220000.jsonl"), 'w').close()
+        start_journal(self.directory.name, keep_runs=2)
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import json
+import tempfile
+import unittest
+from vm_config import MetricsConfig
+from run_metrics import RunMetrics, find_regressions, render_prometheus, write_run_metrics
+
+class TestRunMetrics(unittest.TestCase):
+
+    def test_phase_records_bytes_and_failures(self):
+        metrics = RunMetrics()
+        with metrics.phase('export', vm='Windows11P6') as phase:
+            phase['bytes'] = 1024 * 1024
+        with self.assertRaises(RuntimeError):
+            with metrics.phase('copy', destination='NAS'):
+                raise RuntimeError("share unavailable")
+        export, copy = metrics.phases
+        self.assertEqual(export['status'], 'ok')
+        self.assertEqual(export['bytes'], 1024 * 1024)
+        self.assertEqual(copy['status'], 'failed')
+        text = render_prometheus(metrics.summary())
+        self.assertIn('vmbackup_phase_bytes{phase="export",status="ok",vm="Windows11P6"} 1048576', text)
+
+    def test_find_regressions_against_median(self):
+        previous = [{'phases': [{'phase': 'export', 'labels': {'vm': 'A'}, 'status': 'ok', 'seconds': seconds}]}
+                    for seconds in (100, 110, 120)]
+        current = {'phases': [{'phase': 'export', 'labels': {'vm': 'A'}, 'status': 'ok', 'seconds': 300}]}
+        regressions = find_regressions(current, previous, factor=1.5, min_seconds=60)
+        self.assertEqual(regressions, [{'phase': 'export vm=A', 'seconds': 300, 'median_seconds': 110}])
+        self.assertEqual(find_regressions(current, previous, factor=3, min_seconds=60), [])
+
+    def test_repeated_phases_render_as_one_series(self):
+        metrics = RunMetrics()
+        for _ in range(3):
+            with metrics.phase('copy', source='C:\\Daily', destination='N:\\Daily') as phase:
+                phase['bytes'] = 1024 * 1024
+        lines = [line for line in render_prometheus(metrics.summary()).splitlines() if line.startswith('vmbackup_phase_bytes{')]
+        self.assertEqual(lines, ['vmbackup_phase_bytes{destination="N:\\\\Daily",phase="copy",source="C:\\\\Daily",status="ok"} 3145728'])
+
+    def test_write_run_metrics_writes_textfile_and_summary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings = MetricsConfig(textfile_path=os.path.join(directory, 'vmbackup.prom'),
+                                     summary_directory=os.path.join(directory, 'runs'))
+            metrics = RunMetrics()
+            with metrics.phase('email'):
+                pass
+            write_run_metrics(settings, metrics)
+            self.assertTrue(os.path.exists(settings.textfile_path))
+            summary_file, = os.listdir(settings.summary_directory)
+            with open(os.path.join(settings.summary_directory, summary_file)) as f:
+                self.assertEqual(json.load(f)['phases'][0]['phase'], 'email')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import datetime
+import unittest
+from run_planner import RunPlanner, ewma, get_window_deadline, choose_deferrals
+
+def summary(*phases):
+    return {'phases': [{'phase': phase, 'labels': labels, 'seconds': seconds, 'bytes': size, 'status': 'ok'}
+                       for phase, labels, seconds, size in phases]}
+
+class TestRunPlanner(unittest.TestCase):
+
+    def test_ewma_follows_recent_runs(self):
+        self.assertAlmostEqual(ewma([100, 200], alpha=0.5), 150)
+        self.assertIsNone(ewma([]))
+
+    def test_estimates_from_history(self):
+        copy = {'source': 'C:\\Daily', 'destination': 'D:\\Daily'}
+        planner = RunPlanner([  # newest first
+            summary(('power_off', {'vm': 'A'}, 10, None), ('export', {'vm': 'A'}, 290, None), ('copy', copy, 100, 1000)),
+            summary(('export', {'vm': 'A'}, 100, None), ('copy', copy, 100, 1000)),
+        ], alpha=0.5)
+        self.assertAlmostEqual(planner.vm_downtime('A'), 200)
+        self.assertIsNone(planner.vm_downtime('B'))
+        self.assertAlmostEqual(planner.phase_seconds('copy', 2000, **copy), 200)  # 10 bytes/s, twice the data
+        self.assertAlmostEqual(planner.phase_seconds('copy', **copy), 100)
+
+    def test_repeated_phases_of_one_run_are_summed(self):
+        copy = {'source': 'C:\\Daily', 'destination': 'D:\\Daily'}
+        planner = RunPlanner([summary(('copy', copy, 30, 300), ('copy', copy, 70, 700))])
+        self.assertAlmostEqual(planner.phase_seconds('copy', **copy), 100)
+
+    def test_read_throughput_per_source(self):
+        planner = RunPlanner([summary(('copy', {'source': 'N:\\Daily', 'destination': 'C:\\Daily'}, 10, 1000),
+                                      ('copy', {'source': 'C:\\Daily', 'destination': 'O:\\Daily'}, 100, 1000))])
+        self.assertAlmostEqual(planner.read_throughput('N:\\Daily'), 100)
+        self.assertAlmostEqual(planner.read_throughput('C:\\Daily'), 10)
+        self.assertIsNone(planner.read_throughput('X:\\Daily'))
+
+    def test_window_deadline_crosses_midnight(self):
+        started = datetime.datetime(2024, 1, 31, 22, 0)
+        self.assertEqual(get_window_deadline('06:00', started), datetime.datetime(2024, 2, 1, 6, 0))
+        self.assertEqual(get_window_deadline('23:30', started), datetime.datetime(2024, 1, 31, 23, 30))
+        self.assertIsNone(get_window_deadline('', started))
+
+    def test_defers_monthly_before_offsite(self):
+        now = datetime.datetime(2024, 1, 31, 4, 0)
+        deadline = datetime.datetime(2024, 1, 31, 6, 0)
+        estimates = {'required': 3600, 'offsite': 1800, 'monthly': 3600}
+        self.assertEqual(choose_deferrals(now, deadline, estimates)[0], ['monthly'])
+        self.assertEqual(choose_deferrals(now, deadline, estimates, safety_factor=1.5)[0], ['monthly', 'offsite'])
+        self.assertEqual(choose_deferrals(now, deadline, estimates, defer=False)[0], [])
+
+if __name__ == '__main__':
+    unittest.main()
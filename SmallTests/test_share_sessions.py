@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+from vm_config import SharesConfig
+from share_sessions import ShareManager, NetUseBackend, LocalDirectoryBackend, get_share_root
+
+class CountingBackend(LocalDirectoryBackend):
+    """Local directory stand-in that counts connects and checks and can refuse to connect."""
+
+    def __init__(self):
+        self.connects = self.validations = 0
+        self.refuse = False
+
+    def connect(self, root):
+        self.connects += 1
+        return not self.refuse and super().connect(root)
+
+    def validate(self, root):
+        self.validations += 1
+        return super().validate(root)
+
+class TestShareSessions(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.share = os.path.join(self.directory.name, 'nas')
+        self.now = 0.0
+        self.backend = CountingBackend()
+        self.manager = ShareManager(SharesConfig(backend='net_use', revalidate_seconds=60, reconnect_attempts=2, reconnect_delay=0),
+                                    self.backend, clock=lambda: self.now, sleep=lambda seconds: None)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_share_root_of_unc_paths(self):
+        self.assertEqual(get_share_root(r'\\OFFICE-NAS\VM_Backups\Daily\x.ova'), r'\\OFFICE-NAS\VM_Backups')
+        self.assertEqual(get_share_root('//nas/share/Daily'), r'\\nas\share')
+
+    def test_checks_are_cached_until_revalidate_seconds(self):
+        self.assertTrue(self.manager.open(self.share))
+        self.assertEqual(self.backend.connects, 1)
+        checks = self.backend.validations
+        self.now = 30
+        self.assertTrue(self.manager.ensure(os.path.join(self.share, 'Daily')))
+        self.assertEqual(self.backend.validations, checks)
+        self.now = 61
+        self.assertTrue(self.manager.ensure(os.path.join(self.share, 'Daily')))
+        self.assertEqual(self.backend.validations, checks + 1)
+        self.assertEqual(self.backend.connects, 1)
+        self.assertTrue(self.manager.ensure(os.path.join(self.directory.name, 'elsewhere')))
+
+    def test_reconnects_when_the_share_is_gone(self):
+        self.manager.open(self.share)
+        shutil.rmtree(self.share)
+        self.now = 120
+        self.assertTrue(self.manager.ensure(self.share))
+        self.assertEqual(self.backend.connects, 2)
+        self.assertTrue(os.path.isdir(self.share))
+        shutil.rmtree(self.share)
+        self.backend.refuse = True
+        self.now = 240
+        self.assertFalse(self.manager.ensure(self.share))
+        self.assertEqual(self.backend.connects, 4)
+
+    @unittest.skipIf(os.name == 'nt', "replaces 'net' with a shell script")
+    def test_net_use_timeout_does_not_log_the_password(self):
+        bin_directory = os.path.join(self.directory.name, 'bin')
+        os.makedirs(bin_directory)
+        with open(os.path.join(bin_directory, 'net'), 'w') as f:
+            f.write('#!/bin/sh\nsleep 5\n')
+        os.chmod(os.path.join(bin_directory, 'net'), 0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = bin_directory + os.pathsep + path
+        try:
+            manager = ShareManager(SharesConfig(backend='net_use', reconnect_attempts=1), NetUseBackend('user', 'SECRET', 0.5))
+            with self.assertLogs(level='WARNING') as logs:
+                self.assertFalse(manager.open(r'\\nas\share'))
+        finally:
+            os.environ['PATH'] = path
+        self.assertIn('timed out', '\n'.join(logs.output))
+        self.assertNotIn('SECRET', '\n'.join(logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
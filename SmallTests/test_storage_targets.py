@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from storage_targets import LocalTarget, OneDriveTarget, S3Target, LocalObjectStore, ObjectStoreError, MIN_PART_SIZE
+
+class FailingObjectStore(LocalObjectStore):
+    """Object store stand-in that rejects the second part of every multipart upload."""
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == 2:
+            raise ObjectStoreError('InternalError', "part rejected")
+        return super().upload_part(Bucket, Key, UploadId, PartNumber, Body)
+
+class TestStorageTargets(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'vm.ova')
+        self.data = os.urandom(2 * MIN_PART_SIZE + 12345)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_local_target_copies_in_parallel_chunks(self):
+        target = LocalTarget('nas', os.path.join(self.directory.name, 'nas'), streams=4, chunk_size=1024 * 1024)
+        self.assertEqual(target.put(self.source, 'Daily/vm.ova'), len(self.data))
+        self.assertEqual(self.read(os.path.join(self.directory.name, 'nas', 'Daily', 'vm.ova')), self.data)
+        self.assertEqual([info.key for info in target.list('Daily/')], ['Daily/vm.ova'])
+        restored = os.path.join(self.directory.name, 'restored.ova')
+        target.get('Daily/vm.ova', restored)
+        self.assertEqual(self.read(restored), self.data)
+        target.delete('Daily/vm.ova')
+        self.assertIsNone(target.stat('Daily/vm.ova'))
+
+    def test_onedrive_target_does_not_rewrite_unchanged_files(self):
+        root = os.path.join(self.directory.name, 'OneDrive')
+        target = OneDriveTarget('office365', root)
+        self.assertEqual(target.put(self.source, 'vm.ova'), len(self.data))
+        self.assertEqual(target.put(self.source, 'vm.ova'), 0)
+        with open(self.source, 'ab') as f:
+            f.write(b'changed')
+        self.assertEqual(target.put(self.source, 'vm.ova'), len(self.data) + 7)
+        self.assertEqual(self.read(os.path.join(root, 'vm.ova')), self.data + b'changed')
+        with open(os.path.join(root, '~$other.ova.tmp'), 'wb') as f:
+            f.write(b'interrupted')
+        self.assertEqual([info.key for info in target.list()], ['vm.ova'])
+        self.assertEqual(target.stat('vm.ova').size, len(self.data) + 7)
+        self.assertFalse(target.is_cloud_only('vm.ova'))
+
+    def test_onedrive_target_checks_a_folder_from_one_listing(self):
+        root = os.path.join(self.directory.name, 'OneDrive')
+        target = OneDriveTarget('office365', root)
+        self.assertEqual(target.list_folder('Daily'), {})
+        target.put(self.source, 'Daily/vm.ova')
+        copies = target.list_folder('Daily')
+        self.assertEqual([info.key for info in copies.values()], ['Daily/vm.ova'])
+        self.assertTrue(target.is_unchanged(self.source, 'Daily/vm.ova', copies))
+        self.assertFalse(target.is_unchanged(self.source, 'Daily/other.ova', copies))
+        self.assertEqual(target.put(self.source, 'Daily/vm.ova', checked=True), len(self.data))
+
+    def test_s3_target_uses_multipart_uploads_and_ranged_reads(self):
+        store = LocalObjectStore(os.path.join(self.directory.name, 'minio'))
+        target = S3Target('offsite', store, 'backups', prefix='daily', streams=3, chunk_size=MIN_PART_SIZE)
+        target.put(self.source, 'vm.ova')
+        self.assertEqual(self.read(os.path.join(self.directory.name, 'minio', 'backups', 'daily', 'vm.ova')), self.data)
+        self.assertEqual(target.stat('vm.ova').size, len(self.data))
+        self.assertEqual([info.key for info in target.list()], ['vm.ova'])
+        restored = os.path.join(self.directory.name, 'restored.ova')
+        target.get('vm.ova', restored)
+        self.assertEqual(self.read(restored), self.data)
+        self.assertEqual(target.open('vm.ova').read(10), self.data[:10])
+        target.delete('vm.ova')
+        self.assertIsNone(target.stat('vm.ova'))
+
+    def test_failed_multipart_upload_is_aborted(self):
+        store = FailingObjectStore(os.path.join(self.directory.name, 'minio'))
+        target = S3Target('offsite', store, 'backups', streams=2, chunk_size=MIN_PART_SIZE)
+        with self.assertRaises(ObjectStoreError):
+            target.put(self.source, 'vm.ova')
+        self.assertIsNone(target.stat('vm.ova'))
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, 'minio', '.uploads')), [])
+
+if __name__ == '__main__':
+    unittest.main()
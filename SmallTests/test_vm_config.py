@@ -0,0 +1,89 @@
+import os
+import time
+import tempfile
+import unittest
+from vm_config import SECTIONS, ConfigError, load_config, get_config, clear_config_cache
+from settings_schema import CONFIG_SETTINGS, init_settings
+
+CONFIG_TEXT = """[Paths]
+virtual_box_path = {vbox}
+[VMDetails]
+vm_names = Windows11P6, Ubuntu - Moodle
+[SnapshotDetails]
+daily_retention = {retention}
+[Misc]
+days_in_month = 28
+"""
+
+class TestVMConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.directory.name, 'config.ini')
+        self.write_config(retention=3)
+        clear_config_cache()
+
+    def tearDown(self):
+        clear_config_cache()
+        self.directory.cleanup()
+
+    def write_config(self, retention):
+        with open(self.config_path, 'w') as f:
+            f.write(CONFIG_TEXT.format(vbox=self.directory.name, retention=retention))
+
+    def test_load_config_types_and_defaults(self):
+        config = load_config(self.config_path)
+        self.assertEqual(config.vm_details.vm_names, ('Windows11P6', 'Ubuntu - Moodle'))
+        self.assertEqual(config.snapshot_details.daily_retention, 3)
+        self.assertEqual(config.backup_details.monthly_retention, 90)
+        self.assertEqual(config.smtp.server, 'smtp-mail.outlook.com')
+
+    def test_invalid_integer_raises(self):
+        self.write_config(retention='three')
+        with self.assertRaises(ConfigError):
+            load_config(self.config_path)
+
+    def test_get_config_is_cached_until_file_changes(self):
+        first = get_config(self.config_path)
+        self.write_config(retention=5)
+        os.utime(self.config_path, (time.time() + 5, time.time() + 5))
+        self.assertIs(get_config(self.config_path), first)
+        reloaded = get_config(self.config_path, reload_on_change=True)
+        self.assertEqual(reloaded.snapshot_details.daily_retention, 5)
+
+    def test_per_vm_sections(self):
+        with open(self.config_path, 'a') as f:
+            f.write("[VM Ubuntu - Moodle]\npriority = 10\ndepends_on = Windows11P6\n")
+        config = load_config(self.config_path)
+        self.assertEqual(config.vm_options['Ubuntu - Moodle'].priority, 10)
+        self.assertEqual(config.vm_options['Ubuntu - Moodle'].depends_on, ('Windows11P6',))
+        with open(self.config_path, 'a') as f:
+            f.write("[VM Windows11P6]\ndepends_on = Ubuntu - Moodle\n")
+        with self.assertRaises(ConfigError):
+            load_config(self.config_path)
+
+    def test_schema_lists_every_config_key(self):
+        schema_keys = {(setting.section, setting.key) for setting in CONFIG_SETTINGS}
+        dataclass_keys = {(section_name, key) for section_name, (_, section_class) in SECTIONS.items()
+                          for key in section_class.__dataclass_fields__}
+        self.assertEqual(schema_keys, dataclass_keys)
+
+    def test_init_settings_writes_loadable_files_without_prompting(self):
+        config_path = os.path.join(self.directory.name, 'generated.ini')
+        env_path = os.path.join(self.directory.name, '.env')
+        written, problems = init_settings(config_path, env_path, interactive=False)
+        self.assertEqual(written, [config_path, env_path])
+        with self.assertRaises(ConfigError):
+            load_config(config_path)  # vm_names has no default and must be filled in
+        self.assertEqual([problem.split(' needs')[0] for problem in problems],
+                         ['[Paths] source_daily_backup_path', '[Paths] source_monthly_backup_path', '[VMDetails] vm_names'])
+        self.assertEqual(init_settings(config_path, env_path, interactive=False), ([], problems))
+        with open(config_path) as f:
+            text = f.read()
+        with open(config_path, 'w') as f:
+            f.write(text.replace('vm_names = ', 'vm_names = VM1').replace('backup_path = ', 'backup_path = ' + self.directory.name))
+        self.assertEqual(init_settings(config_path, env_path, interactive=False), ([], []))
+        load_config(config_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import io
+import os
+import tarfile
+import datetime
+import tempfile
+import unittest
+from storage_targets import LocalTarget
+from vm_restore import Artifact, RestoreError, choose_artifact, extract_ova
+
+class StubPlanner:
+    """Read throughput per directory, as RunPlanner reports it."""
+
+    def __init__(self, rates):
+        self.rates = rates
+
+    def read_throughput(self, source):
+        return self.rates.get(source)
+
+class TestVMRestore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_ova(self, members):
+        ova_file = os.path.join(self.directory.name, 'vm.ova')
+        with tarfile.open(ova_file, 'w', format=tarfile.USTAR_FORMAT) as archive:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return ova_file
+
+    def test_members_are_extracted_in_parallel_chunks(self):
+        disk = os.urandom(300 * 1024 + 17)
+        ova_file = self.write_ova([('vm.ovf', b'<Envelope/>'), ('vm-disk001.vmdk', disk), ('empty.mf', b'')])
+        output = os.path.join(self.directory.name, 'extracted')
+        extracted = extract_ova(ova_file, output, streams=4, chunk_size=64 * 1024)
+        self.assertEqual([os.path.basename(path) for path in extracted], ['vm.ovf', 'vm-disk001.vmdk', 'empty.mf'])
+        with open(os.path.join(output, 'vm-disk001.vmdk'), 'rb') as f:
+            self.assertEqual(f.read(), disk)
+        self.assertEqual(sorted(os.listdir(output)), ['empty.mf', 'vm-disk001.vmdk', 'vm.ovf'])
+
+    def test_paths_outside_the_directory_are_refused(self):
+        ova_file = self.write_ova([('vm.ovf', b'<Envelope/>'), ('../escape.vmdk', b'disk')])
+        with self.assertRaises(RestoreError):
+            extract_ova(ova_file, os.path.join(self.directory.name, 'extracted'))
+
+    def test_newest_verified_export_is_read_from_the_fastest_copy(self):
+        local, nas = LocalTarget('local', '/local/Daily'), LocalTarget('nas', '/nas/Daily')
+        monday, tuesday, wednesday = (datetime.date(2024, 1, day) for day in (1, 2, 3))
+        artifacts = [Artifact(monday, local, 'vm_2024-01-01.ova', False, 10, True),
+                     Artifact(monday, nas, 'vm_2024-01-01.ova', False, 10, True),
+                     Artifact(tuesday, nas, 'vm_2024-01-02.ova', False, 10, True),
+                     Artifact(wednesday, nas, 'vm_2024-01-03.ova', False, 10, False)]
+        planner = StubPlanner({'/local/Daily': 50.0, '/nas/Daily': 100.0})
+        self.assertEqual(choose_artifact(artifacts, planner=planner), artifacts[2])
+        self.assertEqual(choose_artifact(artifacts, planner=planner, allow_unverified=True), artifacts[3])
+        self.assertEqual(choose_artifact(artifacts, monday, planner), artifacts[1])
+        self.assertEqual(choose_artifact(artifacts, monday), artifacts[0])
+        self.assertIsNone(choose_artifact(artifacts, datetime.date(2023, 12, 31)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import time
+import threading
+import unittest
+from vm_scheduler import VMJob, plan_order, run_jobs
+
+class TestVMScheduler(unittest.TestCase):
+
+    def test_plan_prefers_priority_per_second_of_downtime(self):
+        jobs = [VMJob('Big', priority=1, estimate=3600), VMJob('Moodle', priority=50, estimate=1800),
+                VMJob('Small', priority=1, estimate=60)]
+        self.assertEqual([job.name for job in plan_order(jobs)], ['Moodle', 'Small', 'Big'])
+
+    def test_dependencies_finish_before_dependents_start(self):
+        jobs = [VMJob('App', priority=10, depends_on=('Database',), estimate=60),
+                VMJob('Database', estimate=600), VMJob('Other', estimate=600)]
+        events, lock = [], threading.Lock()
+
+        def worker(vm_name):
+            with lock:
+                events.append(('start', vm_name))
+            time.sleep(0.05)
+            with lock:
+                events.append(('end', vm_name))
+            if vm_name == 'Other':
+                raise RuntimeError("export hung")
+
+        results = run_jobs(jobs, worker, max_parallel=2)
+        self.assertLess(events.index(('end', 'Database')), events.index(('start', 'App')))
+        self.assertEqual(set(events[:2]), {('start', 'Database'), ('start', 'Other')})
+        self.assertIsInstance(results['Other'], RuntimeError)
+        self.assertEqual(len(results), 3)
+
+if __name__ == '__main__':
+    unittest.main()
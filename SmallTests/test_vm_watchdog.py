@@ -0,0 +1,107 @@
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+from vm_config import CONFIG_ENV_VAR, WatchdogConfig
+from vm_watchdog import VMWatchdog, parse_running_vms
+from vm_process import (acquire_maintenance_lock, release_maintenance_lock, is_maintenance_running, get_maintenance_lock_path,
+                        read_lock_identity, remove_stale_lock)
+
+class TestVMWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.running = {'Windows11P6'}
+        self.started = []
+        self.alerts = []
+        self.start_succeeds = True
+        settings = WatchdogConfig(poll_interval=60, backoff_initial=30, backoff_max=120, crash_loop_restarts=3, crash_loop_window=1000)
+        self.watchdog = VMWatchdog(['Windows11P6', 'Ubuntu - Moodle'], settings, poll=lambda: set(self.running),
+                                   start=self.start, alert=lambda subject, body: self.alerts.append(body), clock=lambda: self.now)
+
+    def start(self, vm_name):
+        self.started.append(vm_name)
+        return self.start_succeeds
+
+    def test_parse_running_vms(self):
+        output = '"Windows11P6" {6b1c2f3a-0000-4e5f-9a8b-123456789abc}\n"Ubuntu - Moodle" {aa1c2f3a-0000-4e5f-9a8b-123456789abc}\n'
+        self.assertEqual(parse_running_vms(output), {'Windows11P6', 'Ubuntu - Moodle'})
+
+    def test_stopped_vm_is_started_once_and_alerted_once(self):
+        self.watchdog.poll_once()
+        self.assertEqual(self.started, ['Ubuntu - Moodle'])
+        self.running.add('Ubuntu - Moodle')
+        self.now = 60
+        self.watchdog.poll_once()
+        self.assertEqual(len(self.alerts), 1)
+
+    def test_failed_start_backs_off_and_alert_is_deduplicated(self):
+        self.start_succeeds = False
+        for self.now in (0, 10, 20, 40):
+            self.watchdog.poll_once()
+        self.assertEqual(len(self.started), 2)  # at 0 and after the 30 second backoff
+        self.assertEqual(len(self.alerts), 1)
+
+    def test_crash_loop_pauses_restarts(self):
+        for self.now in (0, 200, 400, 600, 800):
+            self.watchdog.poll_once()
+        self.assertEqual(len(self.started), 3)
+        self.assertEqual(self.watchdog.states['Ubuntu - Moodle'].state, 'crash-loop')
+
+    def test_maintenance_lock_skips_checks(self):
+        self.watchdog.maintenance_running = lambda: True
+        self.watchdog.poll_once()
+        self.assertEqual(self.started, [])
+
+class TestMaintenanceLock(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous = os.environ.get(CONFIG_ENV_VAR)
+        os.environ[CONFIG_ENV_VAR] = os.path.join(self.directory.name, 'config.ini')
+
+    def tearDown(self):
+        release_maintenance_lock()
+        if self.previous is None:
+            del os.environ[CONFIG_ENV_VAR]
+        else:
+            os.environ[CONFIG_ENV_VAR] = self.previous
+        self.directory.cleanup()
+
+    def write_lock(self, pid):
+        with open(get_maintenance_lock_path(), 'w') as f:
+            f.write(f"{pid} 2024-01-31T22:00:00\n")
+
+    def test_live_lock_of_another_run_is_honoured_and_kept(self):
+        self.write_lock(os.getppid())
+        self.assertTrue(is_maintenance_running(12))
+        self.assertFalse(acquire_maintenance_lock(12))
+        release_maintenance_lock()
+        self.assertTrue(os.path.exists(get_maintenance_lock_path()))
+
+    def test_lock_of_an_ended_run_is_replaced_and_released(self):
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        self.write_lock(int(finished.stdout))
+        self.assertFalse(is_maintenance_running(12))
+        self.assertTrue(acquire_maintenance_lock(12))
+        self.assertTrue(is_maintenance_running(12))
+        release_maintenance_lock()
+        self.assertFalse(os.path.exists(get_maintenance_lock_path()))
+
+    def test_lock_created_after_the_stale_one_is_not_removed(self):
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        self.write_lock(int(finished.stdout))
+        stale = read_lock_identity(get_maintenance_lock_path())
+        os.remove(get_maintenance_lock_path())  # another starter replaced the stale lock first
+        self.write_lock(os.getppid())
+        replacement = read_lock_identity(get_maintenance_lock_path())
+        remove_stale_lock(get_maintenance_lock_path(), stale)
+        self.assertEqual(read_lock_identity(get_maintenance_lock_path()), replacement)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(get_maintenance_lock_path())) if name.endswith('.stale')], [])
+        self.assertFalse(acquire_maintenance_lock(12))
+        remove_stale_lock(get_maintenance_lock_path(), replacement)
+        self.assertFalse(os.path.exists(get_maintenance_lock_path()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,424 @@
+"""
+asyncio based execution of external commands.
+
+A single event loop runs in a background thread. Commands from any thread are scheduled onto it,
+so the per resource concurrency limits hold for the whole process: the blocking wrappers used by
+vm_process, the copies run side by side by run_parallel, and any coroutine an orchestrator awaits
+directly all share the same semaphores.
+"""
+import os
+import codecs
+import locale
+import asyncio
+import logging
+import threading
+import subprocess
+import concurrent.futures
+from enum import Enum
+from contextlib import asynccontextmanager, contextmanager
+from progress import OutputBuffer, DEFAULT_MAX_LINES
+from io_devices import DeviceUsage, get_devices, get_command_paths, is_unc_path
+from run_metrics import get_directory_size
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_STALL_CHECK_INTERVAL = 10
+# Worker threads of run_parallel; the engine's limits decide how many of their commands run at once.
+MAX_PARALLEL_CALLS = 32
+
+class ResourceClass(Enum):
+    VIRTUALBOX = "virtualbox"
+    DISK = "disk"
+    NETWORK = "network"
+    DEFAULT = "default"
+
+class CommandStalled(subprocess.TimeoutExpired):
+    """
+    Raised when a command produced no output and its watched file stopped growing for too long.
+    """
+
+    def __str__(self):
+        return f"Command '{self.cmd}' stalled: no output or file growth for {self.timeout} seconds"
+
+DEFAULT_LIMITS = {ResourceClass.VIRTUALBOX: 2, ResourceClass.DISK: 2, ResourceClass.NETWORK: 2, ResourceClass.DEFAULT: 4}
+# Concurrent streams per local disk and per network share, unless overridden for a device.
+DEFAULT_DEVICE_STREAMS = {'disk': 1, 'network': 2}
+
+def classify_command(command):
+    """
+    Decide which resource an external command mostly uses.
+
+    Args:
+        command (list): The command and its arguments.
+
+    Returns:
+        ResourceClass: VIRTUALBOX for VBoxManage, NETWORK for 'net' and copies to or from a UNC
+        path, DISK for other copies and DEFAULT for anything else.
+    """
+    program = os.path.basename(command[0]).lower()
+    if program.startswith('vboxmanage'):
+        return ResourceClass.VIRTUALBOX
+    if program in ('net', 'net.exe'):
+        return ResourceClass.NETWORK
+    if program in ('xcopy', 'xcopy.exe', 'robocopy', 'robocopy.exe'):
+        if any(str(arg).startswith('\\\\') for arg in command[1:]):
+            return ResourceClass.NETWORK
+        return ResourceClass.DISK
+    return ResourceClass.DEFAULT
+
+####### Engine
+class CommandEngine:
+    """
+    Owns the background event loop, the per resource semaphores and the per device stream budgets.
+
+    The small file system probes a command needs (finding its devices, watching its output grow)
+    run on the engine's own executor rather than the loop's default one, so they still run when
+    every default worker thread is busy.
+    """
+
+    def __init__(self, limits=None, device_streams=None, device_overrides=None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.device_streams = {**DEFAULT_DEVICE_STREAMS, **(device_streams or {})}
+        self.device_overrides = device_overrides or {}
+        self.device_semaphores = {}
+        self.device_usage = {}
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='command-engine-io')
+        self.thread = threading.Thread(target=self.loop.run_forever, name='command-engine', daemon=True)
+        self.thread.start()
+        self.semaphores = self.call(self.create_semaphores())
+
+    async def create_semaphores(self):
+        return {resource: asyncio.Semaphore(limit) for resource, limit in self.limits.items()}
+
+    def call(self, coroutine):
+        """
+        Run a coroutine on the engine loop and wait for its result from another thread.
+
+        Args:
+            coroutine: The coroutine to run.
+
+        Returns:
+            The coroutine's result.
+        """
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("Blocking engine call made from the engine's own event loop. Await the coroutine instead.")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def get_device_limit(self, device):
+        if device in self.device_overrides:
+            return self.device_overrides[device]
+        return self.device_streams['network' if is_unc_path(device) else 'disk']
+
+    @asynccontextmanager
+    async def device_slots(self, devices):
+        """
+        Hold one stream slot on each device, waiting while a device is at its budget.
+
+        Args:
+            devices (list): Devices in sorted order, so two callers never wait on each other.
+        """
+        acquired = []
+        try:
+            for device in devices:
+                if device not in self.device_semaphores:
+                    self.device_semaphores[device] = asyncio.Semaphore(self.get_device_limit(device))
+                    self.device_usage[device] = DeviceUsage(self.get_device_limit(device))
+                waiting_since = self.loop.time()
+                await self.device_semaphores[device].acquire()
+                acquired.append(device)
+                self.device_usage[device].update(self.loop.time(), 1, self.loop.time() - waiting_since)
+            yield
+        finally:
+            for device in reversed(acquired):
+                self.device_usage[device].update(self.loop.time(), -1)
+                self.device_semaphores[device].release()
+
+    def device_report(self):
+        """
+        Usage of every device seen so far.
+
+        Returns:
+            dict: Device -> limit, streams, max_streams, busy_seconds, stream_seconds and wait_seconds.
+        """
+        async def report():
+            now = self.loop.time()
+            for usage in self.device_usage.values():
+                usage.update(now, 0)
+            return {device: usage.report() for device, usage in self.device_usage.items()}
+        return self.call(report())
+
+    async def run(self, command, resource=None, timeout=None, on_line=None, progress=None, max_lines=DEFAULT_MAX_LINES,
+                  stall_timeout=None, watch_path=None, devices=None):
+        """
+        Run a command, streaming its output, within its resource's concurrency limit.
+
+        Output is read in chunks as it is produced and only the last max_lines lines of each stream
+        are kept, so a long copy or export cannot grow the captured text without bound. On a timeout
+        or stall the command is killed together with any processes it started.
+
+        Args:
+            command (list): The command and its arguments.
+            resource (ResourceClass, optional): Resource to count the command against. Derived from
+                the command when omitted.
+            timeout (float, optional): Seconds after which the command is killed.
+            on_line (callable, optional): Called as on_line(stream_name, line) for every output line,
+                with stream_name 'stdout' or 'stderr'.
+            progress (ProgressTracker, optional): Receives every stdout chunk and line to report progress.
+            max_lines (int): Lines kept per stream for the returned result.
+            stall_timeout (float, optional): Seconds without output or growth of watch_path after
+                which the command is killed.
+            watch_path (str, optional): File or directory the command writes to.
+            devices (list, optional): Devices the command uses. Derived from the paths in the
+                command when omitted.
+
+        Returns:
+            subprocess.CompletedProcess: Return code and the retained stdout and stderr text.
+
+        Raises:
+            subprocess.TimeoutExpired: If the command ran longer than timeout.
+            CommandStalled: If the command stalled for stall_timeout seconds.
+        """
+        resource = resource or classify_command(command)
+        if devices is None:
+            devices = await self.loop.run_in_executor(self.executor, get_devices, get_command_paths(command))
+        async with self.semaphores[resource], self.device_slots(devices):
+            process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                           start_new_session=os.name != 'nt')
+            output = {'stdout': OutputBuffer(max_lines), 'stderr': OutputBuffer(max_lines)}
+            activity = {'time': self.loop.time()}
+            readers = asyncio.ensure_future(asyncio.gather(read_stream(process.stdout, output['stdout'], 'stdout', on_line, progress, activity),
+                                                           read_stream(process.stderr, output['stderr'], 'stderr', on_line, None, activity)))
+            tasks = [readers]
+            if stall_timeout:
+                tasks.append(asyncio.ensure_future(watch_for_stall(activity, stall_timeout, watch_path, self.executor)))
+            try:
+                done, pending = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if readers not in done:
+                    await kill_process_tree(process)
+                    await readers
+                    await process.wait()
+                    error = CommandStalled if done else subprocess.TimeoutExpired
+                    raise error(command, stall_timeout if done else timeout, output['stdout'].text(), output['stderr'].text())
+                readers.result()
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                await kill_process_tree(process)
+                raise
+            finally:
+                for task in tasks[1:]:
+                    task.cancel()
+            return subprocess.CompletedProcess(command, returncode, output['stdout'].text(), output['stderr'].text())
+
+async def read_stream(stream, buffer, stream_name, on_line, progress, activity):
+    """
+    Read a process stream in chunks as it is produced.
+
+    Chunks rather than lines are read because VBoxManage prints its '10%...20%...' progress without
+    line breaks until the operation finishes.
+
+    Args:
+        stream (asyncio.StreamReader): stdout or stderr of the process.
+        buffer (OutputBuffer): Keeps the stream's most recent lines.
+        stream_name (str): 'stdout' or 'stderr'.
+        on_line (callable or None): Callback for each decoded line.
+        progress (ProgressTracker or None): Progress parser for the stream.
+        activity (dict): Its 'time' is set to the loop time whenever output arrives.
+    """
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors='replace')
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        activity['time'] = asyncio.get_running_loop().time()
+        text = decoder.decode(chunk, final=not chunk)
+        if progress and text:
+            progress.feed_text(text)
+        lines = buffer.feed(text) if chunk else buffer.feed(text) + buffer.close()
+        for line in lines:
+            if progress:
+                progress.feed_line(line)
+            if on_line:
+                on_line(stream_name, line)
+        if not chunk:
+            return
+
+async def watch_for_stall(activity, stall_timeout, watch_path, executor=None):
+    """
+    Return once a command has shown no sign of progress for stall_timeout seconds.
+
+    Progress is new output or, when watch_path is given, the file or directory growing. A large
+    export or an xcopy of a single OVA can run for a long time without printing anything, so the
+    file size is what keeps those commands alive.
+
+    Args:
+        activity (dict): Shared with read_stream; 'time' is when output last arrived.
+        stall_timeout (float): Seconds without progress that count as a stall.
+        watch_path (str or None): File or directory the command writes to.
+        executor (Executor, optional): Where the size of watch_path is measured. The engine passes
+            its own, because the loop's default executor can be full of blocking run_parallel work.
+    """
+    loop = asyncio.get_running_loop()
+    last_size = None
+    while True:
+        await asyncio.sleep(min(stall_timeout / 4, MAX_STALL_CHECK_INTERVAL))
+        if watch_path:
+            size = await loop.run_in_executor(executor, get_path_size, watch_path)
+            if size != last_size:
+                last_size = size
+                activity['time'] = max(activity['time'], loop.time())
+        if loop.time() - activity['time'] >= stall_timeout:
+            logging.error(f"No output or file growth for {stall_timeout} seconds.")
+            return
+
+def get_path_size(path):
+    """
+    Size of a file, or of all files below a directory, in bytes. 0 if it does not exist.
+    """
+    if os.path.isdir(path):
+        return get_directory_size(path)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+async def kill_process_tree(process):
+    """
+    Kill a process and every process it started, if it is still running.
+
+    Killing only the direct child is not enough: a grandchild (e.g. the VBoxSVC work behind a
+    VBoxManage call, or the tools started by a .cmd wrapper) keeps the output pipes open and the
+    command would never be seen to finish.
+
+    Args:
+        process (asyncio.subprocess.Process): The process, started in its own session on POSIX.
+    """
+    if process.returncode is not None:
+        return
+    logging.warning(f"Killing process tree of PID {process.pid}.")
+    try:
+        if os.name == 'nt':
+            taskkill = await asyncio.create_subprocess_exec('taskkill', '/T', '/F', '/PID', str(process.pid),
+                                                            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            await taskkill.wait()
+        else:
+            import signal
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError) as e:
+        logging.error(f"Could not kill process tree of PID {process.pid}: {e}")
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+_engine = {'engine': None}
+_engine_lock = threading.Lock()
+
+def configure_engine(limits, device_streams=None, device_overrides=None):
+    """
+    Set the concurrency limits, replacing the engine if it was already started.
+
+    Args:
+        limits (dict): Maps ResourceClass to the number of commands allowed at once.
+        device_streams (dict, optional): Streams per 'disk' and per 'network' share.
+        device_overrides (dict, optional): Streams for specific devices.
+
+    Returns:
+        CommandEngine: The engine.
+    """
+    with _engine_lock:
+        previous = _engine['engine']
+        _engine['engine'] = CommandEngine(limits, device_streams, device_overrides)
+    if previous:
+        previous.loop.call_soon_threadsafe(previous.loop.stop)
+        previous.executor.shutdown(wait=False)
+    return _engine['engine']
+
+def get_engine():
+    """
+    Get the process wide engine, starting it with the default limits on first use.
+
+    Returns:
+        CommandEngine: The engine.
+    """
+    with _engine_lock:
+        if _engine['engine'] is None:
+            _engine['engine'] = CommandEngine()
+        return _engine['engine']
+
+def limits_from_config(concurrency):
+    """
+    Build engine limits from the [Concurrency] config section.
+
+    Args:
+        concurrency (ConcurrencyConfig): Limits per resource class.
+
+    Returns:
+        dict: Maps ResourceClass to its limit.
+    """
+    return {resource: getattr(concurrency, resource.value) for resource in ResourceClass}
+
+def device_limits_from_config(io_settings):
+    """
+    Build the device stream budgets from the [IO] config section.
+
+    Args:
+        io_settings (IOConfig): Streams per disk and per share, plus overrides written as
+            'path=streams' pairs separated by ';'. Each override applies to the device the path is on.
+
+    Returns:
+        tuple: (device_streams, device_overrides) for configure_engine.
+    """
+    overrides = {}
+    for pair in io_settings.device_overrides.split(';'):
+        if '=' in pair:
+            path, streams = pair.rsplit('=', 1)
+            overrides[get_devices([path.strip()])[0]] = int(streams)
+    return {'disk': io_settings.disk_streams, 'network': io_settings.network_streams}, overrides
+
+####### Blocking wrappers
+@contextmanager
+def hold_devices(*paths):
+    """
+    Hold a stream slot on the devices of paths while Python code does I/O there, such as
+    deleting old backups, so it queues with the commands using the same disks.
+
+    Do not start a command on the same device while holding its slot.
+    """
+    engine = get_engine()
+    devices = get_devices(paths)
+    slots = engine.device_slots(devices)
+    engine.call(slots.__aenter__())
+    try:
+        yield
+    finally:
+        engine.call(slots.__aexit__(None, None, None))
+
+def run_command(command, resource=None, timeout=None, on_line=None, progress=None, stall_timeout=None, watch_path=None):
+    """
+    Run a command on the engine and block until it finishes. See CommandEngine.run.
+    """
+    engine = get_engine()
+    return engine.call(engine.run(command, resource, timeout, on_line, progress, stall_timeout=stall_timeout, watch_path=watch_path))
+
+def run_parallel(calls):
+    """
+    Run blocking functions side by side on worker threads of their own.
+
+    Any commands they start still go through the shared resource limits, so two copies to the
+    same disk only overlap as far as the disk limit allows. The threads are not the event loop's
+    executor, which the commands themselves use.
+
+    Args:
+        calls (list): (function, args) tuples.
+
+    Returns:
+        list: Each function's result, or the exception it raised, in the order given.
+    """
+    if not calls:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(calls), MAX_PARALLEL_CALLS), thread_name_prefix='parallel') as executor:
+        futures = [executor.submit(function, *args) for function, args in calls]
+    results = [future.exception() or future.result() for future in futures]
+    for (function, args), result in zip(calls, results):
+        if isinstance(result, Exception):
+            logging.error(f"{function.__name__}{tuple(args)} failed: {result}")
+    return results
@@ -0,0 +1,116 @@
+"""
+Catalog of the files copied to each destination.
+
+Every file a run puts on a storage target gets one row, keyed by the target's location (its
+directory or s3://bucket/prefix) and the file's key there, with the source's size and
+modification time, when it was copied and when 'verify' last found it intact. The catalog lets a
+run tell what a destination already holds without reading it, which matters for OneDrive folders
+where reading a cloud-only file downloads it again.
+
+The catalog only describes what was copied; rows whose file has since been deleted are removed
+when the cleanup or a target's retention deletes it.
+"""
+import os
+import sqlite3
+import datetime
+import threading
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (location TEXT, key TEXT, target TEXT, size INTEGER, modified REAL,
+                                      uploaded TEXT, verified TEXT, PRIMARY KEY (location, key));
+CREATE INDEX IF NOT EXISTS artifacts_by_key ON artifacts (key);
+"""
+COLUMNS = ('location', 'key', 'target', 'size', 'modified', 'uploaded', 'verified')
+
+class Catalog:
+    """
+    The catalog database.
+
+    Args:
+        database (str): SQLite file, created on first use.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.lock = threading.Lock()
+
+    def connect(self):
+        directory = os.path.dirname(self.database)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.database, timeout=30)
+        connection.executescript(SCHEMA)
+        return closing(connection)
+
+    def execute(self, statement, parameters=()):
+        with self.lock, self.connect() as connection, connection:
+            return connection.execute(statement, parameters).fetchall()
+
+    def record(self, target, key, source_file):
+        """
+        Record that source_file was copied to key on target. The verification of an earlier copy
+        is kept if the file is unchanged.
+
+        Args:
+            target (StorageTarget): The destination.
+            key (str): Key of the copy on the target.
+            source_file (str): The file that was copied.
+        """
+        status = os.stat(source_file)
+        uploaded = datetime.datetime.now().isoformat(timespec='seconds')
+        self.execute('INSERT INTO artifacts (location, key, target, size, modified, uploaded) VALUES (?, ?, ?, ?, ?, ?) '
+                     'ON CONFLICT (location, key) DO UPDATE SET target = excluded.target, size = excluded.size, '
+                     'modified = excluded.modified, uploaded = excluded.uploaded, verified = CASE WHEN '
+                     'artifacts.size = excluded.size AND artifacts.modified = excluded.modified THEN artifacts.verified END',
+                     (str(target), key, target.name, status.st_size, status.st_mtime, uploaded))
+
+    def mark_verified(self, location, key, when=None):
+        """
+        Record that the copy at location/key was found intact.
+        """
+        if not os.path.exists(self.database):
+            return
+        when = (when or datetime.datetime.now()).isoformat(timespec='seconds')
+        self.execute('UPDATE artifacts SET verified = ? WHERE location = ? AND key = ?', (when, str(location), key))
+
+    def remove(self, location, key):
+        if not os.path.exists(self.database):
+            return
+        self.execute('DELETE FROM artifacts WHERE location = ? AND key = ?', (str(location), key))
+
+    def lookup(self, location, key):
+        """
+        Returns:
+            dict: The row of location/key, or None.
+        """
+        rows = self.execute(f"SELECT {', '.join(COLUMNS)} FROM artifacts WHERE location = ? AND key = ?", (str(location), key))
+        return dict(zip(COLUMNS, rows[0])) if rows else None
+
+    def find(self, key=None, target=None):
+        """
+        Rows of one key and/or target, most recently copied first.
+
+        Returns:
+            list: Row dicts.
+        """
+        clauses, parameters = [], []
+        for column, value in (('key', key), ('target', target)):
+            if value:
+                clauses.append(f'{column} = ?')
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.execute(f"SELECT {', '.join(COLUMNS)} FROM artifacts {where} ORDER BY uploaded DESC", parameters)
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+_current = {'catalog': None}
+_current_lock = threading.Lock()
+
+def get_catalog(config):
+    """
+    Get the process wide catalog of the [Catalog] database.
+    """
+    with _current_lock:
+        if _current['catalog'] is None or _current['catalog'].database != config.catalog.database:
+            _current['catalog'] = Catalog(config.catalog.database)
+        return _current['catalog']
@@ -0,0 +1,188 @@
+"""
+End-to-end benchmark of the nightly run against the fake_vboxmanage simulator.
+
+Each run builds a throw-away directory tree with its own config.ini, simulator state and
+VBoxManage/net/xcopy shims on PATH, then runs vm_process.py in a fresh process and reads back the
+JSON run summary it writes. Runs for 1, 10 and 50 VMs by default:
+
+    python vmbackup.py bench --pipeline
+    python vmbackup.py bench --pipeline --vm-counts 5 --latency export=1.5 --export-size-mb 256 --real-writes
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from collections import defaultdict
+import fake_vboxmanage
+from settings_schema import build_config
+
+DEFAULT_VM_COUNTS = (1, 10, 50)
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+####### Environment
+def build_paths(root):
+    """
+    Lay out the directories a run touches below root.
+
+    Args:
+        root (str): Temporary benchmark directory.
+
+    Returns:
+        dict: Values for the [Paths] section.
+    """
+    names = {
+        'virtual_box_path': 'bin',
+        'vm_management_source_path': 'VM_Management',
+        'source_daily_backup_path': os.path.join('local', 'Daily'),
+        'source_monthly_backup_path': os.path.join('local', 'Monthly'),
+        'office365_daily_path': os.path.join('onedrive', 'Daily'),
+        'office365_monthly_path': os.path.join('onedrive', 'Monthly'),
+        'office365_misc_path': os.path.join('onedrive', 'Misc'),
+        'nas_path': 'nas',
+        'nas_daily_path': os.path.join('nas', 'Daily'),
+        'nas_monthly_path': os.path.join('nas', 'Monthly'),
+        'nas_misc_path': os.path.join('nas', 'Misc'),
+        'logs_location': os.path.join('VM_Management', 'logs'),
+        'logs_office365': os.path.join('onedrive', 'Misc', 'logs'),
+        'logs_nas': os.path.join('nas', 'Misc', 'logs'),
+    }
+    paths = {key: os.path.join(root, relative) for key, relative in names.items()}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    with open(os.path.join(paths['vm_management_source_path'], 'vm_process.py'), 'w') as f:
+        f.write('# placeholder copied to the misc destinations\n')
+    return paths
+
+def build_environment(root, vm_count, latency=None, export_size_mb=16, sparse_exports=True, settings=None):
+    """
+    Create config.ini, simulator state and shims for one benchmark run.
+
+    Args:
+        root (str): Temporary benchmark directory.
+        vm_count (int): Number of simulated VMs.
+        latency (dict, optional): Seconds per simulated operation.
+        export_size_mb (int): Size of each exported OVA.
+        sparse_exports (bool): Create sparse exports instead of writing every byte.
+        settings (dict, optional): Extra config.ini values keyed by (section, key).
+
+    Returns:
+        tuple: (environment variables for the run, path of the metrics summary directory)
+    """
+    paths = build_paths(root)
+    fake_vboxmanage.install_shims(paths['virtual_box_path'])
+    vm_names = [f"BenchVM{index:03d}" for index in range(vm_count)]
+    state_path = os.path.join(root, 'vbox_state.json')
+    fake_vboxmanage.create_state(state_path, vm_names, latency, export_size_mb, sparse_exports)
+
+    summary_directory = os.path.join(root, 'metrics', 'runs')
+    values = {('Paths', key): value for key, value in paths.items()}
+    values.update({
+        ('VMDetails', 'vm_names'): ', '.join(vm_names),
+        ('SMTP', 'server'): 'localhost',
+        ('Metrics', 'textfile_path'): os.path.join(root, 'metrics', 'vmbackup.prom'),
+        ('Metrics', 'summary_directory'): summary_directory,
+        ('Journal', 'directory'): os.path.join(root, 'journal'),
+        ('Notifications', 'outbox'): os.path.join(root, 'outbox'),
+        ('Notifications', 'flush_timeout'): '5',
+        ('LogIndex', 'database'): os.path.join(root, 'log_index.sqlite'),
+        ('Catalog', 'database'): os.path.join(root, 'catalog.sqlite'),
+    })
+    values.update(settings or {})
+    config_path = os.path.join(root, 'config.ini')
+    with open(config_path, 'w') as f:
+        build_config(values).write(f)
+
+    environment = dict(os.environ)
+    environment.update({
+        'PATH': paths['virtual_box_path'] + os.pathsep + environment.get('PATH', ''),
+        fake_vboxmanage.STATE_ENV_VAR: state_path,
+        'VMBACKUP_CONFIG': config_path,
+        'NASUsername': 'bench',
+        'NASPassword': 'bench',
+        'email_port': '1',  # nothing listens here, so the log email fails immediately
+    })
+    return environment, summary_directory
+
+####### Running
+def run_pipeline(vm_count, latency=None, export_size_mb=16, sparse_exports=True):
+    """
+    Time one full run of vm_process.py against the simulator.
+
+    Args:
+        vm_count (int): Number of simulated VMs.
+        latency (dict, optional): Seconds per simulated operation.
+        export_size_mb (int): Size of each exported OVA.
+        sparse_exports (bool): Create sparse exports instead of writing every byte.
+
+    Returns:
+        dict: vm_count, wall clock seconds, exit code and the run summary written by the run.
+    """
+    with tempfile.TemporaryDirectory(prefix='vmbackup_bench_') as root:
+        environment, summary_directory = build_environment(root, vm_count, latency, export_size_mb, sparse_exports)
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, os.path.join(SCRIPT_DIRECTORY, 'vm_process.py')],
+                                   env=environment, cwd=root, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        summary = {}
+        if os.path.isdir(summary_directory):
+            for name in os.listdir(summary_directory):
+                with open(os.path.join(summary_directory, name)) as f:
+                    summary = json.load(f)
+        return {'vm_count': vm_count, 'seconds': elapsed, 'returncode': completed.returncode,
+                'summary': summary, 'stderr': completed.stderr}
+
+def phase_totals(summary):
+    """
+    Sum phase durations by phase name.
+
+    Args:
+        summary (dict): A run summary.
+
+    Returns:
+        dict: Phase name -> total seconds.
+    """
+    totals = defaultdict(float)
+    for record in summary.get('phases', []):
+        totals[record['phase']] += record['seconds']
+    return dict(totals)
+
+def parse_latency(values):
+    """
+    Parse 'operation=seconds' pairs.
+
+    Args:
+        values (list): Strings such as 'export=1.5'.
+
+    Returns:
+        dict: Operation -> seconds.
+    """
+    latency = {}
+    for value in values or []:
+        operation, seconds = value.split('=', 1)
+        latency[operation] = float(seconds)
+    return latency
+
+def main(args):
+    """
+    Run the pipeline benchmark and print one line per VM count.
+
+    Args:
+        args (argparse.Namespace): Parsed bench arguments.
+
+    Returns:
+        int: 0 if every run finished, 1 otherwise.
+    """
+    latency = parse_latency(args.latency)
+    failed = False
+    print(f"{'vms':>5} {'seconds':>9} {'s/vm':>7}  phases")
+    for vm_count in args.vm_counts:
+        result = run_pipeline(vm_count, latency, args.export_size_mb, not args.real_writes)
+        totals = phase_totals(result['summary'])
+        phases = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in sorted(totals.items(), key=lambda item: -item[1]))
+        print(f"{vm_count:>5} {result['seconds']:>9.2f} {result['seconds'] / vm_count:>7.2f}  {phases}")
+        if result['returncode'] != 0 or not result['summary']:
+            failed = True
+            print(result['stderr'][-2000:], file=sys.stderr)
+    return 1 if failed else 0
@@ -1,25 +1,37 @@
 import os
+import sys
 import logging
-from vm_process import VMAction, configure_logging, read_config, manage_vm_action, send_log_email
+from vm_config import get_config
+from notifications import flush_notifications
+from vm_process import VMAction, configure_logging, load_environment_variables, manage_vm_action, get_vm_state, send_log_email
 
 def main():
     try:
         log_file_path = configure_logging("vmrunninglogs")
-        Paths = read_config("Paths")
-        os.chdir(Paths['virtual_box_path'])
+        load_environment_variables()
+        config = get_config()
+        os.chdir(config.paths.virtual_box_path)
         already_running = 0  
-        VMDetails = read_config("VMDetails")
-        vm_names_section = VMDetails['vm_names']
-        for vm_name in vm_names_section.split(','):
-            vm_name = vm_name.strip()
+        for vm_name in config.vm_details.vm_names:
             if manage_vm_action(vm_name, VMAction.START_HEADLESS):
                 already_running += 1  # Increment the counter for each failed VM start
         if already_running > 0:
             logging.info("Certain VM's weren't running. Sending Email to summarise.")
-            send_log_email(log_file_path)
+            send_log_email(log_file_path, config)
+            flush_notifications(config)
 
     except Exception as e:
         logging.error(f"Error in main: {str(e)}")
 
+def report_states():
+    config = get_config()
+    os.chdir(config.paths.virtual_box_path)
+    for vm_name in config.vm_details.vm_names:
+        print(f"{vm_name}: {get_vm_state(vm_name)}")
+
 if __name__ == "__main__":
-    main()
+    if '--daemon' in sys.argv[1:]:
+        import vm_watchdog
+        vm_watchdog.main()
+    else:
+        main()
@@ -0,0 +1,328 @@
+"""
+Stateful stand-in for VBoxManage, 'net use' and 'xcopy' so the maintenance run can be executed and
+timed on a machine without VirtualBox or Windows.
+
+Exports are OVA tar archives holding an OVF descriptor and one disk image, so they can be extracted
+and imported again like real ones.
+
+State lives in a JSON file named by the FAKE_VBOX_STATE environment variable:
+
+    {
+        "vms": {"Windows11P6": {"state": "running", "snapshots": ["Snapshot-010124"]}},
+        "latency": {"export": 2.0, "poweroff": 0.2},
+        "export_size_mb": 512,
+        "sparse_exports": true
+    }
+
+install_shims() writes VBoxManage, net and xcopy launchers into a directory that is put first on PATH.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import tarfile
+from contextlib import contextmanager
+
+STATE_ENV_VAR = 'FAKE_VBOX_STATE'
+DEFAULT_LATENCY = {'showvminfo': 0.01, 'list': 0.01, 'poweroff': 0.05, 'startvm': 0.05,
+                   'snapshot': 0.05, 'export': 0.2, 'import': 0.2, 'net': 0.01, 'xcopy': 0.0}
+WRITE_CHUNK = 1024 * 1024
+OVF_TEMPLATE = '''<?xml version="1.0"?>
+<Envelope xmlns="http://schemas.dmtf.org/ovf/envelope/2" xmlns:ovf="http://schemas.dmtf.org/ovf/envelope/2">
+  <References>
+    <File ovf:id="file1" ovf:href="{disk}"/>
+  </References>
+  <VirtualSystem ovf:id="{vm_name}"/>
+</Envelope>
+'''
+
+####### State handling
+@contextmanager
+def locked_state(state_path):
+    """
+    Load the simulator state under an exclusive lock and write it back afterwards.
+
+    Args:
+        state_path (str): Path to the JSON state file.
+
+    Yields:
+        dict: The state, which may be modified in place.
+    """
+    with open(f"{state_path}.lock", 'a+') as lock_file:
+        lock(lock_file)
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            yield state
+            with open(state_path, 'w') as f:
+                json.dump(state, f)
+        finally:
+            unlock(lock_file)
+
+def lock(lock_file):
+    if os.name == 'nt':
+        import msvcrt
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                time.sleep(0.01)
+    import fcntl
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+def unlock(lock_file):
+    if os.name == 'nt':
+        import msvcrt
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def create_state(state_path, vm_names, latency=None, export_size_mb=16, sparse_exports=True):
+    """
+    Write a fresh simulator state with every VM running and no snapshots.
+
+    Args:
+        state_path (str): Path to the JSON state file.
+        vm_names (list): Names of the simulated VMs.
+        latency (dict, optional): Seconds per operation, merged over DEFAULT_LATENCY.
+        export_size_mb (int): Size of each exported OVA.
+        sparse_exports (bool): Create exports as sparse files instead of writing every byte.
+    """
+    state = {
+        'vms': {name: {'state': 'running', 'snapshots': []} for name in vm_names},
+        'latency': dict(DEFAULT_LATENCY, **(latency or {})),
+        'export_size_mb': export_size_mb,
+        'sparse_exports': sparse_exports,
+    }
+    with open(state_path, 'w') as f:
+        json.dump(state, f)
+
+def read_latency(state_path, operation):
+    with open(state_path) as f:
+        return json.load(f)['latency'].get(operation, 0.0)
+
+def fail(message):
+    print(f"VBoxManage: error: {message}", file=sys.stderr)
+    return 1
+
+def get_vm(state, vm_name):
+    vm = state['vms'].get(vm_name)
+    if vm is None:
+        raise LookupError(f"Could not find a registered machine named '{vm_name}'")
+    return vm
+
+####### VBoxManage commands
+def vboxmanage(state_path, args):
+    """
+    Emulate the VBoxManage subcommands used by vm_process, vm_watchdog and vm_restore.
+
+    Args:
+        state_path (str): Path to the JSON state file.
+        args (list): Arguments after 'VBoxManage'.
+
+    Returns:
+        int: Process exit code.
+    """
+    if not args:
+        return fail("no command given")
+    command = args[0]
+    operation = args[2] if command == 'controlvm' and len(args) > 2 else command
+    time.sleep(read_latency(state_path, operation))
+    try:
+        if command == 'list':
+            return list_command(state_path, args[1:])
+        if command == 'showvminfo':
+            with locked_state(state_path) as state:
+                vm = get_vm(state, args[1])
+            print(f'name="{args[1]}"\nVMState="{vm["state"]}"')
+            return 0
+        if command == 'controlvm' and operation == 'poweroff':
+            with locked_state(state_path) as state:
+                vm = get_vm(state, args[1])
+                if vm['state'] != 'running':
+                    return fail(f"Machine in invalid state {vm['state']} -- not running")
+                vm['state'] = 'poweroff'
+            print("0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%")
+            return 0
+        if command == 'startvm':
+            with locked_state(state_path) as state:
+                vm = get_vm(state, args[1])
+                if vm['state'] == 'running':
+                    return fail(f"The machine '{args[1]}' is already locked by a session")
+                vm['state'] = 'running'
+            print(f"VM \"{args[1]}\" has been successfully started.")
+            return 0
+        if command == 'snapshot':
+            return snapshot_command(state_path, args[1], args[2], args[3:])
+        if command == 'export':
+            return export_command(state_path, args[1], args[2:])
+        if command == 'import':
+            return import_command(state_path, args[1], args[2:])
+    except LookupError as e:
+        return fail(str(e))
+    return fail(f"unsupported command: {' '.join(args)}")
+
+def list_command(state_path, args):
+    with locked_state(state_path) as state:
+        vms = state['vms']
+    for name, vm in vms.items():
+        if args and args[0] == 'runningvms' and vm['state'] != 'running':
+            continue
+        print(f'"{name}" {{{uuid.uuid5(uuid.NAMESPACE_DNS, name)}}}')
+    return 0
+
+def snapshot_command(state_path, vm_name, action, args):
+    with locked_state(state_path) as state:
+        vm = get_vm(state, vm_name)
+        if action == 'list':
+            if not vm['snapshots']:
+                print("This machine does not have any snapshots")
+                return 1
+            for index, name in enumerate(vm['snapshots']):
+                suffix = '' if index == 0 else '-1' * index
+                print(f'SnapshotName{suffix}="{name}"')
+                print(f'SnapshotUUID{suffix}="{uuid.uuid5(uuid.NAMESPACE_DNS, vm_name + name)}"')
+            print(f'CurrentSnapshotName="{vm["snapshots"][-1]}"')
+            return 0
+        if action == 'take':
+            vm['snapshots'].append(args[0])
+            print("0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%")
+            return 0
+        if action == 'delete':
+            if args[0] not in vm['snapshots']:
+                return fail(f"Could not find a snapshot named '{args[0]}'")
+            vm['snapshots'].remove(args[0])
+            print("0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%")
+            return 0
+    return fail(f"unsupported snapshot action: {action}")
+
+def export_command(state_path, vm_name, args):
+    with locked_state(state_path) as state:
+        get_vm(state, vm_name)
+        size = state['export_size_mb'] * 1024 * 1024
+        sparse = state['sparse_exports']
+    output = next((arg.split('=', 1)[1] for arg in args if arg.startswith('--output=')), None)
+    if not output:
+        return fail("--output is required")
+    print("0%...", end='', flush=True)
+    write_ova(output, vm_name, size, sparse)
+    print("10%...20%...30%...40%...50%...60%...70%...80%...90%...100%")
+    print(f"Successfully exported 1 machine(s).")
+    return 0
+
+def write_ova(output, vm_name, size, sparse):
+    """
+    Write an OVA of size bytes, rounded up to whole tar blocks: a tar archive with an OVF
+    descriptor and a disk image of zeros filling the rest.
+    """
+    disk = f"{vm_name}-disk001.vmdk"
+    descriptor = OVF_TEMPLATE.format(disk=disk, vm_name=vm_name).encode()
+    # Two headers, the descriptor's blocks and the two end of archive blocks.
+    overhead = 4 * tarfile.BLOCKSIZE + len(descriptor) + -len(descriptor) % tarfile.BLOCKSIZE
+    disk_size = max(0, size - overhead)
+    with open(output, 'wb') as f:
+        for name, member_size in ((vm_name + '.ovf', len(descriptor)), (disk, disk_size)):
+            info = tarfile.TarInfo(name)
+            info.size, info.mtime = member_size, time.time()
+            f.write(info.tobuf(tarfile.GNU_FORMAT))
+            if name == disk and sparse:
+                f.seek(disk_size, os.SEEK_CUR)
+            elif name == disk:
+                written, chunk = 0, b'\0' * WRITE_CHUNK
+                while written < disk_size:
+                    written += f.write(chunk[:disk_size - written])
+            else:
+                f.write(descriptor)
+            f.seek(-member_size % tarfile.BLOCKSIZE, os.SEEK_CUR)
+        f.seek(2 * tarfile.BLOCKSIZE, os.SEEK_CUR)
+        f.truncate()
+
+def import_command(state_path, ovf_file, args):
+    """
+    Emulate 'VBoxManage import <ovf> --vsys 0 --vmname NAME': register the VM powered off after
+    checking the descriptor and the disk images it references exist.
+    """
+    vm_name = next((value for option, value in zip(args, args[1:]) if option == '--vmname'), None)
+    if not os.path.isfile(ovf_file):
+        return fail(f"Could not open the file '{ovf_file}'")
+    with open(ovf_file) as f:
+        descriptor = f.read()
+    for reference in descriptor.split('ovf:href="')[1:]:
+        disk = reference.split('"')[0]
+        if not os.path.isfile(os.path.join(os.path.dirname(ovf_file), disk)):
+            return fail(f"Could not find the disk image '{disk}'")
+    vm_name = vm_name or descriptor.split('<VirtualSystem ovf:id="')[1].split('"')[0]
+    with locked_state(state_path) as state:
+        if vm_name in state['vms']:
+            return fail(f"A machine named '{vm_name}' already exists")
+        state['vms'][vm_name] = {'state': 'poweroff', 'snapshots': []}
+    print("0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%")
+    print("Successfully imported the appliance.")
+    return 0
+
+####### net and xcopy
+def net(state_path, args):
+    """
+    Emulate 'net use' listing, mapping and deleting with no existing connections.
+    """
+    time.sleep(read_latency(state_path, 'net'))
+    if args[:1] == ['use'] and len(args) == 1:
+        print("New connections will be remembered.\n\nThere are no entries in the list.")
+    else:
+        print("The command completed successfully.")
+    return 0
+
+def xcopy(state_path, args):
+    """
+    Emulate 'xcopy src dest /E /I /Y ...' by copying the tree and printing one line per file.
+    """
+    time.sleep(read_latency(state_path, 'xcopy'))
+    paths = [arg for arg in args if not (len(arg) == 2 and arg.startswith('/'))]  # switches like /E, /Y
+    source, destination = paths[0], paths[1]
+    count = 0
+    for root, dirs, files in os.walk(source):
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for file_name in files:
+            shutil.copyfile(os.path.join(root, file_name), os.path.join(target_root, file_name))
+            print(f"{os.path.join(root, file_name)} -> {os.path.join(target_root, file_name)}")
+            count += 1
+    print(f"{count} File(s) copied")
+    return 0
+
+TOOLS = {'vboxmanage': vboxmanage, 'net': net, 'xcopy': xcopy}
+SHIM_NAMES = {'vboxmanage': 'VBoxManage', 'net': 'net', 'xcopy': 'xcopy'}
+
+def install_shims(bin_directory):
+    """
+    Write VBoxManage, net and xcopy launchers that run this simulator.
+
+    Args:
+        bin_directory (str): Directory to create; put it first on PATH to use the simulator.
+    """
+    os.makedirs(bin_directory, exist_ok=True)
+    for tool, name in SHIM_NAMES.items():
+        if os.name == 'nt':
+            with open(os.path.join(bin_directory, f"{name}.cmd"), 'w') as f:
+                f.write(f'@"{sys.executable}" "{os.path.abspath(__file__)}" {tool} %*\n')
+        else:
+            shim_path = os.path.join(bin_directory, name)
+            with open(shim_path, 'w') as f:
+                f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" {tool} "$@"\n')
+            os.chmod(shim_path, 0o755)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    state_path = os.environ.get(STATE_ENV_VAR)
+    if not state_path or not argv or argv[0] not in TOOLS:
+        print(f"usage: {STATE_ENV_VAR}=state.json fake_vboxmanage.py vboxmanage|net|xcopy ARGS", file=sys.stderr)
+        return 2
+    return TOOLS[argv[0]](state_path, argv[1:])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Maps paths to the storage device they live on and tracks how busy each device is.
+
+A device is identified by its mount point (a drive root such as 'C:\\' on Windows) or, for UNC
+paths, by the '\\\\server\\share' root. The command engine gives every device a stream budget
+so an export, a copy and a cleanup on the same disk queue behind each other instead of competing
+for the disk heads.
+"""
+import os
+import re
+
+SWITCH_PATTERN = re.compile(r'/[A-Za-z]{1,2}(:\S*)?')
+_mount_points = {}
+
+def is_unc_path(path):
+    return path.startswith('\\\\') or path.startswith('//')
+
+def get_device(path):
+    """
+    Identify the device a path lives on. The path does not need to exist yet.
+
+    Args:
+        path (str): File or directory path.
+
+    Returns:
+        str: UNC share root (lower case) or the mount point of the nearest existing parent.
+    """
+    if is_unc_path(path):
+        parts = [part for part in re.split(r'[\\/]+', path) if part]
+        return '\\\\' + '\\'.join(parts[:2]).lower()
+    existing = os.path.abspath(path)
+    while not os.path.exists(existing) and os.path.dirname(existing) != existing:
+        existing = os.path.dirname(existing)
+    try:
+        device_number = os.stat(existing).st_dev
+    except OSError:
+        return os.path.splitdrive(existing)[0] or os.sep
+    if device_number not in _mount_points:
+        _mount_points[device_number] = find_mount_point(existing, device_number)
+    return _mount_points[device_number]
+
+def find_mount_point(path, device_number):
+    """
+    Walk up from path while the parent is still on the same device.
+    """
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return path
+        try:
+            if os.stat(parent).st_dev != device_number:
+                return path
+        except OSError:
+            return path
+        path = parent
+
+def get_command_paths(command):
+    """
+    Paths an external command reads or writes.
+
+    Args:
+        command (list): The command and its arguments.
+
+    Returns:
+        list: The export target of 'VBoxManage export', the source and destination of xcopy or
+        robocopy, and nothing for other commands.
+    """
+    program = os.path.basename(command[0]).lower()
+    if program.startswith('vboxmanage') and 'export' in command:
+        return [arg.split('=', 1)[1] for arg in command if arg.startswith('--output=')]
+    if program in ('xcopy', 'xcopy.exe', 'robocopy', 'robocopy.exe'):
+        return [arg for arg in command[1:] if not SWITCH_PATTERN.fullmatch(arg)]
+    return []
+
+def get_devices(paths):
+    """
+    Devices touched by a set of paths, sorted so they are always acquired in the same order.
+    """
+    return sorted({get_device(path) for path in paths if path})
+
+class DeviceUsage:
+    """
+    Stream counts and busy time of one device, in engine loop seconds.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.max_active = 0
+        self.streams = 0
+        self.busy_seconds = 0.0
+        self.stream_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.changed = None
+
+    def update(self, now, change, waited=0.0):
+        """
+        Record a stream starting (change=1) or ending (change=-1).
+        """
+        if self.changed is not None:
+            elapsed = now - self.changed
+            self.stream_seconds += elapsed * self.active
+            if self.active:
+                self.busy_seconds += elapsed
+        self.changed = now
+        self.active += change
+        if change > 0:
+            self.streams += 1
+            self.wait_seconds += waited
+            self.max_active = max(self.max_active, self.active)
+
+    def report(self):
+        return {'limit': self.limit, 'streams': self.streams, 'max_streams': self.max_active,
+                'busy_seconds': round(self.busy_seconds, 3), 'stream_seconds': round(self.stream_seconds, 3),
+                'wait_seconds': round(self.wait_seconds, 3)}
@@ -0,0 +1,304 @@
+"""
+Compresses finished logs and packs older days into monthly archives.
+
+Every script writes one log per day (logs/<name>/YYYY-MM-DD_<name>.log, plus the run's
+.events.jsonl). Left alone they dominate the file count the nightly misc copy and the cleanup walk
+through. The archiver:
+
+1. compresses each finished day's log in place (YYYY-MM-DD_<name>.log.gz, or .zst with
+   [LogArchive] compression = zstd and the zstandard package installed). A run crosses midnight
+   and keeps writing the log it opened the day before, so the files of the running process and
+   any file written to since the run started are left alone, as is a log whose compressed copy
+   already exists,
+2. moves compressed logs older than pack_after_days into logs/archive/<name>/YYYY-MM.zip, stored
+   as they are so nothing is compressed twice, and records each in YYYY-MM.index.json with its
+   date, sizes and line, warning and error counts,
+3. removes monthly archives older than keep_months.
+
+search_logs reads plain, compressed and archived logs alike and uses the indexes to skip months
+outside the requested dates.
+"""
+import os
+import re
+import gzip
+import json
+import shutil
+import logging
+import datetime
+import zipfile
+
+ARCHIVE_DIRECTORY = 'archive'
+LOG_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})_.+\.(log|events\.jsonl)(\.gz|\.zst)?$')
+ARCHIVE_PATTERN = re.compile(r'^(\d{4}-\d{2})\.zip$')
+INDEX_SUFFIX = '.index.json'
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+####### Compression
+def load_zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def get_compression(requested):
+    """
+    The compression to use: zstd needs the optional zstandard package and falls back to gzip.
+    """
+    if requested == 'zstd' and load_zstandard() is None:
+        logging.warning("zstd log compression needs the zstandard package. Using gzip.")
+        return 'gzip'
+    return requested
+
+def open_compressed_writer(path, compression):
+    if compression == 'zstd':
+        return load_zstandard().ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    return gzip.open(path, 'wb')
+
+def open_log_stream(file_name, stream):
+    """
+    Wrap a binary stream of a log file in a decompressor chosen by the file's suffix.
+    """
+    if file_name.endswith('.gz'):
+        return gzip.open(stream, 'rb')
+    if file_name.endswith('.zst'):
+        zstandard = load_zstandard()
+        if zstandard is None:
+            raise RuntimeError(f"{file_name} is zstd compressed and the zstandard package is not installed.")
+        return zstandard.ZstdDecompressor().stream_reader(stream, closefd=True)
+    return stream
+
+def compress_file(path, compression):
+    """
+    Compress a log next to itself and remove the original.
+
+    Returns:
+        str: The compressed file.
+    """
+    target = path + COMPRESSED_SUFFIXES[compression]
+    with open(path, 'rb') as source, open_compressed_writer(target + '.tmp', compression) as writer:
+        shutil.copyfileobj(source, writer)
+    shutil.copystat(path, target + '.tmp')  # keep the modification time the cleanup ages files by
+    os.replace(target + '.tmp', target)
+    os.remove(path)
+    return target
+
+def iterate_lines(file_name, stream):
+    """
+    Decoded lines of a plain or compressed log stream.
+    """
+    with open_log_stream(file_name, stream) as binary:
+        for line in binary:
+            yield line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+####### Archiving
+def get_log_date(file_name):
+    match = LOG_FILE_PATTERN.match(file_name)
+    return datetime.date.fromisoformat(match.group(1)) if match else None
+
+def describe_log(file_name, stream):
+    """
+    Index entry of a log: line, warning and error counts.
+    """
+    lines = warnings = errors = 0
+    for line in iterate_lines(file_name, stream):
+        lines += 1
+        warnings += '[WARNING]' in line
+        errors += '[ERROR]' in line or '[CRITICAL]' in line
+    return {'lines': lines, 'warnings': warnings, 'errors': errors}
+
+def read_index(index_path):
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_index(index_path, index):
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(index_path + '.tmp', index_path)
+
+def pack_file(path, archive_directory):
+    """
+    Move a compressed log into its monthly archive and index it.
+
+    Args:
+        path (str): A compressed log file.
+        archive_directory (str): logs/archive/<name>.
+
+    Returns:
+        str: The monthly archive.
+    """
+    file_name = os.path.basename(path)
+    log_date = get_log_date(file_name)
+    os.makedirs(archive_directory, exist_ok=True)
+    archive_path = os.path.join(archive_directory, f"{log_date:%Y-%m}.zip")
+    index_path = os.path.join(archive_directory, f"{log_date:%Y-%m}{INDEX_SUFFIX}")
+    index = read_index(index_path)
+    with zipfile.ZipFile(archive_path, 'a', zipfile.ZIP_STORED) as archive:
+        if file_name not in archive.namelist():
+            archive.write(path, file_name)
+    with open(path, 'rb') as f:
+        entry = describe_log(file_name, f)
+    entry.update(date=log_date.isoformat(), compressed_bytes=os.path.getsize(path))
+    index[file_name] = entry
+    write_index(index_path, index)
+    os.remove(path)
+    return archive_path
+
+def prune_archives(archive_root, keep_months, today=None):
+    """
+    Remove monthly archives and indexes older than keep_months.
+
+    Returns:
+        int: Archives removed.
+    """
+    today = today or datetime.date.today()
+    oldest = (today.year * 12 + today.month - 1) - keep_months
+    removed = 0
+    for root, dirs, files in os.walk(archive_root):
+        for file_name in files:
+            match = ARCHIVE_PATTERN.match(file_name)
+            if not match:
+                continue
+            year, month = map(int, match.group(1).split('-'))
+            if year * 12 + month - 1 < oldest:
+                for stale in (file_name, match.group(1) + INDEX_SUFFIX):
+                    if os.path.exists(os.path.join(root, stale)):
+                        os.remove(os.path.join(root, stale))
+                removed += 1
+                logging.info(f"Removed log archive {os.path.join(root, file_name)}.")
+    return removed
+
+def is_in_use(path, active_paths, modified_since):
+    """
+    Whether a log may still be written to: it belongs to the running process or was modified
+    after modified_since.
+    """
+    if os.path.normcase(os.path.abspath(path)) in active_paths:
+        return True
+    try:
+        return modified_since is not None and os.path.getmtime(path) >= modified_since
+    except OSError:
+        return True
+
+def archive_logs(logs_directory, settings, today=None, active_paths=(), modified_since=None):
+    """
+    Compress, pack and prune the logs below logs_directory.
+
+    Args:
+        logs_directory (str): [Paths] logs_location, holding one folder per script.
+        settings (LogArchiveConfig): Compression, pack_after_days and keep_months.
+        today (datetime.date, optional): Logs of this day are still being written and left alone.
+        active_paths (list, optional): Files the running process writes to, left alone whatever their date.
+        modified_since (float, optional): Timestamp, usually the run's start. Files modified since
+            are left alone.
+
+    Returns:
+        dict: Counts of compressed, packed and pruned files.
+    """
+    today = today or datetime.date.today()
+    compression = get_compression(settings.compression)
+    counts = {'compressed': 0, 'packed': 0, 'pruned': 0}
+    active_paths = {os.path.normcase(os.path.abspath(path)) for path in active_paths}
+    if not os.path.isdir(logs_directory):
+        return counts
+    for name in sorted(os.listdir(logs_directory)):
+        directory = os.path.join(logs_directory, name)
+        if name == ARCHIVE_DIRECTORY or not os.path.isdir(directory):
+            continue
+        for file_name in sorted(os.listdir(directory)):
+            log_date = get_log_date(file_name)
+            if log_date is None or log_date >= today:
+                continue
+            path = os.path.join(directory, file_name)
+            if is_in_use(path, active_paths, modified_since):
+                continue
+            try:
+                if not file_name.endswith(tuple(COMPRESSED_SUFFIXES.values())):
+                    if any(os.path.exists(path + suffix) for suffix in COMPRESSED_SUFFIXES.values()):
+                        logging.warning(f"Not compressing {path}: a compressed copy already exists.")
+                        continue
+                    path = compress_file(path, compression)
+                    counts['compressed'] += 1
+                if (today - log_date).days >= settings.pack_after_days:
+                    pack_file(path, os.path.join(logs_directory, ARCHIVE_DIRECTORY, name))
+                    counts['packed'] += 1
+            except Exception as e:
+                logging.error(f"Could not archive log {path}: {e}")
+    counts['pruned'] = prune_archives(os.path.join(logs_directory, ARCHIVE_DIRECTORY), settings.keep_months, today)
+    logging.info(f"Log archive: {counts['compressed']} logs compressed, {counts['packed']} packed, {counts['pruned']} archives removed.")
+    return counts
+
+####### Searching
+def iterate_log_sources(logs_directory, name=None, since=None, until=None):
+    """
+    Every log below logs_directory in date order, whether plain, compressed or archived.
+
+    Args:
+        logs_directory (str): [Paths] logs_location.
+        name (str, optional): Only this script's logs, e.g. 'vmmaintenance'.
+        since (datetime.date, optional): First day to include.
+        until (datetime.date, optional): Last day to include.
+
+    Yields:
+        tuple: (script name, source label, file name, a function opening the binary stream)
+    """
+    since = since or datetime.date.min
+    until = until or datetime.date.max
+    sources = []
+    for folder in sorted(os.listdir(logs_directory)) if os.path.isdir(logs_directory) else []:
+        directory = os.path.join(logs_directory, folder)
+        if folder == ARCHIVE_DIRECTORY or not os.path.isdir(directory) or (name and folder != name):
+            continue
+        for file_name in os.listdir(directory):
+            log_date = get_log_date(file_name)
+            if log_date and since <= log_date <= until:
+                path = os.path.join(directory, file_name)
+                sources.append((log_date, path, folder, file_name, lambda path=path: open(path, 'rb')))
+    archive_root = os.path.join(logs_directory, ARCHIVE_DIRECTORY)
+    for folder in sorted(os.listdir(archive_root)) if os.path.isdir(archive_root) else []:
+        if name and folder != name:
+            continue
+        directory = os.path.join(archive_root, folder)
+        for file_name in sorted(os.listdir(directory)):
+            match = ARCHIVE_PATTERN.match(file_name)
+            if not match:
+                continue
+            index = read_index(os.path.join(directory, match.group(1) + INDEX_SUFFIX))
+            archive_path = os.path.join(directory, file_name)
+            for member, entry in index.items():
+                log_date = datetime.date.fromisoformat(entry['date'])
+                if since <= log_date <= until:
+                    sources.append((log_date, f"{archive_path}:{member}", folder, member,
+                                    lambda archive_path=archive_path, member=member: open_archive_member(archive_path, member)))
+    for log_date, label, folder, file_name, opener in sorted(sources, key=lambda source: (source[0], source[1])):
+        yield folder, label, file_name, opener
+
+def open_archive_member(archive_path, member):
+    archive = zipfile.ZipFile(archive_path)
+    stream = archive.open(member)
+    close = stream.close
+
+    def close_both():
+        close()
+        archive.close()
+    stream.close = close_both
+    return stream
+
+def search_logs(logs_directory, pattern, name=None, since=None, until=None):
+    """
+    Find log lines matching a regular expression.
+
+    Yields:
+        tuple: (source label, line)
+    """
+    expression = re.compile(pattern)
+    for _, label, file_name, opener in iterate_log_sources(logs_directory, name, since, until):
+        try:
+            for line in iterate_lines(file_name, opener()):
+                if expression.search(line):
+                    yield label, line
+        except (OSError, RuntimeError, zipfile.BadZipFile) as e:
+            logging.warning(f"Could not read {label}: {e}")
@@ -0,0 +1,262 @@
+"""
+SQLite index of the text logs and run events, for 'vmbackup.py logs query'.
+
+Every log line and every finished phase event becomes one row of the entries table with its time,
+level, script name, VM, phase and message; an FTS5 table over the messages answers word searches.
+The index is incremental: for each log it stores how far it has been read, so an update only reads
+what was written since. The position carries over when the archiver compresses a log or packs it
+into a monthly archive, and logs whose archive was pruned are removed from the index.
+
+Text log lines get the VM whose name they mention. Logged errors also appear as 'log' events in
+the events file; those are skipped since the text log already holds them.
+"""
+import os
+import re
+import json
+import sqlite3
+import datetime
+from contextlib import closing
+from log_archive import COMPRESSED_SUFFIXES, iterate_log_sources, open_log_stream
+
+LOG_LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}) (\d{2}:\d{2}:\d{2}),\d+ \[(\w+)\]: ?(.*)$')
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+LEVEL_NAMES = {number: name for name, number in LEVELS.items()}
+DEFAULT_LIMIT = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (name TEXT, file TEXT, position INTEGER, complete INTEGER, PRIMARY KEY (name, file));
+CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, name TEXT, file TEXT, time TEXT, level INTEGER,
+                                    vm TEXT, phase TEXT, status TEXT, message TEXT);
+CREATE INDEX IF NOT EXISTS entries_by_time ON entries (time);
+CREATE INDEX IF NOT EXISTS entries_by_vm ON entries (vm, time);
+CREATE INDEX IF NOT EXISTS entries_by_source ON entries (name, file);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_text USING fts5 (message, content='entries', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS entries_added AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_text (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_removed AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_text (entries_text, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+"""
+
+####### Reading logs
+def get_logical_name(file_name):
+    """
+    The name of a log before compression, which identifies it in the index wherever it is stored.
+    """
+    for suffix in COMPRESSED_SUFFIXES.values():
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+def read_new_lines(file_name, stream, position, complete):
+    """
+    Lines of a log after a position in its uncompressed content.
+
+    Args:
+        file_name (str): Decides the decompression.
+        stream (file): Binary stream of the log.
+        position (int): Bytes already indexed.
+        complete (bool): Whether the log is finished; otherwise a last line without a line end
+            is still being written and left for the next update.
+
+    Yields:
+        tuple: (position after the line, line)
+    """
+    with open_log_stream(file_name, stream) as binary:
+        offset = 0
+        if binary is stream:
+            offset = binary.seek(position)
+        for line in binary:
+            offset += len(line)
+            if offset <= position:
+                continue
+            if not complete and not line.endswith(b'\n'):
+                return
+            yield offset, line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+def find_vm(message, vm_names):
+    """
+    The first of vm_names (longest first) that a message mentions.
+    """
+    return next((vm for vm in vm_names if vm in message), None)
+
+def parse_log_lines(lines, log_date):
+    """
+    Turn text log lines into entries; lines without a timestamp, such as tracebacks, are added to
+    the message before them.
+
+    Args:
+        lines (iterable): (position, line) pairs from read_new_lines.
+        log_date (str): Date of the log, used for lines before the first timestamp.
+
+    Yields:
+        tuple: (position after the entry, entry dict)
+    """
+    entry, end = None, 0
+    for position, line in lines:
+        match = LOG_LINE_PATTERN.match(line)
+        if match or entry is None:
+            if entry:
+                yield end, entry
+            if match:
+                day, time, level, message = match.groups()
+                entry = {'time': f"{day}T{time}", 'level': LEVELS.get(level, 20), 'message': message}
+            else:
+                entry = {'time': f"{log_date}T00:00:00", 'level': 20, 'message': line}
+        else:
+            entry['message'] += '\n' + line
+        end = position
+    if entry:
+        yield end, entry
+
+def parse_event_lines(lines):
+    """
+    Turn events.jsonl lines into entries, skipping 'log' events and lines that are not JSON.
+
+    Yields:
+        tuple: (position after the line, entry dict or None)
+    """
+    for position, line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            yield position, None
+            continue
+        if event.get('phase') == 'log':
+            yield position, None
+            continue
+        status = event.get('status') or 'ok'
+        labels = ' '.join(f"{key}={value}" for key, value in (event.get('labels') or {}).items())
+        message = ' '.join(filter(None, (event.get('phase'), status, labels, event.get('error'))))
+        yield position, {'time': event.get('time'), 'level': LEVELS['INFO'] if status == 'ok' else LEVELS['ERROR'],
+                         'vm': event.get('vm'), 'phase': event.get('phase'), 'status': status, 'message': message}
+
+####### Index
+def open_index(database):
+    """
+    Open the index database, creating its tables if needed.
+    """
+    directory = os.path.dirname(database)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(database)
+    connection.executescript(SCHEMA)
+    return connection
+
+def remove_source(connection, name, file):
+    connection.execute('DELETE FROM entries WHERE name = ? AND file = ?', (name, file))
+    connection.execute('DELETE FROM sources WHERE name = ? AND file = ?', (name, file))
+
+def index_source(connection, name, file, file_name, stream, position, complete, vm_names):
+    """
+    Add the lines of one log written after position.
+
+    Returns:
+        int: Entries added.
+    """
+    lines = read_new_lines(file_name, stream, position, complete)
+    if file.endswith('.log'):
+        parsed = parse_log_lines(lines, file[:10])
+    else:
+        parsed = parse_event_lines(lines)
+    added = 0
+    for position, entry in parsed:
+        if entry is None:
+            continue
+        vm = entry.get('vm') or find_vm(entry['message'], vm_names)
+        connection.execute('INSERT INTO entries (name, file, time, level, vm, phase, status, message) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (name, file, entry['time'], entry['level'], vm, entry.get('phase'), entry.get('status'), entry['message']))
+        added += 1
+    connection.execute('INSERT OR REPLACE INTO sources (name, file, position, complete) VALUES (?, ?, ?, ?)',
+                       (name, file, position, int(complete)))
+    return added
+
+def update_index(database, logs_directory, vm_names=()):
+    """
+    Bring the index up to date with the logs below logs_directory.
+
+    Args:
+        database (str): Index database file.
+        logs_directory (str): [Paths] logs_location.
+        vm_names (iterable): VM names to tag text log lines with.
+
+    Returns:
+        dict: Counts of logs read, entries added and logs removed.
+    """
+    vm_names = sorted(vm_names, key=len, reverse=True)
+    counts = {'sources': 0, 'entries': 0, 'removed': 0}
+    with closing(open_index(database)) as connection:
+        known = {(name, file): (position, complete)
+                 for name, file, position, complete in connection.execute('SELECT name, file, position, complete FROM sources')}
+        seen = set()
+        for name, label, file_name, opener in iterate_log_sources(logs_directory):
+            file = get_logical_name(file_name)
+            seen.add((name, file))
+            position, complete = known.get((name, file), (0, 0))
+            compressed = file != file_name
+            if complete:
+                continue
+            if not compressed:
+                size = os.path.getsize(label)
+                if size == position:
+                    continue
+                if size < position:  # rewritten since it was indexed
+                    remove_source(connection, name, file)
+                    position = 0
+            with connection:
+                counts['entries'] += index_source(connection, name, file, file_name, opener(), position, compressed, vm_names)
+            known[(name, file)] = (position, compressed)
+            counts['sources'] += 1
+        if os.path.isdir(logs_directory):
+            with connection:
+                for name, file in set(known) - seen:
+                    remove_source(connection, name, file)
+                    counts['removed'] += 1
+    return counts
+
+def query_index(database, text=None, vm=None, phase=None, level=None, since=None, until=None, name=None, limit=DEFAULT_LIMIT):
+    """
+    Find index entries.
+
+    Args:
+        database (str): Index database file.
+        text (str, optional): FTS5 query over the messages, e.g. 'export AND failed' or '"disk full"'.
+        vm (str, optional): Only entries of this VM.
+        phase (str, optional): Only events of this phase, e.g. 'export'.
+        level (str, optional): Minimum level, e.g. 'WARNING'.
+        since (datetime.date, optional): First day.
+        until (datetime.date, optional): Last day.
+        name (str, optional): Only this script's logs, e.g. 'vmmaintenance'.
+        limit (int): Most recent entries returned.
+
+    Returns:
+        list: Entry dicts (time, level, name, vm, phase, status, message), oldest first.
+
+    Raises:
+        sqlite3.OperationalError: If text is not a valid FTS5 query.
+    """
+    clauses, parameters = [], []
+    if text:
+        clauses.append('id IN (SELECT rowid FROM entries_text WHERE entries_text MATCH ?)')
+        parameters.append(text)
+    for column, value in (('vm', vm), ('phase', phase), ('name', name)):
+        if value:
+            clauses.append(f'{column} = ?')
+            parameters.append(value)
+    if level:
+        clauses.append('level >= ?')
+        parameters.append(LEVELS[level.upper()])
+    if since:
+        clauses.append('time >= ?')
+        parameters.append(since.isoformat())
+    if until:
+        clauses.append('time < ?')
+        parameters.append((until + datetime.timedelta(days=1)).isoformat())
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    with closing(open_index(database)) as connection:
+        rows = connection.execute(f'SELECT time, level, name, vm, phase, status, message FROM entries {where} '
+                                  'ORDER BY time DESC, id DESC LIMIT ?', parameters + [limit]).fetchall()
+    return [{'time': time, 'level': LEVEL_NAMES.get(level_number, str(level_number)), 'name': script, 'vm': vm_name,
+             'phase': phase_name, 'status': status, 'message': message}
+            for time, level_number, script, vm_name, phase_name, status, message in reversed(rows)]
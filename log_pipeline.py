@@ -0,0 +1,175 @@
+"""
+Background logging for the maintenance scripts.
+
+Threads that log only put the record on a bounded queue; a QueueListener thread writes it to the
+console and the log file. A slow console or a log folder being synced by OneDrive then no longer
+holds up exports, copies or cleanups. When the queue is full, records below WARNING are dropped and
+counted instead of blocking; warnings and errors wait for space so they are never lost.
+
+Per-item messages (each file copied or checked, each snapshot) are logged at DEBUG through
+SampledLog, which writes an INFO summary every [Logging] sample_every items and at the end.
+
+start_logging can be called any number of times: calls for the log file already in use change
+nothing, and a call for another file moves the pipeline to it.
+"""
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s]: %(message)s'
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_SAMPLE_EVERY = 100
+
+_pipeline = {'listener': None, 'handler': None, 'log_file_path': None, 'queue_size': None, 'sample_every': DEFAULT_SAMPLE_EVERY}
+_pipeline_lock = threading.Lock()
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops and counts records below WARNING when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                with self.dropped_lock:
+                    self.dropped += 1
+
+def start_logging(log_file_path, level=logging.INFO, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Send the root logger's records through the queue to the console and a log file.
+
+    Args:
+        log_file_path (str): Log file to append to.
+        level (int or str): Root logger level.
+        queue_size (int): Records the queue holds before INFO and DEBUG records are dropped.
+
+    Returns:
+        bool: True if the pipeline was started, False if it already wrote to log_file_path.
+    """
+    with _pipeline_lock:
+        if _pipeline['listener'] and _pipeline['log_file_path'] == log_file_path and _pipeline['queue_size'] == queue_size:
+            logging.getLogger().setLevel(level)
+            return False
+        _stop_pipeline()
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = [logging.StreamHandler(), logging.FileHandler(log_file_path)]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        log_queue = queue.Queue(queue_size)
+        queue_handler = BoundedQueueHandler(log_queue)
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _pipeline.update(listener=listener, handler=queue_handler, log_file_path=log_file_path, queue_size=queue_size)
+        return True
+
+def apply_logging_config(logging_config):
+    """
+    Apply the [Logging] section once the configuration is loaded.
+
+    Args:
+        logging_config (LoggingConfig): Level, queue size and sampling interval.
+    """
+    _pipeline['sample_every'] = logging_config.sample_every
+    if _pipeline['log_file_path']:
+        start_logging(_pipeline['log_file_path'], logging_config.level, logging_config.queue_size)
+    else:
+        logging.getLogger().setLevel(logging_config.level)
+
+def flush_logging():
+    """
+    Wait until every queued record has been written, e.g. before the log file is emailed.
+    """
+    with _pipeline_lock:
+        listener, handler = _pipeline['listener'], _pipeline['handler']
+    if listener is None:
+        return
+    handler.queue.join()
+    for target in listener.handlers:
+        target.flush()
+
+def get_dropped_count():
+    """
+    Records dropped because the queue was full since the pipeline started.
+    """
+    handler = _pipeline['handler']
+    return handler.dropped if handler else 0
+
+def get_log_file_path():
+    """
+    The log file the pipeline writes to, or None before start_logging.
+    """
+    return _pipeline['log_file_path']
+
+def stop_logging():
+    """
+    Write out the queue and close the log file. Registered to run at exit.
+    """
+    with _pipeline_lock:
+        _stop_pipeline()
+
+def _stop_pipeline():
+    listener, handler = _pipeline['listener'], _pipeline['handler']
+    if listener is None:
+        return
+    logging.getLogger().removeHandler(handler)
+    listener.stop()
+    if handler.dropped:
+        record = logging.makeLogRecord({'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                        'msg': f"{handler.dropped} log records were dropped because the log queue was full."})
+        for target in listener.handlers:
+            target.handle(record)
+    for target in listener.handlers:
+        target.close()
+    _pipeline.update(listener=None, handler=None, log_file_path=None, queue_size=None)
+
+class SampledLog:
+    """
+    Logs each item at DEBUG and a running count at INFO every sample_every items.
+
+    Use as a context manager so the total is logged when the loop ends:
+
+        with SampledLog(f"Files checked in '{path}'") as checked:
+            for file_name in files:
+                checked.item(f"Checking file '{file_name}'")
+    """
+
+    def __init__(self, label, every=None):
+        self.label = label
+        self.every = every or _pipeline['sample_every']
+        self.count = 0
+
+    def item(self, message=None):
+        """
+        Count an item and log its message at DEBUG.
+        """
+        self.count += 1
+        if message:
+            logging.debug(message)
+        if self.count % self.every == 0:
+            logging.info(f"{self.label}: {self.count} so far" + (f", latest: {message}" if message else '.'))
+
+    def close(self):
+        if self.count:
+            logging.info(f"{self.label}: {self.count} in total.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+atexit.register(stop_logging)
@@ -1,15 +1,16 @@
 import logging
 import os
 import shutil
-from vm_process import configure_logging, read_config, copy_last_day_of_month, file_directory_list
+from vm_config import get_config
+from vm_process import configure_logging, copy_last_day_of_month, file_directory_list
 
 def main():
     try:
         configure_logging("vmrunninglogs")
-        Paths = read_config("Paths")
+        Paths = get_config().paths
 
-        files = file_directory_list(Paths['source_daily_backup_path'])
-        copy_last_day_of_month(files, Paths['source_monthly_backup_path'])
+        files = file_directory_list(Paths.source_daily_backup_path)
+        copy_last_day_of_month(files, Paths.source_monthly_backup_path)
         print("Completed")
             
     except Exception as e:
@@ -0,0 +1,478 @@
+"""
+Delivers notifications (the run digest, watchdog alerts) through an on-disk outbox.
+
+notify only writes the message to [Notifications] outbox, one JSON file per message
+and channel, and wakes a background thread that delivers it. A slow or unreachable mail server
+therefore no longer holds up the end of a run or a host restart, and a message that cannot be
+delivered stays in the outbox and is retried with exponential backoff, also by the next process
+that starts delivery. After max_attempts it is moved to the outbox's 'failed' folder.
+
+Every process that notifies (a run, the resident watchdog) delivers the same outbox. A process
+claims each message before sending it by moving it into its own 'sending/<pid>' folder, which only
+one process can do, so no message is sent twice. Claims left by a process that died while sending
+are returned to the outbox after CLAIM_TIMEOUT seconds.
+
+Channels:
+    smtp     all due messages go out over one SMTP connection
+    webhook  JSON POST of subject and body to webhook_url (e.g. a Teams or Slack incoming webhook)
+    file     writes each message and its attachments to file_directory
+"""
+import os
+import json
+import time
+import uuid
+import base64
+import logging
+import datetime
+import threading
+
+FAILED_DIRECTORY = 'failed'
+SENDING_DIRECTORY = 'sending'
+CLAIM_TIMEOUT = 15 * 60
+
+####### Messages
+def create_message(channel, subject, body, html_body=None, attachments=()):
+    """
+    Build an outbox message.
+
+    Args:
+        channel (str): Name of the channel delivering it.
+        subject (str): Subject line.
+        body (str): Plain text body.
+        html_body (str, optional): HTML body.
+        attachments (list, optional): (file name, bytes) tuples.
+
+    Returns:
+        dict: The message, ready to be written to the outbox.
+    """
+    return {
+        'id': f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}",
+        'channel': channel,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'subject': subject,
+        'body': body,
+        'html_body': html_body,
+        'attachments': [{'name': name, 'data': base64.b64encode(content).decode('ascii')} for name, content in attachments],
+        'attempts': 0,
+        'next_attempt': 0.0,
+        'last_error': None,
+    }
+
+def get_attachments(message):
+    return [(attachment['name'], base64.b64decode(attachment['data'])) for attachment in message['attachments']]
+
+def build_email(message, from_email, to_email):
+    """
+    Turn an outbox message into a MIME email.
+
+    Returns:
+        email.mime.multipart.MIMEMultipart: The email.
+    """
+    # Imported here so quick probes that never send mail do not pay for the email packages.
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.application import MIMEApplication
+
+    msg = MIMEMultipart()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Subject'] = message['subject']
+    if message['html_body']:
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText(message['body'], 'plain'))
+        alternative.attach(MIMEText(message['html_body'], 'html'))
+        msg.attach(alternative)
+    else:
+        msg.attach(MIMEText(message['body'], 'plain'))
+    for file_name, content in get_attachments(message):
+        attachment = MIMEApplication(content, Name=file_name)
+        attachment['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        msg.attach(attachment)
+    return msg
+
+####### Channels
+class SMTPChannel:
+    """
+    Sends email, reusing one connection for every message of a batch.
+    """
+
+    def __init__(self, server, port, username=None, password=None, from_email=None, to_email=None, starttls=True, timeout=30):
+        self.server = server
+        self.port = int(port or 587)
+        self.username = username
+        self.password = password
+        self.from_email = from_email
+        self.to_email = to_email
+        self.starttls = starttls
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the channel from [SMTP], [Notifications] and the email_* environment variables.
+        """
+        return cls(config.smtp.server, os.getenv("email_port"), os.getenv("email_username"), os.getenv("email_password"),
+                   os.getenv("email_from"), os.getenv("email_to"), config.notifications.starttls, config.notifications.timeout)
+
+    def send_batch(self, messages):
+        """
+        Send messages over one connection.
+
+        Returns:
+            list: None for each delivered message, or the error that stopped it.
+        """
+        import smtplib
+        results = []
+        try:
+            with smtplib.SMTP(self.server, self.port, timeout=self.timeout) as server:
+                if self.starttls:
+                    server.starttls()
+                if self.username:
+                    server.login(self.username, self.password)
+                for message in messages:
+                    try:
+                        server.sendmail(self.from_email, self.to_email, build_email(message, self.from_email, self.to_email).as_string())
+                        results.append(None)
+                    except smtplib.SMTPException as e:
+                        results.append(e)
+        except (OSError, smtplib.SMTPException) as e:
+            results += [e] * (len(messages) - len(results))
+        return results
+
+class WebhookChannel:
+    """
+    Posts {"subject", "text", "attachments"} as JSON to a URL. Attachments are listed by name only.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.notifications.webhook_url, config.notifications.timeout)
+
+    def send_batch(self, messages):
+        import urllib.request
+        results = []
+        for message in messages:
+            payload = {'subject': message['subject'], 'text': f"{message['subject']}\n\n{message['body']}",
+                       'attachments': [attachment['name'] for attachment in message['attachments']]}
+            request = urllib.request.Request(self.url, json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    results.append(None)
+            except OSError as e:
+                results.append(e)
+        return results
+
+class FileChannel:
+    """
+    Writes each message as '<id>.txt' (plus '<id>.html' and its attachments) to a directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.notifications.file_directory)
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                base = os.path.join(self.directory, message['id'])
+                with open(base + '.txt', 'w', encoding='utf-8') as f:
+                    f.write(f"Subject: {message['subject']}\n\n{message['body']}\n")
+                if message['html_body']:
+                    with open(base + '.html', 'w', encoding='utf-8') as f:
+                        f.write(message['html_body'])
+                for file_name, content in get_attachments(message):
+                    with open(f"{base}_{file_name}", 'wb') as f:
+                        f.write(content)
+                results.append(None)
+            except OSError as e:
+                results.append(e)
+        return results
+
+CHANNELS = {'smtp': SMTPChannel, 'webhook': WebhookChannel, 'file': FileChannel}
+
+####### Outbox
+class Outbox:
+    """
+    Messages waiting for delivery, one JSON file each.
+    """
+
+    def __init__(self, directory, owner=None):
+        """
+        Args:
+            directory (str): The outbox folder.
+            owner (str, optional): Name of this process's sending folder. Defaults to the PID.
+        """
+        self.directory = directory
+        self.sending_directory = os.path.join(directory, SENDING_DIRECTORY, owner or str(os.getpid()))
+
+    def add(self, message):
+        os.makedirs(self.directory, exist_ok=True)
+        self.save(message)
+
+    def save(self, message):
+        path = self.path_of(message)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(message, f)
+        os.replace(path + '.tmp', path)
+
+    def path_of(self, message):
+        return os.path.join(self.directory, f"{message['id']}.{message['channel']}.json")
+
+    def claimed_path_of(self, message):
+        return os.path.join(self.sending_directory, os.path.basename(self.path_of(message)))
+
+    def messages(self):
+        """
+        All waiting messages, oldest first. Unreadable files are skipped.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        messages = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    messages.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping unreadable outbox message {name}: {e}")
+        return messages
+
+    def claim(self, message):
+        """
+        Take a message for delivery by moving it into this process's sending folder.
+
+        Returns:
+            dict or None: The message as claimed, or None if another process claimed it first.
+        """
+        os.makedirs(self.sending_directory, exist_ok=True)
+        claimed_path = self.claimed_path_of(message)
+        try:
+            os.rename(self.path_of(message), claimed_path)
+        except FileNotFoundError:
+            return None
+        os.utime(claimed_path)  # the claim's age is measured from now
+        try:
+            with open(claimed_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping unreadable outbox message {claimed_path}: {e}")
+            return None
+
+    def remove(self, message):
+        """
+        Remove a claimed message after it was delivered.
+        """
+        os.remove(self.claimed_path_of(message))
+
+    def release(self, message):
+        """
+        Put a claimed message back into the outbox with its updated attempts.
+        """
+        self.save(message)
+        os.remove(self.claimed_path_of(message))
+
+    def move_to_failed(self, message):
+        failed_directory = os.path.join(self.directory, FAILED_DIRECTORY)
+        os.makedirs(failed_directory, exist_ok=True)
+        os.replace(self.claimed_path_of(message), os.path.join(failed_directory, os.path.basename(self.path_of(message))))
+
+    def release_stale_claims(self, now=None):
+        """
+        Return messages claimed more than CLAIM_TIMEOUT seconds ago to the outbox. Their process
+        died while sending them.
+
+        Returns:
+            int: Messages returned.
+        """
+        now = time.time() if now is None else now
+        sending_root = os.path.join(self.directory, SENDING_DIRECTORY)
+        released = 0
+        for owner in os.listdir(sending_root) if os.path.isdir(sending_root) else []:
+            owner_directory = os.path.join(sending_root, owner)
+            for name in os.listdir(owner_directory) if os.path.isdir(owner_directory) else []:
+                path = os.path.join(owner_directory, name)
+                try:
+                    if now - os.path.getmtime(path) > CLAIM_TIMEOUT:
+                        os.replace(path, os.path.join(self.directory, name))
+                        released += 1
+                        logging.warning(f"Returned notification {name} left in {owner_directory} to the outbox.")
+                except OSError:
+                    pass  # delivered or returned by its owner meanwhile
+        return released
+
+def get_retry_delay(attempts, settings):
+    """
+    Seconds to wait after a failed attempt: retry_seconds doubled per attempt, up to max_retry_seconds.
+    """
+    return min(settings.retry_seconds * 2 ** (attempts - 1), settings.max_retry_seconds)
+
+def deliver_due(outbox, channels, settings, now=None):
+    """
+    Try every message that is due, batched per channel. Each message is claimed first, so a
+    message another process is already sending is left to it.
+
+    Args:
+        outbox (Outbox): The outbox.
+        channels (dict): Channel name -> channel object.
+        settings (NotificationsConfig): Retry settings.
+        now (float, optional): time.time() of this round.
+
+    Returns:
+        int: Messages delivered.
+    """
+    now = time.time() if now is None else now
+    outbox.release_stale_claims(now)
+    due = {}
+    for message in outbox.messages():
+        if message['next_attempt'] <= now:
+            claimed = outbox.claim(message)
+            if claimed:
+                due.setdefault(claimed['channel'], []).append(claimed)
+    delivered = 0
+    for channel_name, messages in due.items():
+        channel = channels.get(channel_name)
+        results = channel.send_batch(messages) if channel else [ValueError(f"Channel '{channel_name}' is not configured.")] * len(messages)
+        for message, error in zip(messages, results):
+            try:
+                if error is None:
+                    outbox.remove(message)
+                    delivered += 1
+                    logging.info(f"Notification '{message['subject']}' sent by {channel_name}.")
+                    continue
+                message['attempts'] += 1
+                message['last_error'] = str(error)
+                if message['attempts'] >= settings.max_attempts:
+                    outbox.move_to_failed(message)
+                    logging.error(f"Giving up on notification '{message['subject']}' by {channel_name} after "
+                                  f"{message['attempts']} attempts: {error}")
+                else:
+                    delay = get_retry_delay(message['attempts'], settings)
+                    message['next_attempt'] = now + delay
+                    outbox.release(message)
+                    logging.warning(f"Notification '{message['subject']}' by {channel_name} failed ({error}). "
+                                    f"Retrying in {delay:.0f}s.")
+            except OSError as e:
+                logging.warning(f"Could not update outbox message '{message['subject']}': {e}")
+    return delivered
+
+class Dispatcher:
+    """
+    Background thread delivering the outbox until it is empty.
+    """
+
+    def __init__(self, outbox, channels, settings):
+        self.outbox = outbox
+        self.channels = channels
+        self.settings = settings
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def wake(self):
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='notifications', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            try:
+                deliver_due(self.outbox, self.channels, self.settings)
+            except Exception as e:
+                logging.error(f"Notification delivery failed: {e}")
+            waiting = self.outbox.messages()
+            with self.condition:
+                self.condition.notify_all()
+                if not waiting:
+                    self.thread = None
+                    return
+                delay = max(min(message['next_attempt'] for message in waiting) - time.time(), 0)
+                self.condition.wait(delay)
+
+    def flush(self, timeout):
+        """
+        Wait until the outbox is empty or every waiting message was tried and is backing off.
+
+        Args:
+            timeout (float): Longest wait in seconds.
+
+        Returns:
+            bool: True if the outbox is empty.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.condition.notify_all()
+            while True:
+                waiting = self.outbox.messages()
+                if not waiting or self.thread is None or all(message['next_attempt'] > time.time() for message in waiting):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+        return not self.outbox.messages()
+
+_current = {'dispatcher': None}
+_current_lock = threading.Lock()
+
+def build_channels(config):
+    return {name: CHANNELS[name].from_config(config) for name in config.notifications.channels}
+
+def get_dispatcher(config):
+    """
+    Get the process wide dispatcher, creating it for the configured outbox and channels.
+    """
+    with _current_lock:
+        if _current['dispatcher'] is None:
+            settings = config.notifications
+            _current['dispatcher'] = Dispatcher(Outbox(settings.outbox), build_channels(config), settings)
+        return _current['dispatcher']
+
+def notify(subject, body, config, html_body=None, attachments=()):
+    """
+    Queue a message for every configured channel and start delivering it in the background.
+
+    Args:
+        subject (str): Subject line.
+        body (str): Plain text body.
+        config (AppConfig): Loaded configuration.
+        html_body (str, optional): HTML body.
+        attachments (list, optional): (file name, bytes) tuples.
+    """
+    dispatcher = get_dispatcher(config)
+    for channel in config.notifications.channels:
+        dispatcher.outbox.add(create_message(channel, subject, body, html_body, attachments))
+    dispatcher.wake()
+
+def resume_delivery(config):
+    """
+    Start delivering messages left in the outbox by an earlier process.
+    """
+    dispatcher = get_dispatcher(config)
+    if dispatcher.outbox.messages():
+        logging.info("Delivering notifications left in the outbox.")
+        dispatcher.wake()
+
+def flush_notifications(config, timeout=None):
+    """
+    Give queued notifications a bounded chance to go out before the process exits or the host
+    restarts. Whatever is left stays in the outbox for the next run.
+
+    Returns:
+        bool: True if the outbox is empty.
+    """
+    timeout = config.notifications.flush_timeout if timeout is None else timeout
+    delivered = get_dispatcher(config).flush(timeout)
+    if not delivered:
+        logging.warning(f"Notifications are still waiting in {config.notifications.outbox}; they will be retried later.")
+    return delivered
@@ -0,0 +1,265 @@
+"""
+Splits an OVA export into fixed-size segments with a manifest of SHA-256 hashes.
+
+Single multi-GB files are slow to retry and sync badly to OneDrive. A segmented export is a
+directory next to the daily exports:
+
+    Windows11P6_2024-01-31.ova.segments/
+        part0001
+        part0002
+        ...
+        manifest.json
+
+The segments are written straight from byte ranges of the export, so the OVA is never copied
+locally a second time. Each segment is hashed while it is written and only renamed to its final
+name once the hash matches the manifest; missing or damaged segments can be retried on their own.
+While a copy is in progress its manifest is kept as manifest.pending.json and only renamed to
+manifest.json once every segment is in place, so a directory without manifest.json is unfinished. On restore the
+segments are verified while they are concatenated back into the OVA or streamed to a reader.
+"""
+import os
+import json
+import hashlib
+
+SEGMENTS_SUFFIX = '.segments'
+MANIFEST_NAME = 'manifest.json'
+PENDING_MANIFEST_NAME = 'manifest.pending.json'
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+class SegmentError(Exception):
+    """
+    A segment is missing or its contents do not match the manifest.
+    """
+
+def get_segments_directory(directory, file_name):
+    """
+    Directory holding the segments of an export.
+
+    Args:
+        directory (str): Backup directory, e.g. the NAS daily folder.
+        file_name (str): File name of the export.
+
+    Returns:
+        str: '<directory>/<file_name>.segments'.
+    """
+    return os.path.join(directory, file_name + SEGMENTS_SUFFIX)
+
+def segment_name(index):
+    return f"part{index:04d}"
+
+def read_range(path, offset, length):
+    """
+    Read a byte range of a file in READ_BUFFER_SIZE chunks.
+
+    Yields:
+        bytes: The next chunk.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(READ_BUFFER_SIZE, length))
+            if not chunk:
+                raise SegmentError(f"{path} ended {length} bytes before the end of the segment.")
+            length -= len(chunk)
+            yield chunk
+
+def build_manifest(export_file, segment_size):
+    """
+    Hash an export segment by segment in one read.
+
+    Args:
+        export_file (str): The OVA to split.
+        segment_size (int): Bytes per segment; the last segment may be shorter.
+
+    Returns:
+        dict: File name, size, SHA-256 of the whole file, segment size and the segments with
+        their name, offset, size and SHA-256.
+    """
+    size = os.path.getsize(export_file)
+    whole = hashlib.sha256()
+    segments = []
+    for index, offset in enumerate(range(0, size, segment_size), 1):
+        length = min(segment_size, size - offset)
+        digest = hashlib.sha256()
+        for chunk in read_range(export_file, offset, length):
+            digest.update(chunk)
+            whole.update(chunk)
+        segments.append({'name': segment_name(index), 'offset': offset, 'size': length, 'sha256': digest.hexdigest()})
+    return {'file': os.path.basename(export_file), 'size': size, 'sha256': whole.hexdigest(),
+            'segment_size': segment_size, 'segments': segments}
+
+def write_segment(export_file, segment, segments_directory):
+    """
+    Write one segment from its byte range of the export.
+
+    The segment is written under a temporary name and renamed once its hash matches.
+
+    Args:
+        export_file (str): The OVA being split.
+        segment (dict): Segment entry from build_manifest.
+        segments_directory (str): Destination segments directory.
+
+    Returns:
+        int: Bytes written.
+
+    Raises:
+        SegmentError: If the written data does not match the manifest hash.
+    """
+    os.makedirs(segments_directory, exist_ok=True)
+    segment_path = os.path.join(segments_directory, segment['name'])
+    partial_path = segment_path + '.partial'
+    digest = hashlib.sha256()
+    try:
+        with open(partial_path, 'wb') as f:
+            for chunk in read_range(export_file, segment['offset'], segment['size']):
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != segment['sha256']:
+            raise SegmentError(f"Segment {segment['name']} of {export_file} does not match its manifest hash.")
+        os.replace(partial_path, segment_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return segment['size']
+
+def write_manifest(segments_directory, manifest, name=MANIFEST_NAME):
+    manifest_path = os.path.join(segments_directory, name)
+    with open(manifest_path + '.partial', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.partial', manifest_path)
+
+def read_manifest(segments_directory, name=MANIFEST_NAME):
+    """
+    Load the manifest of a segmented copy.
+
+    Args:
+        segments_directory (str): Segments directory.
+        name (str): MANIFEST_NAME, or PENDING_MANIFEST_NAME for a copy in progress.
+
+    Returns:
+        dict or None: The manifest, or None if it is absent or unreadable.
+    """
+    try:
+        with open(os.path.join(segments_directory, name), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def start_segmented_copy(segments_directory, manifest):
+    """
+    Start or continue copying an export as segments.
+
+    Segments left by an earlier attempt are kept when that attempt copied the same export with
+    the same segment size; otherwise the copy starts over.
+
+    Args:
+        segments_directory (str): Destination segments directory.
+        manifest (dict): Manifest of the export, from build_manifest.
+
+    Returns:
+        list: Segment entries still to write.
+    """
+    os.makedirs(segments_directory, exist_ok=True)
+    earlier = read_manifest(segments_directory) or read_manifest(segments_directory, PENDING_MANIFEST_NAME)
+    same_export = earlier is not None and all(earlier.get(key) == manifest[key] for key in ('sha256', 'segment_size'))
+    if os.path.exists(os.path.join(segments_directory, MANIFEST_NAME)) and not same_export:
+        os.remove(os.path.join(segments_directory, MANIFEST_NAME))
+    write_manifest(segments_directory, manifest, PENDING_MANIFEST_NAME)
+    return find_missing_segments(manifest, segments_directory) if same_export else list(manifest['segments'])
+
+def finish_segmented_copy(segments_directory):
+    """
+    Mark a segmented copy as complete once every segment is written.
+    """
+    os.replace(os.path.join(segments_directory, PENDING_MANIFEST_NAME), os.path.join(segments_directory, MANIFEST_NAME))
+
+def find_missing_segments(manifest, segments_directory):
+    """
+    Segments that are absent or have the wrong size. Cheap enough to run against a share.
+
+    Returns:
+        list: Segment entries to (re)write.
+    """
+    missing = []
+    for segment in manifest['segments']:
+        try:
+            if os.path.getsize(os.path.join(segments_directory, segment['name'])) != segment['size']:
+                missing.append(segment)
+        except OSError:
+            missing.append(segment)
+    return missing
+
+def is_complete(segments_directory, size=None):
+    """
+    Check a segmented copy has its manifest and every segment at the right size.
+
+    Args:
+        segments_directory (str): Segments directory.
+        size (int, optional): Expected size of the whole export.
+
+    Returns:
+        bool: True if complete.
+    """
+    manifest = read_manifest(segments_directory)
+    return bool(manifest) and (size is None or manifest['size'] == size) and not find_missing_segments(manifest, segments_directory)
+
+def stream_segments(segments_directory):
+    """
+    Read an export back from its segments, checking each segment's hash as it is read.
+
+    A damaged segment raises after its data was yielded, so a reader must discard what it
+    received when SegmentError is raised, as reassemble does.
+
+    Yields:
+        bytes: The export's contents in order.
+
+    Raises:
+        SegmentError: If the manifest is missing or a segment is missing or damaged.
+    """
+    manifest = read_manifest(segments_directory)
+    if manifest is None:
+        raise SegmentError(f"No manifest in {segments_directory}.")
+    for segment in manifest['segments']:
+        segment_path = os.path.join(segments_directory, segment['name'])
+        if not os.path.isfile(segment_path):
+            raise SegmentError(f"Segment {segment['name']} is missing from {segments_directory}.")
+        digest = hashlib.sha256()
+        for chunk in read_range(segment_path, 0, segment['size']):
+            digest.update(chunk)
+            yield chunk
+        if digest.hexdigest() != segment['sha256']:
+            raise SegmentError(f"Segment {segment['name']} in {segments_directory} is damaged.")
+
+def reassemble(segments_directory, output_file):
+    """
+    Rebuild an export from its segments and check the whole file's hash.
+
+    Args:
+        segments_directory (str): Segments directory.
+        output_file (str): Path of the OVA to write.
+
+    Returns:
+        int: Size of the rebuilt export.
+
+    Raises:
+        SegmentError: If a segment is missing or damaged or the result does not match the manifest.
+    """
+    manifest = read_manifest(segments_directory)
+    if manifest is None:
+        raise SegmentError(f"No manifest in {segments_directory}.")
+    partial_file = output_file + '.partial'
+    whole = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial_file, 'wb') as f:
+            for chunk in stream_segments(segments_directory):
+                whole.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        if size != manifest['size'] or whole.hexdigest() != manifest['sha256']:
+            raise SegmentError(f"Reassembled {manifest['file']} does not match its manifest.")
+        os.replace(partial_file, output_file)
+    finally:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+    return size
@@ -0,0 +1,227 @@
+import os
+import re
+import time
+import logging
+from collections import deque, namedtuple
+
+DEFAULT_MAX_LINES = 2000
+DEFAULT_MAX_LINE_LENGTH = 4096
+PERCENT_PATTERN = re.compile(r'(\d{1,3})%')
+
+ProgressEvent = namedtuple('ProgressEvent', ['label', 'percent', 'elapsed', 'eta'])
+
+####### Bounded output capture
+class OutputBuffer:
+    """
+    Keeps the last max_lines lines of a command's output.
+
+    Text arrives in arbitrary chunks; complete lines are returned from feed() as they appear and
+    the oldest lines are dropped once the buffer is full, so a command printing one line per file
+    for hours uses a fixed amount of memory.
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, max_line_length=DEFAULT_MAX_LINE_LENGTH):
+        self.lines = deque(maxlen=max_lines)
+        self.max_line_length = max_line_length
+        self.partial = ''
+        self.total_lines = 0
+
+    def feed(self, text):
+        """
+        Add a chunk of output.
+
+        Args:
+            text (str): Decoded output, possibly ending mid line.
+
+        Returns:
+            list: Lines completed by this chunk, without line endings.
+        """
+        self.partial += text
+        if '\n' not in self.partial:
+            if len(self.partial) > self.max_line_length:
+                self.partial = self.partial[-self.max_line_length:]
+            return []
+        *complete, self.partial = self.partial.split('\n')
+        lines = [line.rstrip('\r')[:self.max_line_length] for line in complete]
+        self.lines.extend(lines)
+        self.total_lines += len(lines)
+        return lines
+
+    def close(self):
+        """
+        Flush a final line that had no line ending.
+
+        Returns:
+            list: The final line, if there was one.
+        """
+        if not self.partial:
+            return []
+        line, self.partial = self.partial.rstrip('\r'), ''
+        self.lines.append(line)
+        self.total_lines += 1
+        return [line]
+
+    @property
+    def dropped_lines(self):
+        return self.total_lines - len(self.lines)
+
+    def text(self):
+        """
+        Get the retained output.
+
+        Returns:
+            str: Retained lines, preceded by a marker line if older lines were dropped.
+        """
+        lines = list(self.lines)
+        if self.dropped_lines:
+            lines.insert(0, f"[... {self.dropped_lines} earlier lines not kept ...]")
+        return ''.join(f"{line}\n" for line in lines)
+
+####### Progress tracking
+def format_duration(seconds):
+    """
+    Format seconds as e.g. '1h02m', '3m05s' or '42s'.
+    """
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def log_progress(event):
+    eta = f", ETA {format_duration(event.eta)}" if event.eta is not None else ''
+    logging.info(f"{event.label}: {event.percent:.0f}% after {format_duration(event.elapsed)}{eta}")
+
+class ProgressTracker:
+    """
+    Turns progress percentages into throttled ProgressEvents with an ETA.
+
+    An event is reported when progress has moved at least min_step percent, or min_interval
+    seconds have passed, since the last report. Subclasses parse a command's output and call update().
+    """
+
+    def __init__(self, label, report=log_progress, min_step=10, min_interval=60, clock=time.monotonic):
+        self.label = label
+        self.report = report
+        self.min_step = min_step
+        self.min_interval = min_interval
+        self.clock = clock
+        self.started = clock()
+        self.percent = 0.0
+        self.last_reported = (0.0, self.started)
+
+    def update(self, percent):
+        """
+        Record new progress and report it if it is worth reporting.
+
+        Args:
+            percent (float): Progress from 0 to 100.
+
+        Returns:
+            ProgressEvent or None: The reported event.
+        """
+        percent = min(max(percent, self.percent), 100.0)
+        self.percent = percent
+        now = self.clock()
+        last_percent, last_time = self.last_reported
+        if percent < 100 and percent - last_percent < self.min_step and now - last_time < self.min_interval:
+            return None
+        if percent == last_percent:
+            return None
+        elapsed = now - self.started
+        eta = elapsed * (100 - percent) / percent if 0 < percent < 100 else None
+        event = ProgressEvent(self.label, percent, elapsed, eta)
+        self.last_reported = (percent, now)
+        if self.report:
+            self.report(event)
+        return event
+
+    def feed_text(self, text):
+        """Receive a raw stdout chunk. Overridden by parsers of unterminated progress output."""
+
+    def feed_line(self, line):
+        """Receive a complete stdout line. Overridden by line based parsers."""
+
+class VBoxProgressParser(ProgressTracker):
+    """
+    Parses VBoxManage's '0%...10%...20%' progress, which is printed without line breaks.
+    """
+
+    def feed_text(self, text):
+        percents = [int(value) for value in PERCENT_PATTERN.findall(text) if int(value) <= 100]
+        if percents:
+            self.update(max(percents))
+
+class CopyProgressParser(ProgressTracker):
+    """
+    Tracks 'xcopy /F' output, which prints one 'source -> destination' line per file.
+
+    Progress is measured in bytes when the sizes of the source files are known, otherwise in files.
+    """
+
+    def __init__(self, label, file_sizes, source_root=None, **kwargs):
+        """
+        Args:
+            label (str): Label used in progress events.
+            file_sizes (dict): Size of each source file, keyed by its path relative to source_root.
+            source_root (str, optional): Directory the copy reads from, stripped from copied paths.
+        """
+        super().__init__(label, **kwargs)
+        self.file_sizes = {self.normalize(name): size for name, size in file_sizes.items()}
+        self.source_root = self.normalize(source_root).rstrip('/') + '/' if source_root else None
+        self.names = {}  # base name -> relative paths, for lines whose source is not below source_root
+        for name in self.file_sizes:
+            self.names.setdefault(name.rsplit('/', 1)[-1], []).append(name)
+        self.total_bytes = sum(self.file_sizes.values())
+        self.total_files = len(self.file_sizes)
+        self.copied_bytes = 0
+        self.copied_files = 0
+
+    def feed_line(self, line):
+        if '->' not in line:
+            return
+        source = self.normalize(line.split('->')[0].strip())
+        if self.source_root and source.startswith(self.source_root):
+            source = source[len(self.source_root):]
+        size = self.file_sizes.pop(source, None)
+        if size is None:
+            candidates = [name for name in self.names.get(source.rsplit('/', 1)[-1], ()) if name in self.file_sizes]
+            if candidates:
+                ending = [name for name in candidates if source.endswith('/' + name)]
+                size = self.file_sizes.pop(max(ending, key=len) if ending else candidates[0])
+            else:
+                size = 0
+        self.copied_files += 1
+        self.copied_bytes += size
+        if self.total_bytes:
+            self.update(100.0 * self.copied_bytes / self.total_bytes)
+        elif self.total_files:
+            self.update(100.0 * self.copied_files / self.total_files)
+
+    @staticmethod
+    def normalize(path):
+        return path.replace('\\', '/').lower()
+
+    @classmethod
+    def for_directory(cls, label, directory, **kwargs):
+        """
+        Build a parser sized from the files below a directory, keyed by their path relative to it
+        so same-named files in different subdirectories are all counted.
+
+        Args:
+            label (str): Label used in progress events.
+            directory (str): Source directory of the copy.
+
+        Returns:
+            CopyProgressParser: The parser.
+        """
+        sizes = {}
+        for root, dirs, files in os.walk(directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    sizes[os.path.relpath(path, directory)] = os.path.getsize(path)
+                except OSError:
+                    sizes[os.path.relpath(path, directory)] = 0
+        return cls(label, sizes, source_root=directory, **kwargs)
@@ -0,0 +1,27 @@
+import os
+import logging
+from vm_config import get_config
+from notifications import flush_notifications
+from vm_process import VMAction, manage_vm_action, configure_logging, load_environment_variables, send_log_email
+
+def main():
+    log_file_path = configure_logging("osrestart")
+    load_environment_variables()
+    config = get_config()
+    os.chdir(config.paths.virtual_box_path)
+    for vm_name in config.vm_details.vm_names:
+        manage_vm_action(vm_name, VMAction.POWER_OFF)
+    logging.info(f"All VM's powered off. Host PC about to restart")
+    restart_computer(log_file_path, config)
+
+def restart_computer(log_file_path, config):
+    try:
+        logging.info(f"Restart about to be initiated")
+        send_log_email(log_file_path, config)
+        flush_notifications(config)
+        os.system("shutdown /r /t 0")
+    except Exception as e:
+        logging.info(f"An error occurred executing the restart: {e}")
+
+if __name__ == "__main__":
+    main()
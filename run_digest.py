@@ -0,0 +1,112 @@
+"""
+Builds the run digest email: a short text and HTML report with the full log attached.
+
+The digest leads with errors, then a per VM status table with durations and bytes, copy totals
+and the last lines of the log. Its content comes from the run summary of run_events, so it stays
+the same size however long the log gets. The log itself is read from the end for the tail and
+streamed through gzip for the attachment; it is never loaded whole.
+"""
+import io
+import os
+import gzip
+import html
+import shutil
+import datetime
+
+TAIL_LINES = 40
+TAIL_BLOCK_SIZE = 64 * 1024
+# The gzipped log is only attached up to this size, to stay under common SMTP message limits.
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024
+ERROR_MARKERS = ('[ERROR]', '[CRITICAL]')
+
+def tail_lines(path, count=TAIL_LINES):
+    """
+    Read the last lines of a file by reading blocks backwards from its end.
+
+    Args:
+        path (str): Text file.
+        count (int): Lines to return.
+
+    Returns:
+        list: Up to count lines, oldest first, without line endings.
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return data.decode('utf-8', errors='replace').splitlines()[-count:]
+
+def gzip_file(path, max_bytes=MAX_ATTACHMENT_BYTES):
+    """
+    Compress a file in chunks.
+
+    Returns:
+        bytes or None: The gzip data, or None if it is larger than max_bytes.
+    """
+    buffer = io.BytesIO()
+    with open(path, 'rb') as source, gzip.GzipFile(filename=os.path.basename(path), mode='wb', fileobj=buffer) as target:
+        shutil.copyfileobj(source, target)
+    return buffer.getvalue() if buffer.tell() <= max_bytes else None
+
+def format_size(size):
+    return f"{size / 1024 / 1024 / 1024:.2f} GB" if size >= 1024 ** 3 else f"{size / 1024 / 1024:.1f} MB"
+
+def format_ms(duration_ms):
+    return str(datetime.timedelta(seconds=round((duration_ms or 0) / 1000)))
+
+def build_digest(summary, log_lines, title):
+    """
+    Render the digest.
+
+    Args:
+        summary (dict or None): Run summary from run_events, or None for scripts without one.
+        log_lines (list): Last lines of the log.
+        title (str): Heading and email subject.
+
+    Returns:
+        tuple: (subject, text body, HTML body)
+    """
+    summary = summary or {}
+    errors = summary.get('errors') or [line for line in log_lines if any(marker in line for marker in ERROR_MARKERS)]
+    status = summary.get('status') or ('errors' if errors else 'ok')
+    subject = f"{title}: {status.upper()}"
+    rows = [(vm, entry['status'], format_ms(entry['duration_ms']), format_size(entry['bytes']),
+             ', '.join(phase for phase, phase_status in entry['phases'].items() if phase_status != 'ok'))
+            for vm, entry in summary.get('vms', {}).items()]
+    copies = summary.get('copies')
+    facts = []
+    if summary:
+        facts.append(f"Run time: {format_ms(summary.get('duration_ms'))}")
+    if copies:
+        facts.append(f"Copies: {copies['count']} ({copies['failed']} failed), {format_size(copies['bytes'])}")
+    if summary.get('failed_phases'):
+        facts.append(f"Failed phases: {', '.join(summary['failed_phases'])}")
+    if summary.get('regressions'):
+        facts.append(f"Slower than usual: {', '.join(summary['regressions'])}")
+
+    text = [subject, '']
+    if errors:
+        text += ['Errors:'] + [f"  {error}" for error in errors] + ['']
+    if rows:
+        text += [f"{'VM':<30} {'Status':<8} {'Duration':>10} {'Bytes':>12}  Failed steps"]
+        text += [f"{vm:<30} {vm_status:<8} {duration:>10} {size:>12}  {failed}" for vm, vm_status, duration, size, failed in rows]
+        text.append('')
+    text += facts + ['', f"Last {len(log_lines)} log lines:"] + log_lines
+
+    page = [f"<h2>{html.escape(subject)}</h2>"]
+    if errors:
+        page.append("<h3>Errors</h3><ul>" + ''.join(f"<li>{html.escape(error)}</li>" for error in errors) + "</ul>")
+    if rows:
+        page.append("<table border='1' cellpadding='4' cellspacing='0'><tr><th>VM</th><th>Status</th><th>Duration</th>"
+                    "<th>Bytes</th><th>Failed steps</th></tr>")
+        for row in rows:
+            color = '#e6ffe6' if row[1] == 'ok' else '#ffe6e6'
+            page.append(f"<tr style='background:{color}'>" + ''.join(f"<td>{html.escape(str(value))}</td>" for value in row) + "</tr>")
+        page.append("</table>")
+    page.append("<ul>" + ''.join(f"<li>{html.escape(fact)}</li>" for fact in facts) + "</ul>")
+    page.append(f"<h3>Last {len(log_lines)} log lines</h3><pre>{html.escape(chr(10).join(log_lines))}</pre>")
+    return subject, '\n'.join(text), '\n'.join(page)
@@ -0,0 +1,209 @@
+"""
+Structured record of a run, written next to its text log.
+
+    logs/vmmaintenance/2024-01-31_vmmaintenance.log            the human log
+    logs/vmmaintenance/2024-01-31_vmmaintenance.events.jsonl   one JSON event per line
+    logs/vmmaintenance/2024-01-31_vmmaintenance.summary.json   compact summary of the last run
+
+An event is written for every finished phase and for every ERROR or CRITICAL log message:
+
+    {"time": "2024-01-31T23:41:02", "run": "2024-01-31T22:00:03", "vm": "Windows11P6",
+     "phase": "export", "status": "ok", "duration_ms": 5811000, "bytes": 42949672960,
+     "error": null, "labels": {}}
+
+The summary holds each VM's outcome, the copy totals, failed phases, counters and the first
+errors, so the email and other tools can report on a run without parsing the text log.
+"""
+import os
+import json
+import logging
+import datetime
+import threading
+from run_metrics import phase_key, write_atomically
+
+EVENTS_SUFFIX = '.events.jsonl'
+SUMMARY_SUFFIX = '.summary.json'
+MAX_SUMMARY_ERRORS = 20
+
+def get_event_paths(log_file_path):
+    """
+    Paths of the event log and summary belonging to a text log.
+
+    Args:
+        log_file_path (str): The text log, e.g. from configure_logging.
+
+    Returns:
+        tuple: (events file, summary file)
+    """
+    base = os.path.splitext(log_file_path)[0]
+    return base + EVENTS_SUFFIX, base + SUMMARY_SUFFIX
+
+class EventLog:
+    """
+    Appends the events of one run to a JSON-lines file.
+    """
+
+    def __init__(self, path, run):
+        """
+        Args:
+            path (str): Events file; several runs on one day append to the same file.
+            run (str): Identifies the run in every event, its start time.
+        """
+        self.path = path
+        self.run = run
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def write(self, phase, status, vm=None, duration_ms=None, size=None, error=None, **labels):
+        """
+        Append one event.
+
+        Args:
+            phase (str): Phase name, or 'log' for an error message.
+            status (str): 'ok', 'failed' or 'error'.
+            vm (str, optional): VM the event belongs to.
+            duration_ms (int, optional): Duration of the phase.
+            size (int, optional): Bytes the phase moved.
+            error (str, optional): Error message.
+            **labels: Other labels of the phase, such as destination.
+        """
+        event = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'run': self.run, 'vm': vm,
+                 'phase': phase, 'status': status, 'duration_ms': duration_ms, 'bytes': size, 'error': error,
+                 'labels': labels}
+        line = json.dumps(event, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            if error and len(self.errors) < MAX_SUMMARY_ERRORS:
+                self.errors.append(error)
+
+    def phase_finished(self, record):
+        """
+        RunMetrics listener writing each finished phase as an event.
+        """
+        labels = dict(record['labels'])
+        vm = labels.pop('vm', None)
+        self.write(record['phase'], record['status'], vm, round(record['seconds'] * 1000), record['bytes'],
+                   record.get('error'), **labels)
+
+class ErrorEventHandler(logging.Handler):
+    """
+    Logging handler recording ERROR and CRITICAL messages as 'log' events.
+    """
+
+    def __init__(self, event_log):
+        super().__init__(logging.ERROR)
+        self.event_log = event_log
+
+    def emit(self, record):
+        try:
+            self.event_log.write('log', 'error', error=record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+_current = {'event_log': None, 'handler': None}
+
+def start_event_log(log_file_path, metrics):
+    """
+    Start writing the events of a run next to its text log.
+
+    Args:
+        log_file_path (str): The text log.
+        metrics (RunMetrics): Metrics of the run; each finished phase becomes an event.
+
+    Returns:
+        EventLog: The event log.
+    """
+    stop_event_log()
+    events_path, _ = get_event_paths(log_file_path)
+    event_log = EventLog(events_path, metrics.started.isoformat(timespec='seconds'))
+    metrics.listeners.append(event_log.phase_finished)
+    handler = ErrorEventHandler(event_log)
+    logging.getLogger().addHandler(handler)
+    _current.update(event_log=event_log, handler=handler)
+    return event_log
+
+def stop_event_log():
+    if _current['handler']:
+        logging.getLogger().removeHandler(_current['handler'])
+    _current.update(event_log=None, handler=None)
+
+def build_run_summary(metrics_summary, event_log=None):
+    """
+    Condense a run into the summary document.
+
+    Args:
+        metrics_summary (dict): RunMetrics.summary() or the result of write_run_metrics.
+        event_log (EventLog, optional): Supplies the error messages and file names.
+
+    Returns:
+        dict: Run status ('ok', 'degraded' when something other than a VM failed, 'failed' when a
+        VM failed), duration, per VM outcome, copy totals, failed phases, counters and errors.
+    """
+    vms = {}
+    failed_phases = []
+    copies = {'count': 0, 'failed': 0, 'bytes': 0}
+    for record in metrics_summary.get('phases', []):
+        duration_ms = round(record['seconds'] * 1000)
+        if record['status'] != 'ok':
+            failed_phases.append(phase_key(record))
+        vm = record['labels'].get('vm')
+        if vm:
+            entry = vms.setdefault(vm, {'status': 'ok', 'duration_ms': 0, 'bytes': 0, 'phases': {}})
+            entry['phases'][record['phase']] = record['status']
+            entry['duration_ms'] += duration_ms
+            entry['bytes'] += record['bytes'] or 0
+            if record['status'] != 'ok':
+                entry['status'] = 'failed'
+        if record['phase'] == 'copy':
+            copies['count'] += 1
+            copies['failed'] += record['status'] != 'ok'
+            copies['bytes'] += record['bytes'] or 0
+    errors = list(event_log.errors) if event_log else []
+    if any(entry['status'] != 'ok' for entry in vms.values()):
+        status = 'failed'
+    elif failed_phases or errors:
+        status = 'degraded'
+    else:
+        status = 'ok'
+    return {
+        'run': metrics_summary.get('started'),
+        'status': status,
+        'duration_ms': round(metrics_summary.get('total_seconds', 0) * 1000),
+        'vms': vms,
+        'copies': copies,
+        'failed_phases': failed_phases,
+        'regressions': [regression['phase'] for regression in metrics_summary.get('regressions', [])],
+        'counters': metrics_summary.get('counters', {}),
+        'errors': errors,
+        'events_file': event_log.path if event_log else None,
+    }
+
+def write_run_summary(log_file_path, summary):
+    """
+    Write the summary next to the text log, replacing the previous run's summary of that day.
+
+    Returns:
+        str: The summary file, or None if it could not be written.
+    """
+    _, summary_path = get_event_paths(log_file_path)
+    try:
+        write_atomically(summary_path, json.dumps(summary, indent=2, default=str))
+        return summary_path
+    except OSError as e:
+        logging.error(f"Could not write the run summary: {e}")
+        return None
+
+def read_run_summary(log_file_path):
+    """
+    Load the summary written next to a text log.
+
+    Returns:
+        dict or None: The summary, or None if there is none.
+    """
+    _, summary_path = get_event_paths(log_file_path)
+    try:
+        with open(summary_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
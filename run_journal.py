@@ -0,0 +1,220 @@
+"""
+Append-only journal of a maintenance run.
+
+Every step of the run (per VM: power_off, snapshot, export, snapshot_retention, power_on; then
+file_management and email) is written as one JSON line when it starts and when it finishes:
+
+    {"time": "2024-01-31T22:04:11", "vm": "Windows11P6", "step": "export", "status": "started"}
+    {"time": "2024-01-31T23:41:02", "vm": "Windows11P6", "step": "export", "status": "done"}
+
+Each line is written with a single write() and flushed to disk with fsync before the step goes on,
+so after a crash or power cut the journal shows exactly which steps finished. A run that ends
+normally writes a final 'run' 'done' line; 'vm_process.py --resume' picks up a journal without one
+if its run started today or the previous night.
+"""
+import os
+import json
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+
+JOURNAL_SUFFIX = '.jsonl'
+JOURNAL_NAME_FORMAT = '%Y-%m-%d_%H%M%S'
+
+class RunJournal:
+    """
+    Writes one run's journal and answers which steps already finished.
+    """
+
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = list(entries or [])
+        self.lock = threading.Lock()
+
+    def record(self, step, status, vm=None, **details):
+        """
+        Append a state transition and force it to disk.
+
+        Args:
+            step (str): Step name such as 'export'.
+            status (str): 'started', 'done' or 'failed'.
+            vm (str, optional): VM the step belongs to; None for run level steps.
+            **details: Extra fields stored with the entry.
+        """
+        entry = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'vm': vm, 'step': step, 'status': status, **details}
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        with self.lock:
+            descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, line)
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+            self.entries.append(entry)
+
+    @contextmanager
+    def step(self, step, vm=None):
+        """
+        Record a step as started, then as done or failed.
+
+        The block can set status['status'] = 'failed' for failures that do not raise. An exception
+        records the step as failed and is re-raised.
+
+        Args:
+            step (str): Step name.
+            vm (str, optional): VM the step belongs to.
+
+        Yields:
+            dict: {'status': 'done'}, which the block may change.
+        """
+        self.record(step, 'started', vm)
+        status = {'status': 'done'}
+        try:
+            yield status
+        except Exception:
+            status['status'] = 'failed'
+            raise
+        finally:
+            self.record(step, status['status'], vm)
+
+    def last_status(self, step, vm=None):
+        """
+        Get the most recent status of a step.
+
+        Returns:
+            str or None: 'started', 'done', 'failed', or None if the step never started.
+        """
+        for entry in reversed(self.entries):
+            if entry['step'] == step and entry['vm'] == vm:
+                return entry['status']
+        return None
+
+    def is_done(self, step, vm=None):
+        return self.last_status(step, vm) == 'done'
+
+    def is_finished(self):
+        return self.is_done('run')
+
+    def started_at(self):
+        """
+        When the run started, taken from the journal's file name.
+
+        Returns:
+            datetime.datetime or None: None if the name is not one start_journal writes.
+        """
+        try:
+            return datetime.datetime.strptime(os.path.basename(self.path)[:-len(JOURNAL_SUFFIX)], JOURNAL_NAME_FORMAT)
+        except ValueError:
+            return None
+
+    def resume(self):
+        """
+        Mark the run as resumed. Called once the resuming run holds the maintenance lock.
+        """
+        with open(self.path, 'rb+') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')  # end a line cut short by the crash so new entries start on their own line
+        self.record('run', 'resumed')
+
+    def vms_left_off(self):
+        """
+        VMs that were powered off (or being powered off) and not started again.
+
+        Returns:
+            list: VM names in journal order.
+        """
+        names = []
+        for entry in self.entries:
+            vm = entry['vm']
+            if vm and vm not in names and self.last_status('power_off', vm) in ('started', 'done') \
+                    and self.last_status('power_on', vm) != 'done':
+                names.append(vm)
+        return names
+
+def read_entries(path):
+    """
+    Read a journal, ignoring a last line cut short by a crash.
+
+    Args:
+        path (str): Journal file.
+
+    Returns:
+        list: Entries in the order they were written.
+    """
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logging.warning(f"Ignoring damaged journal line {number} in {path}.")
+    return entries
+
+def list_journals(directory):
+    """
+    Journal files in a directory, newest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if name.endswith(JOURNAL_SUFFIX)), reverse=True)
+    return [os.path.join(directory, name) for name in names]
+
+def start_journal(directory, keep_runs):
+    """
+    Start the journal of a new run and remove the oldest journals.
+
+    Args:
+        directory (str): Journal directory.
+        keep_runs (int): Number of journals to keep, including the new one.
+
+    Returns:
+        RunJournal: The new journal.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{datetime.datetime.now().strftime(JOURNAL_NAME_FORMAT)}{JOURNAL_SUFFIX}")
+    for old_path in list_journals(directory)[max(keep_runs - 1, 0):]:
+        try:
+            os.remove(old_path)
+        except OSError as e:
+            logging.warning(f"Could not remove old journal {old_path}: {e}")
+    journal = RunJournal(path)
+    journal.record('run', 'started')
+    return journal
+
+def find_unfinished_journal(directory):
+    """
+    Load the newest journal if its run did not finish. The journal is only read; RunJournal.resume
+    marks it once the run may go on.
+
+    Args:
+        directory (str): Journal directory.
+
+    Returns:
+        RunJournal or None: The journal to resume, or None if the last run finished.
+    """
+    journals = list_journals(directory)
+    if not journals:
+        return None
+    journal = RunJournal(journals[0], read_entries(journals[0]))
+    if journal.is_finished():
+        return None
+    return journal
+
+def is_resumable(journal, now=None):
+    """
+    Whether a journal belongs to today's run or the previous night's. Older unfinished runs are
+    not continued: the VMs, exports and shares have moved on since.
+
+    Args:
+        journal (RunJournal): An unfinished journal.
+        now (datetime.datetime, optional): Current time, replaceable in tests.
+
+    Returns:
+        bool: True if the run may be resumed.
+    """
+    started = journal.started_at()
+    now = now or datetime.datetime.now()
+    return started is not None and started.date() >= (now - datetime.timedelta(days=1)).date()
@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'vmbackup'
+
+####### Collection
+class RunMetrics:
+    """
+    Timers, counters and gauges for one maintenance run.
+
+    Every timed phase becomes one record holding its labels (vm, destination, ...), duration,
+    status and, where known, the bytes it moved. Records are kept in order so the run summary
+    reads like a timeline of the run.
+    """
+
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.phases = []
+        self.counters = {}
+        self.gauges = {}
+        self.devices = {}
+        self.listeners = []  # called with each finished phase record, e.g. by run_events
+        self.lock = threading.Lock()  # phases may finish on the command engine's worker threads
+
+    @contextmanager
+    def phase(self, name, **labels):
+        """
+        Time a block of work.
+
+        The yielded record can be updated by the block, e.g. record['bytes'] = size or
+        record['status'] = 'failed'. An exception marks the phase failed, is kept as the record's
+        'error' and is re-raised.
+
+        Args:
+            name (str): Phase name such as 'export' or 'copy'.
+            **labels: Extra labels identifying the work, e.g. vm='Windows11P6'.
+
+        Yields:
+            dict: The phase record.
+        """
+        record = {'phase': name, 'labels': labels, 'status': 'ok', 'bytes': None}
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['status'] = 'failed'
+            record['error'] = str(e)
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 3)
+            if record['bytes'] and record['seconds'] > 0:
+                record['mb_per_second'] = round(record['bytes'] / 1024 / 1024 / record['seconds'], 2)
+            with self.lock:
+                self.phases.append(record)
+            for listener in self.listeners:
+                try:
+                    listener(record)
+                except Exception as e:
+                    logging.warning(f"Phase listener failed: {e}")
+            logging.info(f"Phase {name} {format_labels(labels)} finished in {record['seconds']:.1f}s "
+                         f"({record['status']}{format_throughput(record)})")
+
+    def increment(self, name, value=1):
+        """
+        Add to a counter.
+
+        Args:
+            name (str): Counter name.
+            value (int): Amount to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """
+        Set a gauge to its current value.
+
+        Args:
+            name (str): Gauge name.
+            value (float): The value.
+        """
+        self.gauges[name] = value
+
+    def record_device_usage(self, report):
+        """
+        Store the per device usage reported by the command engine.
+
+        Args:
+            report (dict): Device -> usage, from CommandEngine.device_report().
+        """
+        self.devices = report
+
+    def summary(self):
+        """
+        Build the JSON run summary.
+
+        Returns:
+            dict: Run start, total duration, phases, counters, gauges and device usage.
+        """
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'total_seconds': round((datetime.datetime.now() - self.started).total_seconds(), 3),
+            'phases': self.phases,
+            'counters': self.counters,
+            'gauges': self.gauges,
+            'devices': self.devices,
+        }
+
+_current = {'metrics': RunMetrics()}
+
+def get_metrics():
+    """
+    Get the metrics of the current run.
+
+    Returns:
+        RunMetrics: The process wide metrics object.
+    """
+    return _current['metrics']
+
+def reset_metrics():
+    """
+    Start collecting a new run.
+
+    Returns:
+        RunMetrics: The new metrics object.
+    """
+    _current['metrics'] = RunMetrics()
+    return _current['metrics']
+
+def phase_timer(name, **labels):
+    """
+    Time a phase of the current run. See RunMetrics.phase.
+    """
+    return get_metrics().phase(name, **labels)
+
+####### Formatting helpers
+def format_labels(labels):
+    return ' '.join(f"{key}='{value}'" for key, value in labels.items())
+
+def format_throughput(record):
+    if not record.get('bytes'):
+        return ''
+    text = f", {record['bytes'] / 1024 / 1024:.1f} MB"
+    if 'mb_per_second' in record:
+        text += f" at {record['mb_per_second']:.1f} MB/s"
+    return text
+
+def get_directory_size(directory):
+    """
+    Total size in bytes of the files below a directory.
+
+    Args:
+        directory (str): Directory to measure.
+
+    Returns:
+        int: Size in bytes, 0 if the directory cannot be read.
+    """
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total
+
+def phase_key(record):
+    """
+    Identify a phase across runs, e.g. 'export vm=Windows11P6'.
+
+    Args:
+        record (dict): A phase record.
+
+    Returns:
+        str: Phase name followed by its sorted labels.
+    """
+    labels = ' '.join(f"{key}={value}" for key, value in sorted(record['labels'].items()))
+    return f"{record['phase']} {labels}".strip()
+
+def merge_phases(records):
+    """
+    Sum records of the same phase, labels and status into one record, e.g. the copies of several
+    exports between the same two directories, the segments of one export, or a VM started twice
+    when a run is resumed. Seconds add up even where the records overlapped in time.
+
+    Args:
+        records (list): Phase records in run order.
+
+    Returns:
+        list: One record per phase, labels and status, in order of first appearance.
+    """
+    merged = {}
+    for record in records:
+        status = record.get('status', 'ok')
+        total = merged.get((phase_key(record), status))
+        if total is None:
+            total = merged[(phase_key(record), status)] = {'phase': record['phase'], 'labels': dict(record['labels']),
+                                                           'status': status, 'seconds': 0.0, 'bytes': None}
+        total['seconds'] = round(total['seconds'] + record['seconds'], 3)
+        if record.get('bytes'):
+            total['bytes'] = (total['bytes'] or 0) + record['bytes']
+    for total in merged.values():
+        if total['bytes'] and total['seconds'] > 0:
+            total['mb_per_second'] = round(total['bytes'] / 1024 / 1024 / total['seconds'], 2)
+    return list(merged.values())
+
+####### Writers
+def write_atomically(path, text):
+    """
+    Write a file via a temporary name so readers never see a partial file.
+
+    Args:
+        path (str): Destination file.
+        text (str): Content.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as f:
+        f.write(text)
+    os.replace(temporary_path, path)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_prometheus(summary):
+    """
+    Render a run summary in the Prometheus text exposition format.
+
+    Phases recorded more than once with the same labels are summed, since the textfile collector
+    rejects a file holding the same series twice.
+
+    Args:
+        summary (dict): Output of RunMetrics.summary().
+
+    Returns:
+        str: Metrics for the node_exporter textfile collector.
+    """
+    lines = [
+        f"# HELP {METRIC_PREFIX}_run_duration_seconds Duration of the last maintenance run.",
+        f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+        f"{METRIC_PREFIX}_run_duration_seconds {summary['total_seconds']}",
+        f"# TYPE {METRIC_PREFIX}_run_start_timestamp_seconds gauge",
+        f"{METRIC_PREFIX}_run_start_timestamp_seconds {datetime.datetime.fromisoformat(summary['started']).timestamp():.0f}",
+    ]
+    series = {'phase_duration_seconds': 'seconds', 'phase_bytes': 'bytes', 'phase_throughput_mb_per_second': 'mb_per_second'}
+    for metric, field in series.items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} gauge")
+        for record in merge_phases(summary['phases']):
+            if record.get(field) is None:
+                continue
+            labels = dict(record['labels'], phase=record['phase'], status=record['status'])
+            label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in sorted(labels.items()))
+            lines.append(f"{METRIC_PREFIX}_{metric}{{{label_text}}} {record[field]}")
+    for name, value in sorted(summary['counters'].items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+        lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+    for name, value in sorted(summary['gauges'].items()):
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        lines.append(f"{METRIC_PREFIX}_{name} {value}")
+    devices = summary.get('devices', {})
+    for field in ('limit', 'streams', 'max_streams', 'busy_seconds', 'stream_seconds', 'wait_seconds', 'utilization'):
+        if devices:
+            lines.append(f"# TYPE {METRIC_PREFIX}_device_{field} gauge")
+        for device, usage in sorted(devices.items()):
+            value = usage['busy_seconds'] / summary['total_seconds'] if field == 'utilization' else usage[field]
+            if field == 'utilization' and not summary['total_seconds']:
+                continue
+            lines.append(f'{METRIC_PREFIX}_device_{field}{{device="{escape_label(device)}"}} {round(value, 3)}')
+    return '\n'.join(lines) + '\n'
+
+####### Regression check
+def load_previous_summaries(summary_directory, count):
+    """
+    Load the most recent run summaries.
+
+    Args:
+        summary_directory (str): Directory holding one JSON summary per run.
+        count (int): Maximum number of summaries to load.
+
+    Returns:
+        list: Summaries, newest first.
+    """
+    if not os.path.isdir(summary_directory):
+        return []
+    names = sorted((name for name in os.listdir(summary_directory) if name.endswith('.json')), reverse=True)
+    summaries = []
+    for name in names[:count]:
+        try:
+            with open(os.path.join(summary_directory, name)) as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping unreadable run summary {name}: {e}")
+    return summaries
+
+def find_regressions(summary, previous_summaries, factor, min_seconds):
+    """
+    Compare phase durations with the median of previous runs. Records of the same phase and labels
+    are summed per run first.
+
+    Args:
+        summary (dict): The current run summary.
+        previous_summaries (list): Earlier run summaries.
+        factor (float): A phase is flagged when it took longer than factor x its median.
+        min_seconds (float): Phases shorter than this are never flagged, to ignore noise.
+
+    Returns:
+        list: One dictionary per regressed phase with its key, seconds and median.
+    """
+    import statistics
+    history = {}
+    for previous in previous_summaries:
+        for record in merge_phases(previous.get('phases', [])):
+            if record['status'] == 'ok':
+                history.setdefault(phase_key(record), []).append(record['seconds'])
+    regressions = []
+    for record in merge_phases(summary['phases']):
+        durations = history.get(phase_key(record))
+        if not durations or record['seconds'] < min_seconds:
+            continue
+        median = statistics.median(durations)
+        if median > 0 and record['seconds'] > factor * median:
+            regressions.append({'phase': phase_key(record), 'seconds': record['seconds'], 'median_seconds': median})
+    return regressions
+
+def write_run_metrics(settings, metrics=None):
+    """
+    Write the Prometheus textfile and the JSON run summary, flagging regressions against earlier runs.
+
+    Args:
+        settings (MetricsConfig): Metrics section of the configuration.
+        metrics (RunMetrics, optional): Metrics to write. Defaults to the current run.
+
+    Returns:
+        dict: The summary that was written, including any regressions.
+    """
+    metrics = metrics or get_metrics()
+    summary = metrics.summary()
+    previous = load_previous_summaries(settings.summary_directory, settings.history_runs)
+    summary['regressions'] = find_regressions(summary, previous, settings.regression_factor, settings.regression_min_seconds)
+    for regression in summary['regressions']:
+        logging.warning(f"Slower than usual: {regression['phase']} took {regression['seconds']:.0f}s "
+                        f"(median {regression['median_seconds']:.0f}s)")
+    try:
+        file_name = f"{metrics.started.strftime('%Y-%m-%d_%H%M%S')}.json"
+        write_atomically(os.path.join(settings.summary_directory, file_name), json.dumps(summary, indent=2))
+        write_atomically(settings.textfile_path, render_prometheus(summary))
+    except OSError as e:
+        logging.error(f"Could not write run metrics: {e}")
+    return summary
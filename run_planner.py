@@ -0,0 +1,150 @@
+"""
+Predicts how long a run will take from earlier runs and decides what optional work fits the window.
+
+History comes from the JSON run summaries written by run_metrics, which hold every phase's
+duration, labels and bytes; records of the same phase and labels within one run, such as the
+copies of several exports between two folders, count as one. Durations are smoothed with an exponentially weighted moving average,
+so the estimate follows a VM that keeps growing without being thrown by a single slow night. Where
+a phase moved a known number of bytes, the average throughput is used instead and scaled by
+today's size, which tracks a backup folder that grew since the last run.
+
+Optional work is deferred in DEFERRAL_ORDER when the prediction runs past [Planning] window_end.
+"""
+import logging
+import datetime
+from run_metrics import merge_phases, phase_key
+
+DEFAULT_ALPHA = 0.3
+# Categories of optional work, in the order they are given up.
+DEFERRAL_ORDER = ('monthly', 'offsite')
+
+def ewma(values, alpha=DEFAULT_ALPHA):
+    """
+    Exponentially weighted moving average.
+
+    Args:
+        values (list): Observations, oldest first.
+        alpha (float): Weight of each new observation.
+
+    Returns:
+        float or None: The average, or None without observations.
+    """
+    average = None
+    for value in values:
+        average = value if average is None else alpha * value + (1 - alpha) * average
+    return average
+
+class RunPlanner:
+    """
+    Duration estimates built from earlier run summaries.
+    """
+
+    def __init__(self, summaries, alpha=DEFAULT_ALPHA):
+        """
+        Args:
+            summaries (list): Run summaries, newest first as returned by load_previous_summaries.
+            alpha (float): EWMA weight of the most recent run.
+        """
+        self.alpha = alpha
+        self.history = {}
+        self.downtimes = {}
+        for summary in reversed(summaries):
+            per_vm = {}
+            for record in merge_phases(summary.get('phases', [])):
+                if record['status'] != 'ok':
+                    continue
+                self.history.setdefault(phase_key(record), []).append(record)
+                vm_name = record.get('labels', {}).get('vm')
+                if vm_name:
+                    per_vm[vm_name] = per_vm.get(vm_name, 0.0) + record['seconds']
+            for vm_name, seconds in per_vm.items():
+                self.downtimes.setdefault(vm_name, []).append(seconds)
+
+    def phase_seconds(self, phase, current_bytes=None, **labels):
+        """
+        Estimate one phase.
+
+        Args:
+            phase (str): Phase name such as 'copy'.
+            current_bytes (int, optional): Bytes the phase will move this time.
+            **labels: Labels identifying the phase, as passed to phase_timer.
+
+        Returns:
+            float or None: Expected seconds, or None if the phase was never recorded.
+        """
+        records = self.history.get(phase_key({'phase': phase, 'labels': labels}))
+        if not records:
+            return None
+        rates = [record['bytes'] / record['seconds'] for record in records if record.get('bytes') and record['seconds'] > 0]
+        if current_bytes and rates:
+            return current_bytes / ewma(rates, self.alpha)
+        return ewma([record['seconds'] for record in records], self.alpha)
+
+    def read_throughput(self, source):
+        """
+        Average rate at which earlier copies read from a directory.
+
+        Args:
+            source (str): Source directory as recorded in the copy phase labels.
+
+        Returns:
+            float or None: Bytes per second, or None without history.
+        """
+        rates = [record['bytes'] / record['seconds'] for key, records in self.history.items() if key.startswith('copy ')
+                 for record in records if record['labels'].get('source') == source and record.get('bytes') and record['seconds'] > 0]
+        return ewma(rates, self.alpha)
+
+    def vm_downtime(self, vm_name):
+        """
+        Estimate how long a VM is down, from power off until it is started again.
+
+        Returns:
+            float or None: Expected seconds, or None if the VM was never recorded.
+        """
+        return ewma(self.downtimes.get(vm_name, []), self.alpha)
+
+def get_window_deadline(window_end, started):
+    """
+    Turn the [Planning] window_end time into the deadline of a run.
+
+    Args:
+        window_end (str): 'HH:MM', or '' for no window.
+        started (datetime.datetime): When the run started.
+
+    Returns:
+        datetime.datetime or None: The first window_end after the run started.
+    """
+    if not window_end:
+        return None
+    end_time = datetime.datetime.strptime(window_end, '%H:%M').time()
+    deadline = datetime.datetime.combine(started.date(), end_time)
+    return deadline if deadline > started else deadline + datetime.timedelta(days=1)
+
+def choose_deferrals(now, deadline, estimates, safety_factor=1.0, defer=True):
+    """
+    Decide which optional work to skip so the run ends inside the window.
+
+    Args:
+        now (datetime.datetime): Current time.
+        deadline (datetime.datetime): End of the maintenance window.
+        estimates (dict): Category ('required' or one of DEFERRAL_ORDER) -> expected seconds.
+        safety_factor (float): Multiplier applied to every estimate.
+        defer (bool): Only warn instead of deferring when False.
+
+    Returns:
+        tuple: (list of deferred categories, predicted end time)
+    """
+    finish = now + datetime.timedelta(seconds=sum(estimates.values()) * safety_factor)
+    deferred = []
+    for category in DEFERRAL_ORDER:
+        if finish <= deadline or not defer:
+            break
+        if estimates.get(category):
+            deferred.append(category)
+            finish -= datetime.timedelta(seconds=estimates[category] * safety_factor)
+            logging.warning(f"Deferring {category} work ({estimates[category] / 60:.0f} min expected) to stay inside the "
+                            f"maintenance window ending {deadline:%H:%M}.")
+    if finish > deadline:
+        logging.warning(f"The run is expected to end at {finish:%H:%M}, "
+                        f"{(finish - deadline).total_seconds() / 60:.0f} min after the maintenance window.")
+    return deferred, finish
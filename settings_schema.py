@@ -0,0 +1,317 @@
+import os
+import re
+import logging
+import configparser
+from collections import namedtuple
+from vm_config import SECTIONS, ConfigError, build_app_config, validate_config, get_default_config_path
+
+# Every key the scripts read from config.ini and every environment variable they read from .env.
+# Defaults for config keys come from the vm_config dataclasses so they are defined in one place.
+# Required settings have no usable default; init asks until they are given.
+Setting = namedtuple('Setting', ['section', 'key', 'description', 'secret', 'required'], defaults=(False,))
+
+CONFIG_SETTINGS = (
+    Setting('Paths', 'nas_path', 'UNC root of the NAS share, e.g. \\\\OFFICE-NAS\\VM_Backups.', False),
+    Setting('Paths', 'virtual_box_path', 'VirtualBox install directory containing VBoxManage.', False),
+    Setting('Paths', 'vm_management_source_path', 'Directory holding these scripts and their logs.', False),
+    Setting('Paths', 'source_daily_backup_path', 'Local directory the daily OVA exports are written to.', False, True),
+    Setting('Paths', 'source_monthly_backup_path', 'Local directory for the monthly copies.', False, True),
+    Setting('Paths', 'office365_daily_path', 'OneDrive folder receiving the daily exports.', False),
+    Setting('Paths', 'office365_monthly_path', 'OneDrive folder receiving the monthly copies.', False),
+    Setting('Paths', 'office365_misc_path', 'OneDrive folder receiving the scripts and logs.', False),
+    Setting('Paths', 'nas_daily_path', 'NAS folder receiving the daily exports.', False),
+    Setting('Paths', 'nas_monthly_path', 'NAS folder receiving the monthly copies.', False),
+    Setting('Paths', 'nas_misc_path', 'NAS folder receiving the scripts and logs.', False),
+    Setting('Paths', 'logs_location', 'Local log directory included in cleanup.', False),
+    Setting('Paths', 'logs_office365', 'OneDrive log directory included in cleanup.', False),
+    Setting('Paths', 'logs_nas', 'NAS log directory.', False),
+    Setting('VMDetails', 'vm_names', 'Comma separated VirtualBox VM names, processed in order.', False, True),
+    Setting('SnapshotDetails', 'daily_retention', 'Days to keep Snapshot-DDMMYY snapshots.', False),
+    Setting('BackupDetails', 'daily_retention', 'Days to keep daily exports.', False),
+    Setting('BackupDetails', 'monthly_retention', 'Days to keep monthly exports.', False),
+    Setting('SMTP', 'server', 'SMTP server used for the log email.', False),
+    Setting('Notifications', 'channels', 'Channels notifications are delivered by: smtp, webhook, file (comma separated).', False),
+    Setting('Notifications', 'outbox', 'Directory holding notifications until they are delivered.', False),
+    Setting('Notifications', 'webhook_url', 'URL the webhook channel posts JSON to.', False),
+    Setting('Notifications', 'file_directory', 'Directory the file channel writes messages to.', False),
+    Setting('Notifications', 'starttls', 'Use STARTTLS on the SMTP connection.', False),
+    Setting('Notifications', 'timeout', 'Seconds before an SMTP or webhook connection attempt gives up.', False),
+    Setting('Notifications', 'max_attempts', 'Delivery attempts before a notification is moved to the failed folder.', False),
+    Setting('Notifications', 'retry_seconds', 'Wait after the first failed attempt, doubled after each further failure.', False),
+    Setting('Notifications', 'max_retry_seconds', 'Longest wait between attempts.', False),
+    Setting('Notifications', 'flush_timeout', 'Seconds a run or restart waits for notifications to go out before it carries on.', False),
+    Setting('Misc', 'weekday_end', 'Weekday index (Mon=0) on which runs stop for the week.', False),
+    Setting('Misc', 'days_in_month', 'Day of the month used to find the last working day (1-28).', False),
+    Setting('Watchdog', 'poll_interval', 'Seconds between VM state polls in watchdog mode.', False),
+    Setting('Watchdog', 'backoff_initial', 'Seconds to wait before retrying a failed VM start; doubles per failure.', False),
+    Setting('Watchdog', 'backoff_max', 'Upper limit in seconds for the restart backoff.', False),
+    Setting('Watchdog', 'crash_loop_restarts', 'Restarts within crash_loop_window that mark a VM as crash looping.', False),
+    Setting('Watchdog', 'crash_loop_window', 'Window in seconds used for crash loop detection.', False),
+    Setting('Watchdog', 'maintenance_lock_hours', 'Age after which a leftover maintenance lock is ignored.', False),
+    Setting('Metrics', 'textfile_path', 'Prometheus textfile written after each run.', False),
+    Setting('Metrics', 'summary_directory', 'Directory receiving one JSON summary per run.', False),
+    Setting('Metrics', 'history_runs', 'Previous runs compared against to flag slow phases.', False),
+    Setting('Metrics', 'regression_factor', 'A phase slower than this multiple of its median is flagged.', False),
+    Setting('Metrics', 'regression_min_seconds', 'Phases shorter than this are never flagged.', False),
+    Setting('Concurrency', 'virtualbox', 'VBoxManage commands allowed to run at once.', False),
+    Setting('Concurrency', 'disk', 'Local copy commands allowed to run at once.', False),
+    Setting('Concurrency', 'network', "'net' commands and copies to or from UNC paths allowed to run at once.", False),
+    Setting('Concurrency', 'default', 'Other external commands allowed to run at once.', False),
+    Setting('Logging', 'level', 'Log level: DEBUG logs every file copied or checked and every snapshot, INFO logs sampled summaries.', False),
+    Setting('Logging', 'queue_size', 'Log records held for the background writer before INFO and DEBUG records are dropped.', False),
+    Setting('Logging', 'sample_every', 'Per item messages between INFO summaries.', False),
+    Setting('LogArchive', 'compression', 'Compression of finished logs: gzip, or zstd when the zstandard package is installed.', False),
+    Setting('LogArchive', 'pack_after_days', 'Age in days at which compressed logs move into the monthly archive; at most daily_retention.', False),
+    Setting('LogArchive', 'keep_months', 'Months of log archives kept.', False),
+    Setting('LogIndex', 'database', 'SQLite index of the logs and run events searched by "logs query".', False),
+    Setting('Catalog', 'database', 'SQLite catalog of the files copied to each destination and when they were last verified.', False),
+    Setting('Restore', 'directory', "Where restores stage and extract exports; empty uses a 'Restore' folder next to the local daily folder.", False),
+    Setting('Restore', 'streams', 'Parallel chunks when a restore extracts the disks of an export.', False),
+    Setting('Restore', 'chunk_size_mb', 'Size of each extraction chunk in MB.', False),
+    Setting('Export', 'target', "Where VMs are exported to first: local, nas or office365 (falls back to local when unreachable).", False),
+    Setting('Segments', 'enabled', 'Copy exports to the NAS and Office 365 as fixed-size segments with a SHA-256 manifest.', False),
+    Setting('Segments', 'segment_size_mb', 'Size of each export segment in MB.', False),
+    Setting('Segments', 'retries', 'Extra attempts for segments that failed to copy.', False),
+    Setting('IO', 'disk_streams', 'Exports, copies and cleanups allowed on one local disk at once.', False),
+    Setting('IO', 'network_streams', 'Copies allowed to or from one network share at once.', False),
+    Setting('IO', 'device_overrides', "Per device stream budgets as 'path=streams' pairs separated by ';', e.g. D:\\=3.", False),
+    Setting('Shares', 'backend', 'auto (net use sessions for UNC shares, local directories otherwise), net_use or local.', False),
+    Setting('Shares', 'revalidate_seconds', 'Seconds a share check stays valid before the share is checked again.', False),
+    Setting('Shares', 'reconnect_attempts', 'Connection attempts when a share is unreachable.', False),
+    Setting('Shares', 'reconnect_delay', 'Seconds between connection attempts.', False),
+    Setting('Timeouts', 'export', 'Seconds before a VM export is killed (0 = no limit).', False),
+    Setting('Timeouts', 'copy', 'Seconds before a backup copy is killed (0 = no limit).', False),
+    Setting('Timeouts', 'snapshot', 'Seconds before taking or deleting a snapshot is killed.', False),
+    Setting('Timeouts', 'vm_action', 'Seconds before powering a VM off or on is killed.', False),
+    Setting('Timeouts', 'network', "Seconds before a 'net use' command is killed.", False),
+    Setting('Timeouts', 'query', 'Seconds before a VM state or snapshot listing is killed.', False),
+    Setting('Timeouts', 'stall', 'Seconds an export or copy may go without output or file growth before it is killed.', False),
+    Setting('Journal', 'directory', 'Directory holding the step journal of each run, used by --resume.', False),
+    Setting('Journal', 'keep_runs', 'Number of run journals to keep.', False),
+    Setting('Scheduling', 'max_parallel_vms', 'VMs processed at the same time.', False),
+    Setting('Planning', 'window_end', 'HH:MM at which the maintenance window ends; empty for no window.', False),
+    Setting('Planning', 'defer_optional', 'Skip monthly promotion, then off-site copies, when the run would overrun the window (false only warns).', False),
+    Setting('Planning', 'safety_factor', 'Multiplier applied to predicted durations.', False),
+    Setting('Scheduling', 'default_estimate', 'Seconds a VM is assumed to be down when no earlier run was recorded.', False),
+)
+
+# Keys of the optional per VM sections, e.g. [VM Ubuntu - Moodle]. init does not write these.
+VM_OPTION_SETTINGS = (
+    Setting('VM <name>', 'priority', 'Higher numbers are processed earlier, relative to the expected downtime (default 1).', False),
+    Setting('VM <name>', 'depends_on', 'Comma separated VMs that must be running again before this VM is taken down.', False),
+    Setting('VM <name>', 'max_downtime', 'Seconds this VM may be down; longer is logged as a warning (0 = no limit).', False),
+)
+
+# Keys of the optional storage target sections, e.g. [Target offsite]. init does not write these.
+TARGET_OPTION_SETTINGS = (
+    Setting('Target <name>', 'type', 'local, smb, s3 or onedrive. office365 is a onedrive target unless set to local; other built-in sections only tune streams and chunk_size_mb.', False),
+    Setting('Target <name>', 'path', 'Directory of a local or smb target.', False),
+    Setting('Target <name>', 'bucket', 'Bucket of an s3 target.', False),
+    Setting('Target <name>', 'prefix', 'Key prefix within the bucket.', False),
+    Setting('Target <name>', 'endpoint_url', 'S3-compatible endpoint, e.g. a MinIO server; file:///path uses a local directory instead.', False),
+    Setting('Target <name>', 'region', 'Region of an s3 target.', False),
+    Setting('Target <name>', 'schedule', 'daily targets get the daily exports, monthly targets the monthly folder on the last working day.', False),
+    Setting('Target <name>', 'retention', 'Days objects are kept (0 = the [BackupDetails] retention of the schedule).', False),
+    Setting('Target <name>', 'streams', 'Parallel chunks or multipart parts of one transfer (default 1).', False),
+    Setting('Target <name>', 'chunk_size_mb', 'Chunk and multipart part size; s3 parts are at least 5 MB.', False),
+)
+
+ENVIRONMENT_VARIABLES = (
+    Setting(None, 'NASUsername', 'User name for the NAS share.', False),
+    Setting(None, 'NASPassword', 'Password for the NAS share.', True),
+    Setting(None, 'email_username', 'SMTP login.', False),
+    Setting(None, 'email_password', 'SMTP password.', True),
+    Setting(None, 'email_from', 'Sender address of the log email.', False),
+    Setting(None, 'email_to', 'Recipient address of the log email.', False),
+    Setting(None, 'email_port', 'SMTP port, usually 587.', False),
+    Setting(None, 'AWS_ACCESS_KEY_ID', 'Optional access key of S3 targets when boto3 finds no other credentials.', False),
+    Setting(None, 'AWS_SECRET_ACCESS_KEY', 'Optional secret key of S3 targets.', True),
+    Setting(None, 'VMBACKUP_CONFIG', 'Optional path of config.ini when it is not next to the scripts.', False),
+)
+
+ENV_FILE_NAME = '.env'
+
+####### Defaults
+def get_default_value(setting):
+    """
+    Get the default value of a config setting as it would be written to config.ini.
+
+    Args:
+        setting (Setting): A CONFIG_SETTINGS entry.
+
+    Returns:
+        str: The default value, or an empty string if there is none.
+    """
+    if setting.section not in SECTIONS:
+        return ''
+    value = getattr(SECTIONS[setting.section][1](), setting.key)
+    if isinstance(value, tuple):
+        return ', '.join(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+####### Rendering
+def build_config(values=None):
+    """
+    Build a ConfigParser holding every schema key.
+
+    Args:
+        values (dict, optional): Overrides keyed by (section, key).
+
+    Returns:
+        configparser.ConfigParser: The populated configuration.
+    """
+    values = values or {}
+    config = configparser.ConfigParser()
+    for setting in CONFIG_SETTINGS:
+        if setting.section not in config:
+            config[setting.section] = {}
+        config[setting.section][setting.key] = values.get((setting.section, setting.key), get_default_value(setting))
+    for (section, key), value in values.items():  # sections outside the schema, e.g. [Target offsite]
+        if section not in config:
+            config[section] = {}
+        config[section].setdefault(key, value)
+    return config
+
+def format_env_value(value):
+    """
+    Quote a .env value when it contains characters other than letters, digits, '_' and '-'.
+
+    Args:
+        value (str): The raw value.
+
+    Returns:
+        str: The value as it should appear in the .env file.
+    """
+    return value if not re.search(r"[^\w\-]", value) else f"'{value}'"
+
+def write_env_file(env_file, env_values):
+    """
+    Write environment variables and their values to a file.
+
+    Args:
+        env_file (str): The path to the environment file.
+        env_values (dict): A dictionary containing environment variable names and their values.
+
+    Returns:
+        bool: True if writing to the file was successful, False otherwise.
+    """
+    try:
+        with open(env_file, 'w') as f:
+            for env_var, value in env_values.items():
+                f.write(f"{env_var}={format_env_value(value)}\n")
+        return True
+    except Exception as e:
+        logging.error(f"Error writing to {env_file}: {e}")
+        return False
+
+####### Validation
+def find_config_problems(config, config_path):
+    """
+    List what keeps a config from loading: the required settings without a value or, once they
+    all have one, the first error validate_config reports.
+
+    Args:
+        config (configparser.ConfigParser): The config as built or read.
+        config_path (str): Path of the config, for messages.
+
+    Returns:
+        list: One message per problem; empty if the config loads.
+    """
+    problems = [f"[{s.section}] {s.key} needs a value ({s.description})"
+                for s in CONFIG_SETTINGS if s.required and not config.get(s.section, s.key, fallback='').strip()]
+    if problems:
+        return problems
+    try:
+        validate_config(build_app_config(config, config_path))
+    except ConfigError as e:
+        return [str(e)]
+    return []
+
+####### init command
+def prompt_for_values(settings, current_values):
+    """
+    Ask the user for each setting, keeping the current value when the answer is empty.
+
+    Args:
+        settings (iterable): Setting entries to prompt for.
+        current_values (dict): Values keyed by (section, key) shown as the default.
+
+    Returns:
+        dict: The chosen values keyed by (section, key).
+    """
+    chosen = {}
+    for setting in settings:
+        current = current_values.get((setting.section, setting.key), '')
+        label = f"[{setting.section}] {setting.key}" if setting.section else setting.key
+        answer = input(f"{label} - {setting.description} (press enter to keep '{'' if setting.secret else current}'): ")
+        while setting.required and not (answer.strip() or current):
+            answer = input(f"{label} is required: ")
+        chosen[(setting.section, setting.key)] = answer.strip() or current
+    return chosen
+
+def init_settings(config_path=None, env_path=None, interactive=True, force=False):
+    """
+    Generate config.ini and .env from the schema.
+
+    Existing files are left alone unless force is set, so re-running init is harmless. The config is
+    validated before it is written; a config that a run could not load is still written, so it can be
+    completed by hand, and its problems are logged and returned.
+
+    Args:
+        config_path (str, optional): Where to write config.ini. Defaults to the file next to the scripts.
+        env_path (str, optional): Where to write .env. Defaults to the file next to the scripts.
+        interactive (bool): Prompt for each value instead of writing defaults.
+        force (bool): Overwrite files that already exist.
+
+    Returns:
+        tuple: (paths of the files that were written, problems of the config as find_config_problems lists them)
+    """
+    config_path = config_path or get_default_config_path()
+    env_path = env_path or os.path.join(os.path.dirname(config_path), ENV_FILE_NAME)
+    written = []
+
+    if os.path.exists(config_path) and not force:
+        logging.info(f"Config file '{config_path}' already exists. Use --force to regenerate it.")
+        config = configparser.ConfigParser()
+        try:
+            config.read(config_path)
+            problems = find_config_problems(config, config_path)
+        except configparser.Error as e:
+            problems = [f"Error reading config file: {e}"]
+    else:
+        defaults = {(s.section, s.key): get_default_value(s) for s in CONFIG_SETTINGS}
+        values = prompt_for_values(CONFIG_SETTINGS, defaults) if interactive else defaults
+        config = build_config(values)
+        problems = find_config_problems(config, config_path)
+        with open(config_path, 'w') as configfile:
+            config.write(configfile)
+        written.append(config_path)
+        logging.info(f"Config file written to {config_path}")
+    if problems:
+        logging.warning(f"{config_path} cannot be used for a run until these are fixed:\n  " + "\n  ".join(problems))
+
+    if os.path.exists(env_path) and not force:
+        logging.info(f"The .env file '{env_path}' already exists. Use --force to regenerate it.")
+    else:
+        defaults = {(s.section, s.key): os.getenv(s.key, '') for s in ENVIRONMENT_VARIABLES}
+        values = prompt_for_values(ENVIRONMENT_VARIABLES, defaults) if interactive else defaults
+        if write_env_file(env_path, {key: value for (_, key), value in values.items()}):
+            written.append(env_path)
+            logging.info(f".env file written to {env_path}")
+    return written, problems
+
+def main(args):
+    """
+    Run the init command.
+
+    Args:
+        args (argparse.Namespace): Parsed 'vmbackup.py init' arguments (config, env, defaults, force).
+
+    Returns:
+        int: 0 if the config can be loaded by a run, 1 if settings still need values.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s]: %(message)s')
+    _, problems = init_settings(args.config, args.env, interactive=not args.defaults, force=args.force)
+    return 1 if problems else 0
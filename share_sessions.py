@@ -0,0 +1,252 @@
+"""
+Sessions to the network shares a run copies to.
+
+One authenticated session is opened per share root ('\\\\server\\share') with a deviceless
+'net use \\\\server\\share', since every copy addresses the share by its UNC path and a drive letter
+is never needed. The session's state is cached: before a share is used it is re-validated with a
+directory check, which needs no process, at most every [Shares] revalidate_seconds, and when the
+check fails the session is reconnected up to reconnect_attempts times. Sessions are closed at the
+end of the run.
+
+Shares that are not UNC paths, such as the local directories of the bench pipeline on Linux, get
+a LocalDirectoryBackend session with the same behaviour, so the session handling can be tested
+without Windows.
+"""
+import os
+import re
+import time
+import logging
+import threading
+import subprocess
+from io_devices import is_unc_path
+from run_metrics import get_metrics
+
+####### Backends
+class NetUseBackend:
+    """
+    Opens and closes deviceless SMB sessions with 'net use'.
+    """
+
+    def __init__(self, username=None, password=None, timeout=None):
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+    def connect(self, root):
+        command = ['net', 'use', root]
+        if self.username:
+            command += ['/user:' + self.username, self.password or '']
+        command.append('/persistent:no')
+        result = self.run(root, command)
+        if result.returncode != 0:
+            # e.g. error 1219 when an older session to the server uses other credentials
+            self.disconnect(root)
+            result = self.run(root, command)
+        return result.returncode == 0
+
+    def disconnect(self, root):
+        result = self.run(root, ['net', 'use', root, '/delete', '/yes'])
+        return result.returncode == 0
+
+    def run(self, root, command):
+        """
+        Run a 'net use' command. The command carries the NAS password, so an error raised while
+        running it is replaced by one that names only the share.
+        """
+        from async_exec import run_command
+        try:
+            return run_command(command, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            raise subprocess.SubprocessError(f"'net use {root}' timed out after {self.timeout}s") from None
+        except (OSError, subprocess.SubprocessError) as e:
+            raise subprocess.SubprocessError(f"'net use {root}' failed: {getattr(e, 'strerror', None) or type(e).__name__}") from None
+
+    def validate(self, root):
+        return os.path.isdir(root)
+
+class LocalDirectoryBackend:
+    """
+    Stand-in for a share that is a local directory.
+    """
+
+    def connect(self, root):
+        os.makedirs(root, exist_ok=True)
+        return True
+
+    def disconnect(self, root):
+        return True
+
+    def validate(self, root):
+        return os.path.isdir(root)
+
+####### Sessions
+def get_share_root(path):
+    """
+    The share root a path belongs to: '\\\\server\\share' for UNC paths, otherwise the path itself.
+    """
+    if is_unc_path(path):
+        parts = [part for part in re.split(r'[\\/]+', path) if part]
+        return '\\\\' + '\\'.join(parts[:2])
+    return os.path.normpath(path)
+
+class ShareSession:
+    """
+    Cached state of one share: whether it is connected and when it was last checked.
+    """
+
+    def __init__(self, root, backend):
+        self.root = root
+        self.backend = backend
+        self.connected = False
+        self.validated_at = None
+        self.lock = threading.Lock()
+
+    def is_fresh(self, now, revalidate_seconds):
+        return self.connected and self.validated_at is not None and now - self.validated_at < revalidate_seconds
+
+class ShareManager:
+    """
+    Keeps one session per share root and makes sure it is usable before the share is accessed.
+    """
+
+    def __init__(self, settings, net_use_backend=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            settings (SharesConfig): Revalidation interval and reconnect attempts.
+            net_use_backend (NetUseBackend, optional): Backend of UNC shares.
+            clock (callable): Monotonic clock, replaceable in tests.
+            sleep (callable): Wait between reconnect attempts.
+        """
+        self.settings = settings
+        self.net_use_backend = net_use_backend or NetUseBackend()
+        self.clock = clock
+        self.sleep = sleep
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_backend(self, root):
+        if self.settings.backend == 'local' or (self.settings.backend == 'auto' and not is_unc_path(root)):
+            return LocalDirectoryBackend()
+        return self.net_use_backend
+
+    def open(self, path):
+        """
+        Register the share holding path and connect to it.
+
+        Returns:
+            bool: True if the share is usable.
+        """
+        root = get_share_root(path)
+        with self.lock:
+            if root.lower() not in self.sessions:
+                self.sessions[root.lower()] = ShareSession(root, self.get_backend(root))
+        return self.ensure(path)
+
+    def find_session(self, path):
+        """
+        The registered session whose root holds path, or None.
+        """
+        with self.lock:
+            if is_unc_path(path):
+                return self.sessions.get(get_share_root(path).lower())
+            folded = os.path.normpath(path).lower()
+            for key, session in self.sessions.items():
+                if folded == key or folded.startswith(key.rstrip(os.sep) + os.sep):
+                    return session
+        return None
+
+    def ensure(self, path):
+        """
+        Make sure the share holding path is connected, checking it again if its last check is
+        older than revalidate_seconds and reconnecting if the check fails. Paths outside the
+        registered shares are left alone.
+
+        Returns:
+            bool: True if the share is usable or path is not on a registered share.
+        """
+        session = self.find_session(path)
+        if session is None:
+            return True
+        with session.lock:
+            if session.is_fresh(self.clock(), self.settings.revalidate_seconds):
+                return True
+            if session.connected and session.backend.validate(session.root):
+                session.validated_at = self.clock()
+                return True
+            return self.reconnect(session)
+
+    def reconnect(self, session):
+        was_connected = session.connected
+        session.connected = False
+        for attempt in range(1, self.settings.reconnect_attempts + 1):
+            if attempt > 1:
+                self.sleep(self.settings.reconnect_delay)
+            try:
+                if session.backend.connect(session.root) and session.backend.validate(session.root):
+                    session.connected, session.validated_at = True, self.clock()
+                    if was_connected:
+                        get_metrics().increment('share_reconnects')
+                        logging.warning(f"Reconnected to {session.root} (attempt {attempt}).")
+                    else:
+                        logging.info(f"Connected to {session.root}.")
+                    return True
+            except (OSError, subprocess.SubprocessError) as e:
+                logging.warning(f"Connecting to {session.root} failed: {e}")
+        logging.error(f"Could not connect to {session.root} after {self.settings.reconnect_attempts} attempt(s).")
+        return False
+
+    def close_all(self):
+        """
+        Close every session opened by this manager.
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            try:
+                if session.connected:
+                    session.backend.disconnect(session.root)
+                    logging.info(f"Disconnected from {session.root}.")
+            except (OSError, subprocess.SubprocessError) as e:
+                logging.warning(f"Disconnecting from {session.root} failed: {e}")
+
+_current = {'manager': None}
+_current_lock = threading.Lock()
+
+def get_share_manager(config=None):
+    """
+    Get the process wide share manager, creating it from the [Shares] section and the NAS
+    credentials in the environment on first use.
+    """
+    with _current_lock:
+        if _current['manager'] is None:
+            if config is None:
+                return None
+            backend = NetUseBackend(os.getenv("NASUsername"), os.getenv("NASPassword"), config.timeouts.network or None)
+            _current['manager'] = ShareManager(config.shares, backend)
+        return _current['manager']
+
+def ensure_share(path):
+    """
+    Re-validate the share holding path before it is used. A no-op before open_shares.
+
+    Returns:
+        bool: False if the share is registered and cannot be reached.
+    """
+    manager = get_share_manager()
+    return manager.ensure(path) if manager else True
+
+def open_shares(config, *paths):
+    """
+    Open a session to the share of each path.
+
+    Returns:
+        bool: True if every share is usable.
+    """
+    manager = get_share_manager(config)
+    return all([manager.open(path) for path in paths])
+
+def close_shares():
+    manager = get_share_manager()
+    if manager:
+        manager.close_all()
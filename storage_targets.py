@@ -0,0 +1,716 @@
+"""
+Storage targets: the places exports are written to, behind one interface.
+
+    target.put(local_file, key)      upload a file, in parallel chunks when it is large
+    target.get(key, local_file)      download an object, in parallel ranges when it is large
+    target.open(key)                 stream an object
+    target.list(prefix)              ObjectInfo(key, size, modified) for every object
+    target.stat(key)                 ObjectInfo or None
+    target.delete(key)
+
+Implementations:
+
+    LocalTarget   a directory on a local disk or a synced folder
+    SMBTarget     a directory on a network share; the share session is checked before each use
+    OneDriveTarget  a folder synced by the OneDrive client, written so the client uploads each
+                  file once and cloud-only files are never downloaded again
+    S3Target      a bucket (and prefix) on S3 or an S3-compatible store such as MinIO
+
+Writes never leave a partial object under the final name: files are written to '<name>.partial'
+and renamed, multipart uploads are only completed once every part is in. Each target has its own
+number of parallel streams and chunk size.
+
+The built-in destinations (local, nas, office365) are directory targets, office365 a OneDrive
+target unless its section sets another type; a '[Target <name>]' section tunes them or adds
+another target:
+
+    [Target offsite]
+    type = s3
+    bucket = vm-backups
+    endpoint_url = https://minio.example.com:9000
+    streams = 4
+    chunk_size_mb = 64
+
+S3 targets need the optional boto3 package and use its usual credential settings, for example the
+AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables, which init writes to .env.
+An endpoint_url of the form file:///path uses LocalObjectStore instead, a directory that behaves
+like an S3 bucket, for tests and trials without a server.
+"""
+import os
+import json
+import uuid
+import shutil
+import datetime
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from share_sessions import ensure_share
+from vm_config import BUILTIN_TARGETS, DEFAULT_TARGET_TYPES, TargetOptions, get_target_options
+
+ObjectInfo = namedtuple('ObjectInfo', 'key size modified')
+PARTIAL_SUFFIX = '.partial'
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+# S3 only accepts multipart uploads with parts of at least 5 MB, except the last.
+MIN_PART_SIZE = 5 * 1024 * 1024
+# Windows attributes of placeholder files whose data is only in the cloud. Opening or reading
+# such a file makes the OneDrive client download it.
+FILE_ATTRIBUTE_OFFLINE = 0x1000
+FILE_ATTRIBUTE_RECALL_ON_OPEN = 0x40000
+FILE_ATTRIBUTE_RECALL_ON_DATA_ACCESS = 0x400000
+CLOUD_ONLY_ATTRIBUTES = FILE_ATTRIBUTE_OFFLINE | FILE_ATTRIBUTE_RECALL_ON_OPEN | FILE_ATTRIBUTE_RECALL_ON_DATA_ACCESS
+# OneDrive does not sync files named '~$*' or '*.tmp', so files are written under such a name first.
+ONEDRIVE_TEMP_PREFIX = '~$'
+ONEDRIVE_TEMP_SUFFIX = '.tmp'
+# Seconds two modification times may differ by and still match; FAT and some sync clients keep 2 second steps.
+MTIME_TOLERANCE = 2
+# [Paths] keys of the folders the OneDrive client syncs.
+ONEDRIVE_PATH_KEYS = ('office365_daily_path', 'office365_monthly_path', 'office365_misc_path', 'logs_office365')
+
+class StorageError(Exception):
+    """Raised when a target cannot be built or an object cannot be transferred."""
+
+def get_chunks(size, chunk_size):
+    """
+    Split a size into (offset, length) chunks.
+    """
+    return [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)] or [(0, 0)]
+
+def copy_range(source, destination, offset, length, buffer_size=1024 * 1024):
+    """
+    Copy length bytes at offset between two files opened by the caller.
+    """
+    source.seek(offset)
+    destination.seek(offset)
+    remaining = length
+    while remaining > 0:
+        data = source.read(min(buffer_size, remaining))
+        if not data:
+            raise StorageError(f"Unexpected end of {getattr(source, 'name', 'source')} at {offset + length - remaining}")
+        destination.write(data)
+        remaining -= len(data)
+
+def copy_file(source_file, destination_file, streams=1, chunk_size=64 * 1024 * 1024, partial_file=None):
+    """
+    Copy a file through a '.partial' file that is renamed into place, in parallel chunks when it
+    is larger than one chunk.
+
+    Args:
+        partial_file (str, optional): Temporary file to write instead of '<destination>.partial'.
+
+    Returns:
+        int: Bytes copied.
+    """
+    size = os.path.getsize(source_file)
+    partial_file = partial_file or destination_file + PARTIAL_SUFFIX
+    os.makedirs(os.path.dirname(os.path.abspath(destination_file)), exist_ok=True)
+    try:
+        if streams == 1 or size <= chunk_size:
+            with open(source_file, 'rb') as source, open(partial_file, 'wb') as destination:
+                shutil.copyfileobj(source, destination, min(chunk_size, 16 * 1024 * 1024))
+        else:
+            with open(partial_file, 'wb') as destination:
+                destination.truncate(size)
+
+            def copy_chunk(offset, length):
+                with open(source_file, 'rb') as source, open(partial_file, 'r+b') as destination:
+                    copy_range(source, destination, offset, length)
+            run_in_threads(copy_chunk, get_chunks(size, chunk_size), streams)
+        shutil.copystat(source_file, partial_file)
+        os.replace(partial_file, destination_file)
+    except BaseException:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+    return size
+
+def run_in_threads(function, chunks, streams):
+    """
+    Run function(offset, length) for every chunk on up to streams threads.
+
+    Returns:
+        list: The results in chunk order.
+    """
+    if streams <= 1 or len(chunks) == 1:
+        return [function(*chunk) for chunk in chunks]
+    with ThreadPoolExecutor(min(streams, len(chunks))) as executor:
+        return list(executor.map(lambda chunk: function(*chunk), chunks))
+
+class StorageTarget:
+    """
+    Base of all targets.
+
+    Args:
+        name (str): Target name, as in the '[Target <name>]' section.
+        streams (int): Parallel chunks of one transfer.
+        chunk_size (int): Bytes per chunk.
+    """
+
+    def __init__(self, name, streams=1, chunk_size=64 * 1024 * 1024):
+        self.name = name
+        self.streams = max(1, streams)
+        self.chunk_size = max(1, chunk_size)
+
+    def put(self, local_file, key):
+        raise NotImplementedError
+
+    def get(self, key, local_file):
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def list(self, prefix=''):
+        raise NotImplementedError
+
+    def stat(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+####### Directory targets
+class LocalTarget(StorageTarget):
+    """
+    A directory. Keys are paths relative to it with '/' separators.
+    """
+
+    def __init__(self, name, root, streams=1, chunk_size=64 * 1024 * 1024):
+        super().__init__(name, streams, chunk_size)
+        self.root = root
+
+    def __str__(self):
+        return self.root
+
+    def get_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, local_file, key):
+        return copy_file(local_file, self.get_path(key), self.streams, self.chunk_size)
+
+    def get(self, key, local_file):
+        return copy_file(self.get_path(key), local_file, self.streams, self.chunk_size)
+
+    def open(self, key):
+        return open(self.get_path(key), 'rb')
+
+    def list(self, prefix=''):
+        for root, dirs, files in os.walk(self.root):
+            dirs.sort()
+            for file_name in sorted(files):
+                if file_name.endswith(PARTIAL_SUFFIX):
+                    continue
+                key = os.path.relpath(os.path.join(root, file_name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    info = self.stat(key)
+                    if info:
+                        yield info
+
+    def stat(self, key):
+        try:
+            status = os.stat(self.get_path(key))
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(key, status.st_size, status.st_mtime)
+
+    def delete(self, key):
+        os.remove(self.get_path(key))
+
+class SMBTarget(LocalTarget):
+    """
+    A directory on a network share. The share session is re-validated before each operation.
+    """
+
+    def ensure(self):
+        if not ensure_share(self.root):
+            raise StorageError(f"Share of {self.root} is not reachable")
+
+    def put(self, local_file, key):
+        self.ensure()
+        return super().put(local_file, key)
+
+    def get(self, key, local_file):
+        self.ensure()
+        return super().get(key, local_file)
+
+    def open(self, key):
+        self.ensure()
+        return super().open(key)
+
+    def list(self, prefix=''):
+        self.ensure()
+        return super().list(prefix)
+
+    def stat(self, key):
+        self.ensure()
+        return super().stat(key)
+
+    def delete(self, key):
+        self.ensure()
+        return super().delete(key)
+
+####### OneDrive folders
+def is_cloud_only(status):
+    """
+    Whether a stat result is of a cloud-only placeholder. Always False outside Windows.
+    """
+    return bool(getattr(status, 'st_file_attributes', 0) & CLOUD_ONLY_ATTRIBUTES)
+
+def find_entry(path):
+    """
+    The os.DirEntry of a file, taken from its folder's listing. On Windows the entry's stat() comes
+    from the listing too, so the file itself is not opened.
+
+    Returns:
+        os.DirEntry: The entry, or None if the file does not exist.
+    """
+    directory, file_name = os.path.split(path)
+    try:
+        with os.scandir(directory or '.') as entries:
+            for entry in entries:
+                if os.path.normcase(entry.name) == os.path.normcase(file_name):
+                    return entry
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return None
+
+def is_cloud_only_file(path):
+    entry = find_entry(path)
+    return entry is not None and is_cloud_only(entry.stat(follow_symlinks=False))
+
+def scan_tree(top):
+    """
+    Like os.walk, but yields the files as os.DirEntry objects so they can be aged and sized from
+    the directory listing. Removing names from the yielded dirs skips those folders.
+
+    Yields:
+        tuple: (folder, list of sub folder names, list of file entries)
+    """
+    try:
+        with os.scandir(top) as entries:
+            entries = list(entries)
+    except OSError:
+        return
+    dirs = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
+    files = [entry for entry in entries if not entry.is_dir(follow_symlinks=False)]
+    yield top, dirs, files
+    for name in dirs:
+        yield from scan_tree(os.path.join(top, name))
+
+def is_temporary_name(file_name):
+    return file_name.endswith(PARTIAL_SUFFIX) or (file_name.startswith(ONEDRIVE_TEMP_PREFIX) and file_name.endswith(ONEDRIVE_TEMP_SUFFIX))
+
+class OneDriveTarget(LocalTarget):
+    """
+    A folder synced by the OneDrive client.
+
+    Files are written as '~$<name>.tmp', which the client ignores, and renamed into place, so the
+    client uploads each file once and only when it is complete. A file whose copy already has the
+    same size and modification time is not written again. Sizes and times come from directory
+    listings, so files the client has made cloud-only are never opened and downloaded.
+    """
+
+    def get_temp_path(self, path):
+        directory, file_name = os.path.split(path)
+        return os.path.join(directory, ONEDRIVE_TEMP_PREFIX + file_name + ONEDRIVE_TEMP_SUFFIX)
+
+    def is_unchanged(self, local_file, key, copies=None):
+        """
+        Whether the copy of key has the size and modification time of local_file.
+
+        Args:
+            copies (dict, optional): list_folder of the key's folder. Without it the folder is
+                listed for this one key.
+        """
+        copied = self.stat(key) if copies is None else copies.get(os.path.normcase(key.rsplit('/', 1)[-1]))
+        status = os.stat(local_file)
+        return copied is not None and copied.size == status.st_size and abs(copied.modified - status.st_mtime) <= MTIME_TOLERANCE
+
+    def is_cloud_only(self, key):
+        return is_cloud_only_file(self.get_path(key))
+
+    def put(self, local_file, key, checked=False):
+        """
+        Args:
+            checked (bool): The caller found the copy out of date with is_unchanged, so it is
+                written without checking again.
+
+        Returns:
+            int: Bytes written, 0 if the copy was already up to date.
+        """
+        if not checked and self.is_unchanged(local_file, key):
+            return 0
+        path = self.get_path(key)
+        return copy_file(local_file, path, self.streams, self.chunk_size, self.get_temp_path(path))
+
+    def list(self, prefix=''):
+        for root, dirs, files in scan_tree(self.root):
+            dirs.sort()
+            for entry in sorted(files, key=lambda entry: entry.name):
+                if is_temporary_name(entry.name):
+                    continue
+                key = os.path.relpath(entry.path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    status = entry.stat(follow_symlinks=False)
+                    yield ObjectInfo(key, status.st_size, status.st_mtime)
+
+    def list_folder(self, folder=''):
+        """
+        The copies in one folder from a single listing, for checking all of its files without
+        listing the folder once per file.
+
+        Args:
+            folder (str): Key of the folder, '' for the root.
+
+        Returns:
+            dict: ObjectInfo of each file, keyed by os.path.normcase of its name.
+        """
+        copies = {}
+        try:
+            with os.scandir(self.get_path(folder)) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        status = entry.stat(follow_symlinks=False)
+                        key = f"{folder}/{entry.name}" if folder else entry.name
+                        copies[os.path.normcase(entry.name)] = ObjectInfo(key, status.st_size, status.st_mtime)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return copies
+
+    def stat(self, key):
+        entry = find_entry(self.get_path(key))
+        if entry is None or entry.is_dir(follow_symlinks=False):
+            return None
+        status = entry.stat(follow_symlinks=False)
+        return ObjectInfo(key, status.st_size, status.st_mtime)
+
+####### Object storage
+def is_not_found(error):
+    """
+    Whether an S3 client error means the object does not exist.
+    """
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code')) in NOT_FOUND_CODES
+
+class S3Target(StorageTarget):
+    """
+    A bucket on S3 or an S3-compatible store. Objects larger than one chunk are uploaded as
+    multipart uploads and downloaded as ranged reads, streams parts at a time.
+    """
+
+    def __init__(self, name, client, bucket, prefix='', streams=4, chunk_size=64 * 1024 * 1024):
+        super().__init__(name, streams, max(chunk_size, MIN_PART_SIZE))
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def __str__(self):
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    def put(self, local_file, key):
+        size = os.path.getsize(local_file)
+        object_key = self.prefix + key
+        if size <= self.chunk_size:
+            with open(local_file, 'rb') as f:
+                self.client.put_object(Bucket=self.bucket, Key=object_key, Body=f)
+            return size
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)['UploadId']
+        chunks = get_chunks(size, self.chunk_size)
+
+        def upload_part(offset, length):
+            number = offset // self.chunk_size + 1
+            with open(local_file, 'rb') as f:
+                f.seek(offset)
+                body = f.read(length)
+            response = self.client.upload_part(Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                                               PartNumber=number, Body=body)
+            return {'PartNumber': number, 'ETag': response['ETag']}
+        try:
+            parts = run_in_threads(upload_part, chunks, self.streams)
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                                                  MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
+        return size
+
+    def get(self, key, local_file):
+        info = self.stat(key)
+        if info is None:
+            raise StorageError(f"{key} not found in {self}")
+        partial_file = local_file + PARTIAL_SUFFIX
+        with open(partial_file, 'wb') as f:
+            f.truncate(info.size)
+
+        def download_range(offset, length):
+            if not length:
+                return
+            body = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key,
+                                          Range=f"bytes={offset}-{offset + length - 1}")['Body']
+            with open(partial_file, 'r+b') as f:
+                f.seek(offset)
+                shutil.copyfileobj(body, f)
+            body.close()
+        try:
+            run_in_threads(download_range, get_chunks(info.size, self.chunk_size), self.streams)
+            os.replace(partial_file, local_file)
+        except BaseException:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise
+        return info.size
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                yield ObjectInfo(item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp())
+
+    def stat(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except Exception as e:
+            if is_not_found(e):
+                return None
+            raise
+        return ObjectInfo(key, response['ContentLength'], response['LastModified'].timestamp())
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+class ObjectStoreError(Exception):
+    """Error of LocalObjectStore, shaped like botocore's ClientError."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+class LocalObjectStore:
+    """
+    A directory that answers the S3 client calls S3Target makes, like a single-node MinIO.
+
+    Objects are files below '<directory>/<bucket>/'; multipart uploads collect their parts under
+    '<directory>/.uploads/<upload id>/' until they are completed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def get_path(self, bucket, key):
+        return os.path.join(self.directory, bucket, *key.split('/'))
+
+    def get_upload_directory(self, upload_id):
+        return os.path.join(self.directory, '.uploads', upload_id)
+
+    def write_object(self, bucket, key, parts):
+        """
+        Write an object from parts that are bytes, part file paths or readable streams.
+        """
+        path = self.get_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_file = path + PARTIAL_SUFFIX + uuid.uuid4().hex[:8]
+        with open(partial_file, 'wb') as f:
+            for part in parts:
+                if isinstance(part, bytes):
+                    f.write(part)
+                elif isinstance(part, str):
+                    with open(part, 'rb') as source:
+                        shutil.copyfileobj(source, f)
+                else:
+                    shutil.copyfileobj(part, f)
+        os.replace(partial_file, path)
+
+    def put_object(self, Bucket, Key, Body):
+        self.write_object(Bucket, Key, [Body])
+        return {'ETag': '"local"'}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.get_upload_directory(upload_id))
+        with open(os.path.join(self.get_upload_directory(upload_id), 'upload.json'), 'w') as f:
+            json.dump({'bucket': Bucket, 'key': Key}, f)
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        directory = self.get_upload_directory(UploadId)
+        if not os.path.isdir(directory):
+            raise ObjectStoreError('NoSuchUpload', f"Upload {UploadId} does not exist")
+        with open(os.path.join(directory, f"{PartNumber:05d}"), 'wb') as f:
+            f.write(Body)
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        directory = self.get_upload_directory(UploadId)
+        numbers = sorted(part['PartNumber'] for part in MultipartUpload['Parts'])
+        self.write_object(Bucket, Key, [os.path.join(directory, f"{number:05d}") for number in numbers])
+        shutil.rmtree(directory)
+        return {'ETag': '"local"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        shutil.rmtree(self.get_upload_directory(UploadId), ignore_errors=True)
+
+    def head_object(self, Bucket, Key):
+        try:
+            status = os.stat(self.get_path(Bucket, Key))
+        except FileNotFoundError:
+            raise ObjectStoreError('404', f"{Key} not found")
+        return {'ContentLength': status.st_size,
+                'LastModified': datetime.datetime.fromtimestamp(status.st_mtime, datetime.timezone.utc)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        try:
+            f = open(self.get_path(Bucket, Key), 'rb')
+        except FileNotFoundError:
+            raise ObjectStoreError('NoSuchKey', f"{Key} not found")
+        if Range:
+            start, end = (int(value) for value in Range.split('=')[1].split('-'))
+            f.seek(start)
+            return {'Body': RangeReader(f, end - start + 1)}
+        return {'Body': f}
+
+    def delete_object(self, Bucket, Key):
+        path = self.get_path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        bucket_directory = os.path.join(self.directory, Bucket)
+        contents = []
+        for root, dirs, files in os.walk(bucket_directory):
+            dirs.sort()
+            for file_name in sorted(files):
+                if PARTIAL_SUFFIX in file_name:
+                    continue
+                key = os.path.relpath(os.path.join(root, file_name), bucket_directory).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    head = self.head_object(Bucket, key)
+                    contents.append({'Key': key, 'Size': head['ContentLength'], 'LastModified': head['LastModified']})
+        yield {'Contents': contents}
+
+class RangeReader:
+    """
+    Reads at most length bytes from an open file, like the body of a ranged GET.
+    """
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+####### Building targets
+def create_s3_client(options):
+    """
+    Create the client of an S3 target: LocalObjectStore for file:// endpoints, boto3 otherwise.
+
+    Raises:
+        StorageError: If boto3 is needed and not installed.
+    """
+    if options.endpoint_url.startswith('file://'):
+        return LocalObjectStore(options.endpoint_url[len('file://'):])
+    try:
+        import boto3
+    except ImportError:
+        raise StorageError("S3 targets need the boto3 package (pip install boto3)")
+    return boto3.client('s3', endpoint_url=options.endpoint_url or None, region_name=options.region or None)
+
+def build_target(name, options, path=None):
+    """
+    Create a target from its options.
+
+    Args:
+        name (str): Target name.
+        options (TargetOptions): Settings from its '[Target <name>]' section.
+        path (str, optional): Directory of a built-in target, used instead of options.path.
+
+    Returns:
+        StorageTarget: The target.
+    """
+    chunk_size = options.chunk_size_mb * 1024 * 1024
+    directory = path or options.path
+    target_type = get_target_type(name, options)
+    if target_type == 's3':
+        return S3Target(name, create_s3_client(options), options.bucket, options.prefix, options.streams, chunk_size)
+    if target_type == 'onedrive':
+        return OneDriveTarget(name, directory, options.streams, chunk_size)
+    if target_type == 'smb' or (path and directory.startswith(('\\\\', '//'))):
+        return SMBTarget(name, directory, options.streams, chunk_size)
+    return LocalTarget(name, directory, options.streams, chunk_size)
+
+def get_target_type(name, options):
+    """
+    The type of a target: its section's type, or the default of a built-in target, or 'local'.
+    """
+    return options.type or DEFAULT_TARGET_TYPES.get(name, 'local')
+
+def get_builtin_target(config, name, schedule='daily'):
+    """
+    The directory target of a built-in destination, tuned by its '[Target <name>]' section.
+
+    Args:
+        config (AppConfig): Loaded configuration.
+        name (str): 'local', 'nas' or 'office365'.
+        schedule (str): 'daily' or 'monthly'.
+    """
+    daily_key, monthly_key = BUILTIN_TARGETS[name]
+    path = getattr(config.paths, daily_key if schedule == 'daily' else monthly_key)
+    return build_target(name, get_target_options(config, name), path)
+
+def get_directory_target(config, directory):
+    """
+    The built-in target whose daily or monthly directory is directory, or an untuned local target.
+    """
+    for name, keys in BUILTIN_TARGETS.items():
+        for schedule, key in zip(('daily', 'monthly'), keys):
+            if os.path.normpath(getattr(config.paths, key)) == os.path.normpath(directory):
+                return get_builtin_target(config, name, schedule)
+    return build_target(os.path.basename(directory), TargetOptions(), directory)
+
+def get_extra_targets(config, schedule=None):
+    """
+    Targets added by '[Target <name>]' sections, other than the built-in ones.
+
+    Args:
+        config (AppConfig): Loaded configuration.
+        schedule (str, optional): Only targets receiving 'daily' or 'monthly' exports.
+
+    Returns:
+        list: (target, options) tuples.
+    """
+    return [(build_target(name, options), options) for name, options in config.targets.items()
+            if name not in BUILTIN_TARGETS and (schedule is None or options.schedule == schedule)]
+
+def get_onedrive_target(config, directory):
+    """
+    A OneDrive target for directory if it is one of the Office 365 folders and the office365
+    target is in OneDrive mode.
+
+    Returns:
+        OneDriveTarget: The target, or None.
+    """
+    options = get_target_options(config, 'office365')
+    if get_target_type('office365', options) != 'onedrive':
+        return None
+    for key in ONEDRIVE_PATH_KEYS:
+        path = getattr(config.paths, key)
+        if path and os.path.normpath(path) == os.path.normpath(directory):
+            return OneDriveTarget('office365', directory, options.streams, options.chunk_size_mb * 1024 * 1024)
+    return None
@@ -0,0 +1,636 @@
+import os
+import re
+import logging
+import configparser
+from dataclasses import dataclass, field
+
+CONFIG_FILE_NAME = 'config.ini'
+CONFIG_ENV_VAR = 'VMBACKUP_CONFIG'
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+class ConfigError(ValueError):
+    """Raised when config.ini is missing, unreadable or holds invalid values."""
+
+####### Section dataclasses
+@dataclass(frozen=True)
+class PathsConfig:
+    nas_path: str = r'\\OFFICE-NAS\VM_Backups'
+    virtual_box_path: str = r'C:\Program Files\Oracle\VirtualBox'
+    vm_management_source_path: str = r'C:\VM_Management'
+    source_daily_backup_path: str = ''
+    source_monthly_backup_path: str = ''
+    office365_daily_path: str = ''
+    office365_monthly_path: str = ''
+    office365_misc_path: str = ''
+    nas_daily_path: str = ''
+    nas_monthly_path: str = ''
+    nas_misc_path: str = ''
+    logs_location: str = r'C:\VM_Management\logs'
+    logs_office365: str = ''
+    logs_nas: str = ''
+
+@dataclass(frozen=True)
+class VMDetailsConfig:
+    vm_names: tuple = ()
+
+@dataclass(frozen=True)
+class SnapshotDetailsConfig:
+    daily_retention: int = 3
+
+@dataclass(frozen=True)
+class BackupDetailsConfig:
+    daily_retention: int = 2
+    monthly_retention: int = 90
+
+@dataclass(frozen=True)
+class SMTPConfig:
+    server: str = 'smtp-mail.outlook.com'
+
+@dataclass(frozen=True)
+class MiscConfig:
+    weekday_end: int = 5
+    days_in_month: int = 28
+
+@dataclass(frozen=True)
+class WatchdogConfig:
+    poll_interval: int = 60
+    backoff_initial: int = 30
+    backoff_max: int = 900
+    crash_loop_restarts: int = 3
+    crash_loop_window: int = 1800
+    maintenance_lock_hours: int = 12
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    textfile_path: str = os.path.join(SCRIPT_DIRECTORY, 'logs', 'metrics', 'vmbackup.prom')
+    summary_directory: str = os.path.join(SCRIPT_DIRECTORY, 'logs', 'metrics', 'runs')
+    history_runs: int = 10
+    regression_factor: float = 1.5
+    regression_min_seconds: int = 60
+
+@dataclass(frozen=True)
+class ConcurrencyConfig:
+    virtualbox: int = 2
+    disk: int = 2
+    network: int = 2
+    default: int = 4
+
+@dataclass(frozen=True)
+class NotificationsConfig:
+    channels: tuple = ('smtp',)
+    outbox: str = os.path.join(SCRIPT_DIRECTORY, 'logs', 'outbox')
+    webhook_url: str = ''
+    file_directory: str = ''
+    starttls: bool = True
+    timeout: int = 30
+    max_attempts: int = 12
+    retry_seconds: int = 60
+    max_retry_seconds: int = 3600
+    flush_timeout: int = 60
+
+@dataclass(frozen=True)
+class LoggingConfig:
+    level: str = 'INFO'
+    queue_size: int = 10000
+    sample_every: int = 100
+
+@dataclass(frozen=True)
+class LogArchiveConfig:
+    compression: str = 'gzip'
+    pack_after_days: int = 2
+    keep_months: int = 12
+
+@dataclass(frozen=True)
+class LogIndexConfig:
+    database: str = os.path.join(SCRIPT_DIRECTORY, 'logs', 'log_index.sqlite')
+
+@dataclass(frozen=True)
+class CatalogConfig:
+    database: str = os.path.join(SCRIPT_DIRECTORY, 'catalog.sqlite')
+
+@dataclass(frozen=True)
+class RestoreConfig:
+    directory: str = ''
+    streams: int = 4
+    chunk_size_mb: int = 64
+
+@dataclass(frozen=True)
+class ExportConfig:
+    target: str = 'local'
+
+@dataclass(frozen=True)
+class SegmentsConfig:
+    enabled: bool = False
+    segment_size_mb: int = 1024
+    retries: int = 2
+
+@dataclass(frozen=True)
+class IOConfig:
+    disk_streams: int = 1
+    network_streams: int = 2
+    device_overrides: str = ''
+
+@dataclass(frozen=True)
+class SharesConfig:
+    backend: str = 'auto'
+    revalidate_seconds: int = 60
+    reconnect_attempts: int = 3
+    reconnect_delay: int = 5
+
+@dataclass(frozen=True)
+class TimeoutsConfig:
+    export: int = 21600
+    copy: int = 21600
+    snapshot: int = 3600
+    vm_action: int = 900
+    network: int = 300
+    query: int = 120
+    stall: int = 1800
+
+@dataclass(frozen=True)
+class JournalConfig:
+    directory: str = os.path.join(SCRIPT_DIRECTORY, 'logs', 'journal')
+    keep_runs: int = 30
+
+@dataclass(frozen=True)
+class SchedulingConfig:
+    max_parallel_vms: int = 1
+    default_estimate: int = 1800
+
+@dataclass(frozen=True)
+class PlanningConfig:
+    window_end: str = ''
+    defer_optional: bool = True
+    safety_factor: float = 1.2
+
+@dataclass(frozen=True)
+class VMOptions:
+    """Optional per VM settings from a '[VM <name>]' section."""
+    priority: int = 1
+    depends_on: tuple = ()
+    max_downtime: int = 0
+
+@dataclass(frozen=True)
+class TargetOptions:
+    """Settings of a storage target from a '[Target <name>]' section."""
+    type: str = ''
+    path: str = ''
+    bucket: str = ''
+    prefix: str = ''
+    endpoint_url: str = ''
+    region: str = ''
+    schedule: str = 'daily'
+    retention: int = 0
+    streams: int = 1
+    chunk_size_mb: int = 64
+
+@dataclass(frozen=True)
+class AppConfig:
+    paths: PathsConfig = field(default_factory=PathsConfig)
+    vm_details: VMDetailsConfig = field(default_factory=VMDetailsConfig)
+    snapshot_details: SnapshotDetailsConfig = field(default_factory=SnapshotDetailsConfig)
+    backup_details: BackupDetailsConfig = field(default_factory=BackupDetailsConfig)
+    smtp: SMTPConfig = field(default_factory=SMTPConfig)
+    misc: MiscConfig = field(default_factory=MiscConfig)
+    watchdog: WatchdogConfig = field(default_factory=WatchdogConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    concurrency: ConcurrencyConfig = field(default_factory=ConcurrencyConfig)
+    io: IOConfig = field(default_factory=IOConfig)
+    shares: SharesConfig = field(default_factory=SharesConfig)
+    notifications: NotificationsConfig = field(default_factory=NotificationsConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+    log_archive: LogArchiveConfig = field(default_factory=LogArchiveConfig)
+    log_index: LogIndexConfig = field(default_factory=LogIndexConfig)
+    catalog: CatalogConfig = field(default_factory=CatalogConfig)
+    restore: RestoreConfig = field(default_factory=RestoreConfig)
+    export: ExportConfig = field(default_factory=ExportConfig)
+    segments: SegmentsConfig = field(default_factory=SegmentsConfig)
+    timeouts: TimeoutsConfig = field(default_factory=TimeoutsConfig)
+    journal: JournalConfig = field(default_factory=JournalConfig)
+    scheduling: SchedulingConfig = field(default_factory=SchedulingConfig)
+    planning: PlanningConfig = field(default_factory=PlanningConfig)
+    vm_options: dict = field(default_factory=dict)
+    targets: dict = field(default_factory=dict)
+    source_path: str = ''
+    parser: configparser.ConfigParser = field(default=None, compare=False, repr=False)
+
+# Maps the config.ini section name to the AppConfig attribute and its dataclass.
+SECTIONS = {
+    'Paths': ('paths', PathsConfig),
+    'VMDetails': ('vm_details', VMDetailsConfig),
+    'SnapshotDetails': ('snapshot_details', SnapshotDetailsConfig),
+    'BackupDetails': ('backup_details', BackupDetailsConfig),
+    'SMTP': ('smtp', SMTPConfig),
+    'Misc': ('misc', MiscConfig),
+    'Watchdog': ('watchdog', WatchdogConfig),
+    'Metrics': ('metrics', MetricsConfig),
+    'Concurrency': ('concurrency', ConcurrencyConfig),
+    'IO': ('io', IOConfig),
+    'Shares': ('shares', SharesConfig),
+    'Notifications': ('notifications', NotificationsConfig),
+    'Logging': ('logging', LoggingConfig),
+    'LogArchive': ('log_archive', LogArchiveConfig),
+    'LogIndex': ('log_index', LogIndexConfig),
+    'Catalog': ('catalog', CatalogConfig),
+    'Restore': ('restore', RestoreConfig),
+    'Export': ('export', ExportConfig),
+    'Segments': ('segments', SegmentsConfig),
+    'Timeouts': ('timeouts', TimeoutsConfig),
+    'Journal': ('journal', JournalConfig),
+    'Scheduling': ('scheduling', SchedulingConfig),
+    'Planning': ('planning', PlanningConfig),
+}
+
+NOTIFICATION_CHANNELS = ('smtp', 'webhook', 'file')
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+LOG_COMPRESSIONS = ('gzip', 'zstd')
+# 'auto' uses net use sessions for UNC shares and the local directory stand-in for other paths.
+SHARE_BACKENDS = ('auto', 'net_use', 'local')
+# [Export] target -> key of the daily backup path the export is written to.
+EXPORT_TARGETS = {'local': 'DAILY_LOCAL', 'nas': 'DAILY_NAS', 'office365': 'DAILY_OFFICE365'}
+
+BOOLEAN_VALUES = {'true': True, 'yes': True, 'on': True, '1': True, 'false': False, 'no': False, 'off': False, '0': False}
+
+# Per VM sections are named after the VM, e.g. [VM Ubuntu - Moodle].
+VM_SECTION_PREFIX = 'VM '
+# Storage target sections, e.g. [Target offsite]. local, nas and office365 tune the built-in
+# destinations, whose directories come from [Paths]; any other name adds a target.
+TARGET_SECTION_PREFIX = 'Target '
+# 'onedrive' is a folder synced by the OneDrive client, see storage_targets.OneDriveTarget.
+TARGET_TYPES = ('local', 'smb', 's3', 'onedrive')
+TARGET_SCHEDULES = ('daily', 'monthly')
+# Built-in targets and the [Paths] keys of their daily and monthly directories.
+BUILTIN_TARGETS = {
+    'local': ('source_daily_backup_path', 'source_monthly_backup_path'),
+    'nas': ('nas_daily_path', 'nas_monthly_path'),
+    'office365': ('office365_daily_path', 'office365_monthly_path'),
+}
+# Type of a target whose section leaves type empty. nas is an smb target when its path is a UNC path.
+DEFAULT_TARGET_TYPES = {'office365': 'onedrive'}
+
+####### Parsing & validation helpers
+def get_default_config_path():
+    """
+    Get the path of config.ini, which is the file next to this module unless the
+    VMBACKUP_CONFIG environment variable names another one.
+
+    Returns:
+        str: Absolute path to config.ini.
+    """
+    return os.environ.get(CONFIG_ENV_VAR) or os.path.join(SCRIPT_DIRECTORY, CONFIG_FILE_NAME)
+
+def parse_vm_names(value):
+    """
+    Split the comma separated vm_names value into a tuple of names.
+
+    Args:
+        value (str): Raw value from the VMDetails section.
+
+    Returns:
+        tuple: VM names with surrounding whitespace removed.
+    """
+    return tuple(name.strip() for name in value.split(',') if name.strip())
+
+def convert_value(section_name, key, raw_value, default):
+    """
+    Convert a raw config value to the type of the dataclass default.
+
+    Args:
+        section_name (str): Section the key belongs to.
+        key (str): Name of the key.
+        raw_value (str): Value read from config.ini.
+        default: Default value of the field, used to decide the type.
+
+    Returns:
+        The converted value.
+
+    Raises:
+        ConfigError: If the value cannot be converted.
+    """
+    if isinstance(default, tuple):
+        return parse_vm_names(raw_value)
+    if isinstance(default, bool):
+        if raw_value.strip().lower() not in BOOLEAN_VALUES:
+            raise ConfigError(f"[{section_name}] {key} must be true or false, got '{raw_value}'")
+        return BOOLEAN_VALUES[raw_value.strip().lower()]
+    if isinstance(default, int):
+        try:
+            return int(raw_value)
+        except ValueError:
+            raise ConfigError(f"[{section_name}] {key} must be an integer, got '{raw_value}'")
+    if isinstance(default, float):
+        try:
+            return float(raw_value)
+        except ValueError:
+            raise ConfigError(f"[{section_name}] {key} must be a number, got '{raw_value}'")
+    return raw_value.strip()
+
+def build_section(parser, section_name, section_class):
+    """
+    Build a section dataclass from a ConfigParser section, falling back to field defaults.
+
+    Args:
+        parser (configparser.ConfigParser): Parsed config file.
+        section_name (str): Name of the section in config.ini.
+        section_class (type): Dataclass describing the section.
+
+    Returns:
+        object: Instance of section_class.
+    """
+    defaults = section_class()
+    if section_name not in parser:
+        logging.info(f"Section '{section_name}' not found in config file. Using defaults.")
+        return defaults
+    values = {}
+    for name in section_class.__dataclass_fields__:
+        if name in parser[section_name]:
+            values[name] = convert_value(section_name, name, parser[section_name][name], getattr(defaults, name))
+    return section_class(**values)
+
+def validate_config(config):
+    """
+    Check the loaded configuration for values that would break a run.
+
+    Args:
+        config (AppConfig): Configuration to validate.
+
+    Returns:
+        list: Warnings about paths that do not exist yet.
+
+    Raises:
+        ConfigError: If a value is outside its allowed range.
+    """
+    if not config.vm_details.vm_names:
+        raise ConfigError("[VMDetails] vm_names must list at least one VM")
+    for section, key in (('snapshot_details', 'daily_retention'), ('backup_details', 'daily_retention'), ('backup_details', 'monthly_retention')):
+        if getattr(getattr(config, section), key) < 0:
+            raise ConfigError(f"{section}.{key} cannot be negative")
+    if not 1 <= config.misc.days_in_month <= 28:
+        raise ConfigError("[Misc] days_in_month must be between 1 and 28")
+    if not 0 <= config.misc.weekday_end <= 7:
+        raise ConfigError("[Misc] weekday_end must be between 0 and 7")
+    for key in ('virtualbox', 'disk', 'network', 'default'):
+        if getattr(config.concurrency, key) < 1:
+            raise ConfigError(f"[Concurrency] {key} must be at least 1")
+    for channel in config.notifications.channels:
+        if channel not in NOTIFICATION_CHANNELS:
+            raise ConfigError(f"[Notifications] channels must be among {', '.join(NOTIFICATION_CHANNELS)}, got '{channel}'")
+    if 'webhook' in config.notifications.channels and not config.notifications.webhook_url:
+        raise ConfigError("[Notifications] webhook_url is required for the webhook channel")
+    if 'file' in config.notifications.channels and not config.notifications.file_directory:
+        raise ConfigError("[Notifications] file_directory is required for the file channel")
+    if config.notifications.max_attempts < 1 or config.notifications.retry_seconds < 1:
+        raise ConfigError("[Notifications] max_attempts and retry_seconds must be at least 1")
+    if config.logging.level not in LOG_LEVELS:
+        raise ConfigError(f"[Logging] level must be one of {', '.join(LOG_LEVELS)}, got '{config.logging.level}'")
+    if config.logging.queue_size < 1 or config.logging.sample_every < 1:
+        raise ConfigError("[Logging] queue_size and sample_every must be at least 1")
+    if config.log_archive.compression not in LOG_COMPRESSIONS:
+        raise ConfigError(f"[LogArchive] compression must be one of {', '.join(LOG_COMPRESSIONS)}, got '{config.log_archive.compression}'")
+    if config.log_archive.pack_after_days < 1 or config.log_archive.keep_months < 1:
+        raise ConfigError("[LogArchive] pack_after_days and keep_months must be at least 1")
+    if config.log_archive.pack_after_days > config.backup_details.daily_retention:
+        # the daily cleanup would delete compressed logs before they are packed
+        raise ConfigError("[LogArchive] pack_after_days cannot exceed [BackupDetails] daily_retention")
+    if config.export.target not in EXPORT_TARGETS:
+        raise ConfigError(f"[Export] target must be one of {', '.join(EXPORT_TARGETS)}, got '{config.export.target}'")
+    if config.segments.segment_size_mb < 1:
+        raise ConfigError(f"[Segments] segment_size_mb must be at least 1, got {config.segments.segment_size_mb}")
+    if config.segments.retries < 0:
+        raise ConfigError(f"[Segments] retries cannot be negative, got {config.segments.retries}")
+    if config.restore.streams < 1 or config.restore.chunk_size_mb < 1:
+        raise ConfigError("[Restore] streams and chunk_size_mb must be at least 1")
+    if config.shares.backend not in SHARE_BACKENDS:
+        raise ConfigError(f"[Shares] backend must be one of {', '.join(SHARE_BACKENDS)}, got '{config.shares.backend}'")
+    if config.shares.reconnect_attempts < 1 or config.shares.revalidate_seconds < 0 or config.shares.reconnect_delay < 0:
+        raise ConfigError("[Shares] reconnect_attempts must be at least 1, revalidate_seconds and reconnect_delay cannot be negative")
+    if config.io.disk_streams < 1 or config.io.network_streams < 1:
+        raise ConfigError("[IO] disk_streams and network_streams must be at least 1")
+    for pair in filter(None, (pair.strip() for pair in config.io.device_overrides.split(';'))):
+        if not re.fullmatch(r'.+=\s*[1-9]\d*', pair):
+            raise ConfigError(f"[IO] device_overrides entries must look like 'path=streams', got '{pair}'")
+    for key, value in vars(config.timeouts).items():
+        if value < 0:
+            raise ConfigError(f"[Timeouts] {key} cannot be negative (use 0 for no limit)")
+    if config.journal.keep_runs < 1:
+        raise ConfigError("[Journal] keep_runs must be at least 1")
+    if config.scheduling.max_parallel_vms < 1:
+        raise ConfigError("[Scheduling] max_parallel_vms must be at least 1")
+    if config.planning.window_end and not re.fullmatch(r'([01]\d|2[0-3]):[0-5]\d', config.planning.window_end):
+        raise ConfigError(f"[Planning] window_end must be HH:MM, got '{config.planning.window_end}'")
+    if config.planning.safety_factor <= 0:
+        raise ConfigError("[Planning] safety_factor must be positive")
+    validate_vm_options(config.vm_details.vm_names, config.vm_options)
+    validate_targets(config.targets)
+    if config.watchdog.poll_interval < 1 or config.watchdog.backoff_initial < 1:
+        raise ConfigError("[Watchdog] poll_interval and backoff_initial must be at least 1 second")
+
+    warnings = []
+    for key in ('virtual_box_path', 'vm_management_source_path'):
+        path = getattr(config.paths, key)
+        if path and not os.path.isdir(path):
+            warnings.append(f"[Paths] {key} does not exist: {path}")
+    return warnings
+
+def validate_vm_options(vm_names, vm_options):
+    """
+    Check per VM priorities and dependencies.
+
+    Args:
+        vm_names (tuple): Configured VM names.
+        vm_options (dict): VM name -> VMOptions.
+
+    Raises:
+        ConfigError: If a priority is below 1, a dependency is not a configured VM or the
+            dependencies form a cycle.
+    """
+    for vm_name, options in vm_options.items():
+        section = f"[{VM_SECTION_PREFIX}{vm_name}]"
+        if options.priority < 1:
+            raise ConfigError(f"{section} priority must be at least 1")
+        for dependency in options.depends_on:
+            if dependency not in vm_names or dependency == vm_name:
+                raise ConfigError(f"{section} depends_on names '{dependency}', which is not another VM in vm_names")
+    visiting, checked = set(), set()
+
+    def visit(vm_name):
+        if vm_name in checked:
+            return
+        if vm_name in visiting:
+            raise ConfigError(f"VM dependencies form a cycle through '{vm_name}'")
+        visiting.add(vm_name)
+        for dependency in vm_options.get(vm_name, VMOptions()).depends_on:
+            visit(dependency)
+        visiting.discard(vm_name)
+        checked.add(vm_name)
+
+    for vm_name in vm_names:
+        visit(vm_name)
+
+def validate_targets(targets):
+    """
+    Check the '[Target <name>]' sections.
+
+    Args:
+        targets (dict): Target name -> TargetOptions.
+
+    Raises:
+        ConfigError: If a type, schedule or tuning value is invalid or a required key is missing.
+    """
+    for name, options in targets.items():
+        section = f"[{TARGET_SECTION_PREFIX}{name}]"
+        if options.streams < 1 or options.chunk_size_mb < 1:
+            raise ConfigError(f"{section} streams and chunk_size_mb must be at least 1")
+        if options.type and options.type not in TARGET_TYPES:
+            raise ConfigError(f"{section} type must be one of {', '.join(TARGET_TYPES)}, got '{options.type}'")
+        if name in BUILTIN_TARGETS:
+            if options.type == 's3':
+                raise ConfigError(f"{section} is a directory and cannot be an s3 target")
+            continue
+        if options.schedule not in TARGET_SCHEDULES:
+            raise ConfigError(f"{section} schedule must be one of {', '.join(TARGET_SCHEDULES)}, got '{options.schedule}'")
+        if options.retention < 0:
+            raise ConfigError(f"{section} retention cannot be negative")
+        if options.type == 's3' and not options.bucket:
+            raise ConfigError(f"{section} bucket is required for s3 targets")
+        if options.type != 's3' and not options.path:
+            raise ConfigError(f"{section} path is required for {options.type or 'local'} targets")
+
+def build_targets(parser):
+    """
+    Read the optional '[Target <name>]' sections.
+
+    Args:
+        parser (configparser.ConfigParser): Parsed config file.
+
+    Returns:
+        dict: Target name -> TargetOptions for every target section.
+    """
+    return {section_name[len(TARGET_SECTION_PREFIX):].strip(): build_section(parser, section_name, TargetOptions)
+            for section_name in parser.sections() if section_name.startswith(TARGET_SECTION_PREFIX)}
+
+def build_vm_options(parser, vm_names):
+    """
+    Read the optional '[VM <name>]' sections.
+
+    Args:
+        parser (configparser.ConfigParser): Parsed config file.
+        vm_names (tuple): Configured VM names.
+
+    Returns:
+        dict: VM name -> VMOptions for every VM that has a section.
+    """
+    vm_options = {}
+    for section_name in parser.sections():
+        if not section_name.startswith(VM_SECTION_PREFIX):
+            continue
+        vm_name = section_name[len(VM_SECTION_PREFIX):].strip()
+        if vm_name not in vm_names:
+            logging.warning(f"Section [{section_name}] does not match any VM in vm_names. Ignoring it.")
+            continue
+        vm_options[vm_name] = build_section(parser, section_name, VMOptions)
+    return vm_options
+
+def load_config(config_file_path=None):
+    """
+    Read and validate config.ini into an AppConfig.
+
+    Args:
+        config_file_path (str, optional): Path to config.ini. Defaults to the file next to this module.
+
+    Returns:
+        AppConfig: The loaded configuration.
+
+    Raises:
+        ConfigError: If the file is missing or holds invalid values.
+    """
+    config_file_path = config_file_path or get_default_config_path()
+    if not os.path.exists(config_file_path):
+        raise ConfigError(f"Config file does not exist at {config_file_path}")
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(config_file_path)
+    except configparser.Error as e:
+        raise ConfigError(f"Error reading config file: {e}")
+    config = build_app_config(parser, config_file_path)
+    for warning in validate_config(config):
+        logging.warning(warning)
+    return config
+
+def build_app_config(parser, source_path):
+    """
+    Convert parsed config.ini contents into an AppConfig without validating it.
+
+    Args:
+        parser (configparser.ConfigParser): The parsed file.
+        source_path (str): Path the contents belong to.
+
+    Returns:
+        AppConfig: The configuration.
+
+    Raises:
+        ConfigError: If a value has the wrong type.
+    """
+    sections = {attribute: build_section(parser, section_name, section_class)
+                for section_name, (attribute, section_class) in SECTIONS.items()}
+    vm_options = build_vm_options(parser, sections['vm_details'].vm_names)
+    return AppConfig(source_path=source_path, parser=parser, vm_options=vm_options, targets=build_targets(parser), **sections)
+
+def get_vm_options(config, vm_name):
+    """
+    Get a VM's options, or the defaults if it has no '[VM <name>]' section.
+
+    Args:
+        config (AppConfig): Loaded configuration.
+        vm_name (str): The name of the virtual machine.
+
+    Returns:
+        VMOptions: The VM's options.
+    """
+    return config.vm_options.get(vm_name, VMOptions())
+
+def get_target_options(config, name):
+    """
+    Get a storage target's options, or the defaults if it has no '[Target <name>]' section.
+
+    Args:
+        config (AppConfig): Loaded configuration.
+        name (str): Target name.
+
+    Returns:
+        TargetOptions: The target's options.
+    """
+    return config.targets.get(name, TargetOptions())
+
+####### Process wide cache
+_cache = {'config': None, 'path': None, 'mtime': None}
+
+def get_config(config_file_path=None, reload_on_change=False):
+    """
+    Return the process wide configuration, loading config.ini only once.
+
+    Args:
+        config_file_path (str, optional): Path to config.ini. Defaults to the file next to this module.
+        reload_on_change (bool): Re-read the file if its modification time changed since the last load.
+
+    Returns:
+        AppConfig: The cached configuration.
+    """
+    config_file_path = config_file_path or get_default_config_path()
+    cached = _cache['config']
+    if cached is not None and _cache['path'] == config_file_path:
+        if not reload_on_change:
+            return cached
+        try:
+            if os.path.getmtime(config_file_path) == _cache['mtime']:
+                return cached
+        except OSError:
+            return cached
+        logging.info(f"Config file {config_file_path} changed. Reloading.")
+    config = load_config(config_file_path)
+    _cache.update(config=config, path=config_file_path, mtime=os.path.getmtime(config_file_path))
+    return config
+
+def clear_config_cache():
+    """Forget the cached configuration so the next get_config() call re-reads the file."""
+    _cache.update(config=None, path=None, mtime=None)
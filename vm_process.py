@@ -2,15 +2,27 @@ import subprocess
 import shutil
 import os
 import re
-import configparser
 import logging
-import string
 import datetime
-import smtplib
+import time
 from enum import Enum
-from dotenv import load_dotenv
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from contextlib import contextmanager
+from vm_config import BUILTIN_TARGETS, ConfigError, EXPORT_TARGETS, get_config, get_default_config_path, get_vm_options
+from run_metrics import phase_timer, get_metrics, write_run_metrics, load_previous_summaries, get_directory_size
+from progress import VBoxProgressParser, CopyProgressParser
+from run_journal import start_journal, find_unfinished_journal, is_resumable
+from vm_scheduler import build_jobs, run_jobs
+from run_planner import RunPlanner, get_window_deadline, choose_deferrals
+from run_events import get_event_paths, start_event_log, stop_event_log, build_run_summary, write_run_summary, read_run_summary
+from notifications import SMTPChannel, create_message, notify, resume_delivery, flush_notifications
+from log_pipeline import start_logging, apply_logging_config, flush_logging, get_dropped_count, get_log_file_path, SampledLog
+from share_sessions import open_shares, close_shares, ensure_share
+from storage_targets import (StorageError, get_directory_target, get_extra_targets, get_onedrive_target, is_cloud_only_file,
+                             scan_tree)
+from ova_segments import (SEGMENTS_SUFFIX, build_manifest, get_segments_directory, is_complete, start_segmented_copy,
+                          finish_segmented_copy, write_segment)
+# async_exec (asyncio), log_archive, log_index, backup_catalog and run_digest are imported by the
+# functions using them, so scripts that only need the VM helpers, such as status, start quickly.
 
 class VM(Enum):
     VBOX_MANAGE = "VBoxManage"
@@ -26,270 +38,522 @@ class SnapshotAction(Enum):
     DELETE = "delete"
     SNAPSHOT_PATTERN = r'Snapshot-\d{6}'
 
-def main():
+def main(resume=False):
+    """
+    Run the nightly maintenance.
+
+    Args:
+        resume (bool): Continue the last run if it did not finish, skipping the steps its journal
+            shows as done and first starting any VM it left powered off.
+    """
+    from async_exec import configure_engine, limits_from_config, device_limits_from_config, get_engine
     log_file_path = configure_logging("vmmaintenance")
-    generate_config_from_script()
-    setup_environment_variables()
+    load_environment_variables()
     try:
-        if is_execution_day():
-            Paths = read_config("Paths")
-            disconnect_all_active_connections(Paths['nas_path'])
-            network_drive = map_network_drive(Paths['nas_path'])
-            daily_backup_paths, monthly_backup_paths = get_backup_paths(Paths, network_drive)
-            os.chdir(Paths['virtual_box_path'])
-            configure_logging("vmmaintenance")
-            VMDetails = read_config("VMDetails")
-            vm_names_section = VMDetails['vm_names']
-            for vm_name in vm_names_section.split(','):
-                vm_name = vm_name.strip()
-                logging.info(f"Processing VM: '{vm_name}'")
-                manage_vm_action(vm_name, VMAction.POWER_OFF)
-                create_snapshot(vm_name)
-                export_vm(vm_name, daily_backup_paths['DAILY_LOCAL'])
-                manage_snapshot_retention(vm_name)
-                manage_vm_action(vm_name, VMAction.START_HEADLESS)
-            file_management(Paths, daily_backup_paths, monthly_backup_paths)
-            disconnect_all_active_connections(Paths['nas_path'])
-            send_log_email(log_file_path) 
+        config = get_config()
+        apply_logging_config(config.logging)
+        resume_delivery(config)
+        configure_engine(limits_from_config(config.concurrency), *device_limits_from_config(config.io))
+        journal = None
+        if not (resume or is_execution_day(config)):
+            logging.info("Not running the script today.")
+        elif not acquire_maintenance_lock(config.watchdog.maintenance_lock_hours):
+            logging.error(f"Another maintenance run holds {get_maintenance_lock_path()}. Not starting.")
         else:
-            logging.info("Not running the script today.")       
+            journal = open_run_journal(config.journal, resume)
+        if journal:
+            event_log = start_event_log(log_file_path, get_metrics())
+            Paths = config.paths
+            os.chdir(Paths.virtual_box_path)
+            restart_vms_left_off(journal)
+            nas_available = open_shares(config, Paths.nas_path)
+            daily_backup_paths, monthly_backup_paths = get_backup_paths(Paths, nas_available)
+            planner = RunPlanner(load_previous_summaries(config.metrics.summary_directory, config.metrics.history_runs))
+            deadline = get_window_deadline(config.planning.window_end, get_metrics().started)
+            jobs = build_jobs(config, planner)
+            log_run_prediction(config, jobs, planner, deadline)
+            run_jobs(jobs, lambda vm_name: process_vm(vm_name, daily_backup_paths, config, journal),
+                     config.scheduling.max_parallel_vms)
+            if not journal.is_done('file_management'):
+                with journal.step('file_management'):
+                    file_management(config, daily_backup_paths, monthly_backup_paths, planner, deadline)
+            if not journal.is_done('email'):
+                with journal.step('email'), phase_timer('email'):
+                    send_log_email(log_file_path, config, build_run_summary(get_metrics().summary(), event_log))
+            flush_notifications(config)
+            get_metrics().record_device_usage(get_engine().device_report())
+            get_metrics().set_gauge('log_records_dropped', get_dropped_count())
+            write_run_summary(log_file_path, build_run_summary(write_run_metrics(config.metrics), event_log))
+            index_log_files(config)
+            journal.record('run', 'done')
     except Exception as e:
         logging.critical(f"Error encountered: {e}")
+    finally:
+        close_shares()
+        stop_event_log()
+        release_maintenance_lock()
 
-####### execute_subprocess_command
-def execute_subprocess_command(command, log_message):
+    return True
+
+def open_run_journal(settings, resume):
     """
-    Execute a subprocess command.
+    Start the journal of a new run, or continue the unfinished one. Call only while holding the
+    maintenance lock, since resuming writes to the journal.
 
-    Parameters:
-        command (list): List containing the command and its arguments.
-        log_message (str): Message to log before executing the command.
+    Args:
+        settings (JournalConfig): The [Journal] section.
+        resume (bool): Continue the last run instead of starting a new one.
 
     Returns:
-        CompletedProcess: An object representing the completed process.
+        RunJournal or None: The journal, or None if there is nothing to resume or the unfinished
+            run is older than the previous night.
+    """
+    if not resume:
+        return start_journal(settings.directory, settings.keep_runs)
+    journal = find_unfinished_journal(settings.directory)
+    if journal is None:
+        logging.info("The last run finished. Nothing to resume.")
+        return None
+    if not is_resumable(journal):
+        started = journal.started_at()
+        when = f"started {started:%Y-%m-%d}" if started else "has no start date in its name"
+        logging.error(f"The unfinished run in {journal.path} {when} and is too old to resume. Start a new run instead.")
+        return None
+    journal.resume()
+    return journal
 
-    Raises:
-        subprocess.CalledProcessError: If the subprocess exits with a non-zero return code.
+@contextmanager
+def run_step(journal, step, vm_name):
     """
+    Time a VM step and record it in the run journal.
+
+    Args:
+        journal (RunJournal): Journal of the current run.
+        step (str): Step name, also used as the phase name.
+        vm_name (str): The name of the virtual machine.
+
+    Yields:
+        dict: The phase record; setting its status to 'failed' also records the step as failed.
+    """
+    with journal.step(step, vm_name) as status, phase_timer(step, vm=vm_name) as phase:
+        yield phase
+        status['status'] = 'done' if phase['status'] == 'ok' else 'failed'
+
+def process_vm(vm_name, daily_backup_paths, config, journal):
+    """
+    Power off, snapshot, export and restart one VM, timing each step.
+
+    A step that fails or times out is recorded and the VM is still started again, so one hung
+    VM does not keep the others powered off. When resuming, a VM whose export the journal shows
+    as done only gets its remaining steps.
+
+    Args:
+        vm_name (str): The name of the virtual machine.
+        daily_backup_paths (dict): Daily backup directories; the export goes to the [Export] target.
+        config (AppConfig): Loaded configuration.
+        journal (RunJournal): Journal of the current run.
+    """
+    metrics = get_metrics()
+    exported = journal.is_done('export', vm_name)
+    if exported and journal.is_done('snapshot_retention', vm_name) and journal.is_done('power_on', vm_name):
+        logging.info(f"VM '{vm_name}' was already completed by this run. Skipping.")
+        return
+    logging.info(f"Processing VM: '{vm_name}'")
+    started = time.monotonic()
     try:
-        logging.info(log_message)
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        logging.info(f"{log_message} completed successfully.")
-        return result
-    except subprocess.CalledProcessError as e:
-        logging.error(f"{log_message} failed with return code {e.returncode}.")
-        raise
+        if not exported:
+            with run_step(journal, 'power_off', vm_name) as phase:
+                phase['status'] = 'ok' if manage_vm_action(vm_name, VMAction.POWER_OFF) else 'failed'
+            with run_step(journal, 'snapshot', vm_name):
+                create_snapshot(vm_name)
+            with run_step(journal, 'export', vm_name) as phase:
+                daily_backup_path = get_export_directory(config, daily_backup_paths)
+                if export_vm(vm_name, daily_backup_path):
+                    export_file = os.path.join(daily_backup_path, get_export_file_name(vm_name))
+                    phase['bytes'] = os.path.getsize(export_file) if os.path.exists(export_file) else None
+                else:
+                    phase['status'] = 'failed'
+                    metrics.increment('export_failures')
+        if not journal.is_done('snapshot_retention', vm_name):
+            with run_step(journal, 'snapshot_retention', vm_name):
+                manage_snapshot_retention(vm_name, config.snapshot_details.daily_retention)
     except Exception as e:
-        logging.exception(f"An error occurred during execution: {e}")
-        raise
+        metrics.increment('vm_failures')
+        logging.error(f"Maintenance of VM '{vm_name}' failed, starting it again: {e}")
+    finally:
+        with run_step(journal, 'power_on', vm_name) as phase:
+            phase['status'] = 'ok' if manage_vm_action(vm_name, VMAction.START_HEADLESS) else 'failed'
+    metrics.increment('vms_processed')
+    downtime, max_downtime = time.monotonic() - started, get_vm_options(config, vm_name).max_downtime
+    if max_downtime and downtime > max_downtime:
+        metrics.increment('downtime_exceeded')
+        logging.warning(f"VM '{vm_name}' was down for {downtime:.0f}s, more than its max_downtime of {max_downtime}s.")
 
-####### These two functions are used across setup_environment_variables and generate_log_file_path
-def get_script():
+def restart_vms_left_off(journal):
     """
-    Get the absolute path of the current script.
+    Start the VMs an interrupted run powered off and never started again.
 
-    Returns:
-        str: The absolute path of the current script.
+    Called before anything else when resuming so the VMs are back up within minutes. VMs whose
+    export had not finished are processed again afterwards.
+
+    Args:
+        journal (RunJournal): Journal of the run being resumed.
     """
-    return os.path.abspath(__file__) 
+    for vm_name in journal.vms_left_off():
+        logging.warning(f"VM '{vm_name}' was left powered off by the interrupted run. Starting it.")
+        with run_step(journal, 'power_on', vm_name) as phase:
+            phase['status'] = 'ok' if manage_vm_action(vm_name, VMAction.START_HEADLESS) else 'failed'
 
-def get_script_directory():
+####### Run planning
+def estimate_copies(planner, Paths, is_last_day):
     """
-    Get the directory of the current script.
+    Expected copy time per category of work, from earlier runs scaled by today's source sizes.
+
+    Copies within a category are summed, an upper bound since the engine overlaps some of them.
+
+    Args:
+        planner (RunPlanner): Duration estimates from earlier runs.
+        Paths (PathsConfig): Paths section of the loaded configuration.
+        is_last_day (bool): Whether the monthly copies run today.
 
     Returns:
-        str: The directory path of the current script.
+        dict: Category ('required', 'offsite' or 'monthly') -> expected seconds.
     """
-    return os.path.dirname(os.path.abspath(__file__))
+    estimates = {}
+    for category, src, dest in get_copy_tasks(Paths, is_last_day):
+        seconds = planner.phase_seconds('copy', get_directory_size(src), source=src, destination=dest) or 0.0
+        estimates[category] = estimates.get(category, 0.0) + seconds
+    return estimates
 
-def create_directories(directory):
+def log_run_prediction(config, jobs, planner, deadline):
     """
-    Create directories if they don't exist.
+    Log when the run is expected to end and warn if that is after the maintenance window.
 
     Args:
-        directory (str): The directory path to be created.
+        config (AppConfig): Loaded configuration.
+        jobs (list): VMJobs with their expected downtimes.
+        planner (RunPlanner): Duration estimates from earlier runs.
+        deadline (datetime.datetime or None): End of the maintenance window.
+    """
+    copies = estimate_copies(planner, config.paths, is_last_working_day_of_month(config))
+    vm_seconds = sum(job.estimate for job in jobs) / config.scheduling.max_parallel_vms
+    total = (vm_seconds + sum(copies.values())) * config.planning.safety_factor
+    finish = datetime.datetime.now() + datetime.timedelta(seconds=total)
+    window = f" (window ends {deadline:%H:%M})" if deadline else ''
+    logging.info(f"Expected run time {total / 60:.0f} min: VMs {vm_seconds / 60:.0f} min, copies {sum(copies.values()) / 60:.0f} min. "
+                 f"Expected end {finish:%H:%M}{window}.")
+    if deadline and finish > deadline:
+        logging.warning(f"The run is expected to overrun the maintenance window by {(finish - deadline).total_seconds() / 60:.0f} min.")
+
+####### Maintenance lock
+def get_maintenance_lock_path():
+    """
+    Get the path of the lock file that marks a maintenance run in progress.
+
+    Returns:
+        str: Path to the lock file next to config.ini.
     """
-    os.makedirs(directory, exist_ok=True)
+    return os.path.join(get_config_directory(), 'vmmaintenance.lock')
 
-def file_exists(file):
+_lock_state = {'held': False}
+
+def is_process_running(pid):
     """
-    Check if a file exists in the script directory.
+    Check whether a process with the given PID exists.
 
     Args:
-        file (str): The name of the file to check.
+        pid (int): Process id.
 
     Returns:
-        bool: True if the file exists, False otherwise.
-    """
-    script_dir = get_script_directory()
-    file_path = os.path.join(script_dir, file)
-    return os.path.exists(file_path)
+        bool: True if the process is running.
+    """
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: the process exists
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
-####### Setup_environment_variables & Helper Functions 
-def find_used_env_vars(script_content):
+def read_maintenance_lock(lock_path):
     """
-    Find used environment variables in the script content.
+    Read the PID and age of a maintenance lock.
 
     Args:
-        script_content (str): The content of the script.
+        lock_path (str): Path to the lock file.
 
     Returns:
-        set: A set containing the names of environment variables used in the script.
+        tuple or None: (pid or None if unreadable, age in seconds), or None if there is no lock.
     """
-    return set(re.findall(r"os\.getenv\(['\"]([^'\"]+)['\"]\)", script_content))
+    try:
+        age = datetime.datetime.now().timestamp() - os.path.getmtime(lock_path)
+        with open(lock_path) as lock_file:
+            content = lock_file.read().split()
+    except OSError:
+        return None
+    pid = int(content[0]) if content and content[0].isdigit() else None
+    return pid, age
+
+def read_lock_identity(lock_path):
+    """
+    Tell one lock file from another that replaced it under the same name.
+
+    Returns:
+        tuple or None: (modification time in ns, content), or None if there is no lock.
+    """
+    try:
+        with open(lock_path, 'rb') as lock_file:
+            return os.fstat(lock_file.fileno()).st_mtime_ns, lock_file.read()
+    except OSError:
+        return None
 
-def get_env_values(used_env_vars):
+def remove_stale_lock(lock_path, identity):
     """
-    Prompt the user to provide values for the given environment variables.
+    Remove a lock judged stale, but not a lock another starter created in its place meanwhile.
+
+    The lock is first moved aside under a name of our own, which only one process can do, and
+    removed only if it is still the lock that was judged stale. Any other lock is put back.
 
     Args:
-        used_env_vars (set): A set containing the names of environment variables.
+        lock_path (str): Path to the lock file.
+        identity (tuple): read_lock_identity of the stale lock.
+    """
+    aside = f"{lock_path}.{os.getpid()}.{time.monotonic_ns()}.stale"
+    try:
+        os.rename(lock_path, aside)
+    except FileNotFoundError:
+        return  # removed by another starter
+    if read_lock_identity(aside) != identity:
+        try:
+            os.link(aside, lock_path)  # unlike a rename, never replaces a lock created since
+        except FileExistsError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not put back the maintenance lock moved to {aside}: {e}")
+            return
+    os.remove(aside)
+
+def is_stale_lock(lock_path, max_age_hours):
+    """
+    Check whether a maintenance lock was left over by a run that is no longer going: it is older
+    than max_age_hours or the process that wrote it has ended.
 
     Returns:
-        dict: A dictionary containing environment variable names as keys and their corresponding values.
+        bool: True if the lock is stale, False if it is live or missing.
     """
-    env_values = {}
-    logging.info("Please provide values for the following environment variables:")
-    for env_var in used_env_vars:
-        value = input(f"{env_var}: ")
-        env_values[env_var] = value if not re.search(r"[^\w\-]", value) else f"'{value}'"
-    return env_values
+    lock = read_maintenance_lock(lock_path)
+    if lock is None:
+        return False
+    pid, age = lock
+    if age > max_age_hours * 3600:
+        logging.warning(f"Ignoring stale maintenance lock {lock_path} ({age / 3600:.1f} hours old).")
+        return True
+    if pid is not None and pid != os.getpid() and not is_process_running(pid):
+        logging.warning(f"Ignoring maintenance lock {lock_path} of PID {pid}, which is no longer running.")
+        return True
+    return False
 
-def write_env_file(env_file, env_values):
+def acquire_maintenance_lock(max_age_hours):
     """
-    Write environment variables and their values to a file.
+    Create the maintenance lock so the watchdog does not restart VMs powered off for backup.
+
+    The lock is created exclusively. A live lock of another run is honoured; a stale one is
+    removed with remove_stale_lock and created again. The PID is read back afterwards, so a
+    starter whose lock was replaced does not go on.
 
     Args:
-        env_file (str): The path to the environment file.
-        env_values (dict): A dictionary containing environment variable names and their values.
+        max_age_hours (int): Locks older than this are treated as left over from a crashed run.
 
     Returns:
-        bool: True if writing to the file was successful, False otherwise.
+        bool: True if this process now holds the lock.
     """
-    try:
-        with open(env_file, 'w') as f:
-            for env_var, value in env_values.items():
-                f.write(f"{env_var}={value}\n")
+    lock_path = get_maintenance_lock_path()
+    for _ in range(2):
+        try:
+            descriptor = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            identity = read_lock_identity(lock_path)
+            if not is_stale_lock(lock_path, max_age_hours):
+                return False
+            remove_stale_lock(lock_path, identity)
+            continue
+        with os.fdopen(descriptor, 'w') as lock_file:
+            lock_file.write(f"{os.getpid()} {datetime.datetime.now().isoformat()}\n")
+        lock = read_maintenance_lock(lock_path)
+        if lock is None or lock[0] != os.getpid():
+            logging.warning(f"The maintenance lock {lock_path} was taken over by another run while it was created.")
+            return False
+        _lock_state['held'] = True
         return True
-    except Exception as e:
-        logging.error(f"Error writing to {env_file}: {e}")
-        return False
-    
-def setup_environment_variables():
-    """
-    Setup environment variables based on the script content.
+    return False
 
-    This function checks for the existence of a .env file. If found, it outputs a message saying it exists.
-    If not found, it prompts the user to provide values for environment variables used in the script content,
-    then creates a .env file.
+def release_maintenance_lock():
     """
-    env_file = '.env'
-    if file_exists(env_file):
-        logging.info(f"The .env file '{env_file}' already exists. Skipping user input and file writing.")
-    else:
-        logging.info("No .env file found. Let's set it up.")
-        script_path = get_script()
-        with open(script_path, 'r') as script_file:
-            script_content = script_file.read()
-        used_env_vars = find_used_env_vars(script_content)
-        env_values = get_env_values(used_env_vars)
-        success = write_env_file(env_file, env_values)
-        if success:
-            logging.info(f".env file created successfully at {env_file}")
-        else:
-            logging.error("Failed to create .env file.")
+    Remove the maintenance lock if this process holds it.
+    """
+    if not _lock_state['held']:
+        return
+    _lock_state['held'] = False
+    lock = read_maintenance_lock(get_maintenance_lock_path())
+    if lock is None or lock[0] not in (None, os.getpid()):
+        logging.warning("The maintenance lock was replaced by another process. Leaving it in place.")
+        return
+    try:
+        os.remove(get_maintenance_lock_path())
+    except FileNotFoundError:
+        pass
 
-####### Generate_Config_from_Script & Helper Functions 
-def parse_config_from_script(script_path):
+def is_maintenance_running(max_age_hours):
     """
-    Parse configuration settings from a script.
+    Check whether a maintenance run currently holds the lock.
 
     Args:
-        script_path (str): The path to the script containing configuration settings.
+        max_age_hours (int): Locks older than this are treated as left over from a crashed run.
 
     Returns:
-        dict: A dictionary containing parsed configuration settings.
+        bool: True if a live lock exists, False otherwise.
     """
+    lock_path = get_maintenance_lock_path()
+    return os.path.exists(lock_path) and not is_stale_lock(lock_path, max_age_hours)
+
+####### execute_subprocess_command
+def get_command_timeout(operation):
+    """
+    Get the time limit of an operation from the [Timeouts] section.
+
+    Parameters:
+        operation (str): Key in the [Timeouts] section, e.g. 'export' or 'query'.
+
+    Returns:
+        int or None: Seconds allowed, or None when the setting is 0 (no limit).
+    """
+    return getattr(get_config().timeouts, operation) or None
+
+def execute_subprocess_command(command, log_message, timeout=None, resource=None, progress=None, stall_timeout=None, watch_path=None):
+    """
+    Execute a subprocess command.
+
+    The command runs on the shared asyncio engine (async_exec), so it counts against the
+    concurrency limit of its resource class even when called from several threads. Only the
+    most recent output lines are kept in the returned result.
+
+    Parameters:
+        command (list): List containing the command and its arguments.
+        log_message (str): Message to log before executing the command.
+        timeout (float, optional): Seconds after which the command is killed.
+        resource (ResourceClass, optional): Resource class, derived from the command when omitted.
+        progress (ProgressTracker, optional): Parses the command's output and logs its progress.
+        stall_timeout (float, optional): Seconds without output or growth of watch_path after which
+            the command is killed.
+        watch_path (str, optional): File or directory the command writes to.
+
+    Returns:
+        CompletedProcess: An object representing the completed process.
+
+    Raises:
+        subprocess.CalledProcessError: If the subprocess exits with a non-zero return code.
+        subprocess.TimeoutExpired: If the subprocess ran longer than timeout or stalled. The
+            command and every process it started have been killed.
+    """
+    from async_exec import run_command
     try:
-        script = get_script()
-        with open(script, 'r') as file:
-            script_lines = file.readlines()
-            section_paths = {}
-            for line in script_lines:
-                matches = re.findall(r"([A-Z]\w+)\[['\"](.+?)['\"]\]", line)
-                for match in matches:
-                    header, path = match
-                    if header and path:
-                        combined_key = header + "['" + path + "']"
-                        section_paths[combined_key] = path
-            return section_paths
+        logging.info(log_message)
+        result = run_command(command, resource=resource, timeout=timeout, progress=progress,
+                             stall_timeout=stall_timeout, watch_path=watch_path)
+        result.check_returncode()
+        logging.info(f"{log_message} completed successfully.")
+        return result
+    except subprocess.CalledProcessError as e:
+        logging.error(f"{log_message} failed with return code {e.returncode}.")
+        raise
+    except subprocess.TimeoutExpired as e:
+        get_metrics().increment('command_timeouts')
+        logging.error(f"{log_message} was killed: {e}")
+        raise
     except Exception as e:
-        logging.error(f"Error occurred while parsing script: {e}")
-        return {}
+        logging.exception(f"An error occurred during execution: {e}")
+        raise
 
-def format_section_paths(section_paths):
+####### These two functions are used across load_environment_variables and generate_log_file_path
+def get_script():
     """
-    Format parsed section paths.
-
-    Args:
-        section_paths (dict): Parsed section paths.
+    Get the absolute path of the current script.
 
     Returns:
-        dict: Formatted section paths.
+        str: The absolute path of the current script.
+    """
+    return os.path.abspath(__file__) 
+
+def get_script_directory():
     """
-    formatted_output = {}
-    for key, value in section_paths.items():
-        prefix = key.split("['")[0]
-        if prefix not in formatted_output:
-            formatted_output[prefix] = {}
-        location_key = key.split("['")[-1][:-2]
-        formatted_output[prefix][location_key] = value
-    return formatted_output
+    Get the directory of the current script.
 
-def get_user_input(formatted_output):
+    Returns:
+        str: The directory path of the current script.
     """
-    Get user input for configuration settings.
+    return os.path.dirname(os.path.abspath(__file__))
 
-    Args:
-        formatted_output (dict): Formatted section paths.
+def get_config_directory():
+    """
+    Get the directory of the config.ini in use, which also holds .env and the maintenance lock.
+    This is the script directory unless VMBACKUP_CONFIG names a config.ini elsewhere.
 
     Returns:
-        configparser.ConfigParser or None: Configuration settings obtained from user input.
-    """
-    config = configparser.ConfigParser()
-    if not os.path.exists('config.ini'):
-        for prefix, items in formatted_output.items():
-            config[prefix] = {}
-            for key, value in items.items():
-                input_location = input(f"Enter location for {key} (press enter to keep default value '{value}'): ")
-                if input_location.strip():
-                    items[key] = input_location
-                config[prefix][key] = items[key]
-        return config
-    else:
-        logging.info("Config file 'config.ini' already exists. Skipping user input and file writing.")
-        return None
+        str: The directory path of config.ini.
+    """
+    return os.path.dirname(os.path.abspath(get_default_config_path()))
 
-def write_config_to_file(config):
+def create_directories(directory):
     """
-    Write configuration settings to a file.
+    Create directories if they don't exist.
 
     Args:
-        config (configparser.ConfigParser): Configuration settings to be written to file.
+        directory (str): The directory path to be created.
     """
-    if config:
-        with open('config.ini', 'w') as configfile:
-            config.write(configfile)
+    os.makedirs(directory, exist_ok=True)
+
+def file_exists(file):
+    """
+    Check if a file exists in the script directory.
+
+    Args:
+        file (str): The name of the file to check.
+
+    Returns:
+        bool: True if the file exists, False otherwise.
+    """
+    script_dir = get_script_directory()
+    file_path = os.path.join(script_dir, file)
+    return os.path.exists(file_path)
 
-def generate_config_from_script():
+####### load_environment_variables
+def load_environment_variables():
     """
-    Generate configuration settings from a script.
+    Load the .env file next to config.ini into the environment.
+
+    config.ini and .env are generated by the separate init command (vmbackup.py init), so a
+    scheduled run never prompts for input. A missing file is logged and the run continues with
+    whatever is already set in the environment.
+
+    Returns:
+        bool: True if the .env file was found and loaded, False otherwise.
     """
-    script_path = get_script_directory()
-    section_paths = parse_config_from_script(script_path)
-    formatted_output = format_section_paths(section_paths)
-    config = get_user_input(formatted_output)
-    write_config_to_file(config)
+    env_file = os.path.join(get_config_directory(), '.env')
+    if not os.path.exists(env_file):
+        logging.warning(f"No .env file found at {env_file}. Run 'python vmbackup.py init' to create it.")
+        return False
+    from dotenv import load_dotenv
+    return load_dotenv(env_file)
 
 ####### read_config & Helper Functions
 def read_config_section(config, section_name):
@@ -306,11 +570,14 @@ def read_config_section(config, section_name):
     if section_name not in config:
         logging.critical(f"Error: Section {section_name} does not exist in the config file")
         return None
-    return config[section_name]
+    return dict(config[section_name])
 
 def read_config(section_name):
     """
-    Read configuration settings from a file.
+    Read a raw configuration section.
+
+    The file is parsed once per process by vm_config.get_config(); new code should use the
+    typed AppConfig it returns instead of this dictionary view.
 
     Args:
         section_name (str): Name of the section to read from the config file.
@@ -318,53 +585,54 @@ def read_config(section_name):
     Returns:
         dict or None: Configuration settings from the specified section if found, else None.
     """
-    config_file_path = os.path.join(get_script_directory(), 'config.ini')
-    if not os.path.exists(config_file_path):
-        logging.critical(f"Error: Config file does not exist at {config_file_path}")
-        return None
     try:
-        config = configparser.ConfigParser()
-        config.read(config_file_path)
-        if section_name not in config:
-            logging.error(f"Error: Section '{section_name}' not found in config file.")
-            return None
-
-        section_data = dict(config[section_name])
-        return section_data
-    except Exception as e:
-        logging.error(f"Error reading config file: {e}")
+        config = get_config()
+    except ConfigError as e:
+        logging.critical(f"Error: {e}")
         return None
+    return read_config_section(config.parser, section_name)
 
 ####### configure_logging & Helper Functions 
-def generate_log_file_path(script_directory, logfile):
+def get_logs_directory():
+    """
+    Get the directory holding one log folder per script.
+
+    Returns:
+        str: [Paths] logs_location, or the logs folder next to the scripts when config.ini
+        cannot be read.
+    """
+    try:
+        return get_config().paths.logs_location or os.path.join(get_script_directory(), 'logs')
+    except ConfigError:
+        return os.path.join(get_script_directory(), 'logs')
+
+def generate_log_file_path(logs_directory, logfile):
     """
     Generate the path for the log file.
 
     Args:
-        script_directory (str): Path to the script directory.
+        logs_directory (str): Directory holding one log folder per script.
         logfile (str): Name of the log file.
 
     Returns:
         str: Path to the log file.
     """
     today_date = datetime.date.today().strftime("%Y-%m-%d")
-    logs_folder = os.path.join(script_directory, 'logs', logfile)
-    create_directories(logs_folder)
+    logs_folder = os.path.join(logs_directory, logfile)
     create_directories(logs_folder)
     return os.path.join(logs_folder, f'{today_date}_{logfile}.log')
 
 def setup_logging(log_file_path):
     """
-    Setup logging configuration.
+    Setup logging configuration. Records are written by a background thread, see log_pipeline.
 
     Args:
         log_file_path (str): Path to the log file.
+
+    Returns:
+        bool: False if logging already wrote to this file.
     """
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s]: %(message)s',
-        handlers=[logging.StreamHandler(), logging.FileHandler(log_file_path)]
-    )
+    return start_logging(log_file_path)
 
 def log_configuration_settings():
     """Log configuration settings."""
@@ -381,154 +649,40 @@ def configure_logging(logfile):
     Returns:
         str: Path to the log file.
     """
-    script_directory = get_script_directory()
-    log_file_path = generate_log_file_path(script_directory, logfile)
-    setup_logging(log_file_path)
-    log_configuration_settings()
+    log_file_path = generate_log_file_path(get_logs_directory(), logfile)
+    if setup_logging(log_file_path):
+        log_configuration_settings()
     return log_file_path
 
-####### disconnect_all_active_connections & Helper functions
-def disconnect_all_active_connections(remote_path):
-    """
-    Disconnect all active connections to a remote path.
-
-    Args:
-        remote_path (str): The remote path to disconnect active connections from.
-
-    Returns:
-        bool: True if disconnection was successful, False otherwise.
-    """
-    try:
-        result = execute_subprocess_command(['net', 'use'], "Getting active connections")
-        if result.returncode == 0:
-            active_connections = parse_active_connections(result.stdout, remote_path)
-            log_active_connections(remote_path, active_connections)
-            disconnect_active_connections(active_connections)
-            return True
-        else:
-            logging.info(f"Error getting active connections: {result.stderr}")
-            return False
-
-    except subprocess.CalledProcessError as e:
-        logging.info(f"Error disconnecting active connections: {e}")
-        return False
-
-    except subprocess.TimeoutExpired:
-        logging.info(f"Timeout occurred while disconnecting active connections for {remote_path}")
-        return False
-
-def parse_active_connections(output, remote_path):
-    """
-    Parse active connections from the output of 'net use' command.
-
-    Args:
-        output (str): Output of the 'net use' command.
-        remote_path (str): The remote path to filter active connections.
-
-    Returns:
-        list: List of active connections matching the remote path.
-    """
-    return [line.split()[1] for line in output.splitlines() if line.strip() and remote_path in line and not line.strip().endswith('\\IPC$')]
-
-def log_active_connections(remote_path, active_connections):
-    """
-    Log active connections.
-
-    Args:
-        remote_path (str): The remote path.
-        active_connections (list): List of active connections.
-    """
-    if active_connections:
-        for drive_letter in active_connections:
-            logging.info(f"Active connection: Drive {drive_letter} connected to {remote_path} before disconnection")
-    else:
-        logging.info("No active connections found.")
-
-def disconnect_active_connections(active_connections):
-    """
-    Disconnect active connections.
-
-    Args:
-        active_connections (list): List of active connections to disconnect.
-    """
-    for drive_letter in active_connections:
-        execute_subprocess_command(['net', 'use', drive_letter, '/delete', '/yes'], f"Disconnecting drive {drive_letter}")
-
-####### map_network_drive 
-def map_network_drive(network_path):
-    """
-    Map a network drive.
-
-    Args:
-        network_path (str): The network path to map.
-
-    Raises:
-        Exception: If an error occurs during the process.
-    """
-    load_dotenv()
-    username = os.getenv("NASUsername")
-    password = os.getenv("NASPassword")
-    try:
-        # Construct the net use command to map the network drive
-        drive_letter = find_available_drive_letter()
-        drive_letter = drive_letter + ':'
-        command = ['net', 'use', drive_letter, network_path, '/user:' + username, password]
-        result = execute_subprocess_command(command, f"Mapping network drive {network_path} to {drive_letter}")
-        # Check the return code
-        if result.returncode == 0:
-            logging.info(f"Network drive {network_path} successfully mapped to {drive_letter}.")
-            return True
-    except Exception as e:
-        logging.info(f"ERROR Failed to map network drive {network_path} to {drive_letter}. Error: {e}")
-        return False
-
-####### find_available_drive_letter 
-def find_available_drive_letter():
-    """
-    Find an available drive letter.
-
-    Returns:
-        str: Available drive letter.
-    """
-    try:
-        net_use_output = execute_subprocess_command(['net', 'use'], "Finding available drive letters").stdout
-        used_drive_letters = set()
-        for line in net_use_output.split("\n")[2:]:
-            drive_info = line.split()
-            if len(drive_info) >= 2 and ':' in drive_info[1]:
-                used_drive_letters.add(drive_info[1][0])
-        for letter in reversed(string.ascii_uppercase):
-            if letter not in used_drive_letters:
-                logging.info(f"Drive Letter avaliable to be used: {letter}")
-                return letter
-        return None
-    except Exception as e:
-        logging.info(f"An error occurred while finding available drive letter. Exception: {e}")
-        
 ####### is_execution_day & is_last_working_day_of_month functions with helper functions
-def get_days_in_month():
+def get_days_in_month(config):
     """
     Get the number of days in the month from the configuration.
 
+    Args:
+        config (AppConfig): Loaded configuration.
+
     Returns:
         int or None: Number of days in the month if available, None otherwise.
     """
-    Misc = read_config('Misc')
-    days_in_month = Misc['days_in_month']
+    days_in_month = config.misc.days_in_month
     if days_in_month is not None:
-        return int(days_in_month)
+        return days_in_month
     else:
         logging.error("Missing 'days_in_month' key in Misc config.")
         return None
 
-def calculate_last_working_day_of_month():
+def calculate_last_working_day_of_month(config):
     """
     Calculate the last working day of the month.
 
+    Args:
+        config (AppConfig): Loaded configuration.
+
     Returns:
         datetime.date or None: Last working day of the month if available, None otherwise.
     """
-    days_in_month = get_days_in_month()
+    days_in_month = get_days_in_month(config)
     if days_in_month is not None:
         today = datetime.date.today()
         next_month = today.replace(day=days_in_month) + datetime.timedelta(days=4)  # Jump to end of next month
@@ -536,15 +690,18 @@ def calculate_last_working_day_of_month():
     else:
         return None
 
-def is_last_working_day_of_month():
+def is_last_working_day_of_month(config):
     """
     Check if today is the last working day of the month.
 
+    Args:
+        config (AppConfig): Loaded configuration.
+
     Returns:
         bool or None: True if today is the last working day of the month, False if not, None if unable to determine.
     """
     try:
-        last_working_day = calculate_last_working_day_of_month()
+        last_working_day = calculate_last_working_day_of_month(config)
         if last_working_day:
             logging.info(f"Calculated last working day of the month: {last_working_day}")
             return datetime.date.today() == last_working_day
@@ -554,15 +711,17 @@ def is_last_working_day_of_month():
         logging.error(f"An error occurred during date calculations: {e}")
         return None
     
-def is_execution_day():
+def is_execution_day(config):
     """
     Check if today is an execution day based on configuration.
 
+    Args:
+        config (AppConfig): Loaded configuration.
+
     Returns:
         bool or None: True if today is an execution day, False if not, None if unable to determine.
     """
-   # Misc = read_config('Misc')
-   # weekday_end = int(Misc['weekday_end'])
+   # weekday_end = config.misc.weekday_end
    # if weekday_end is not None:
    #     current_day = datetime.datetime.now().weekday()
    #     return current_day < weekday_end
@@ -572,7 +731,7 @@ def is_execution_day():
 ####### manage_vm_action & get_vm_state & helper functions
 def is_vm_already_in_desired_state(vm_name, action):
     vm_state = get_vm_state(vm_name)
-    if action == VMAction.POWER_OFF and vm_state == "powered off":
+    if action == VMAction.POWER_OFF and vm_state in ("powered off", "poweroff"):
         logging.info(f"VM '{vm_name}' is already powered off.")
         return True
     if action == VMAction.START_HEADLESS and vm_state == "running":
@@ -583,7 +742,7 @@ def is_vm_already_in_desired_state(vm_name, action):
 def execute_vm_action(vm_name, action):
     command, log_message = build_command_and_log_message(vm_name, action)
     try:
-        execute_subprocess_command(command, log_message)
+        execute_subprocess_command(command, log_message, timeout=get_command_timeout('vm_action'))
         return True
     except subprocess.CalledProcessError as e:
         vm_state = get_vm_state(vm_name)
@@ -660,7 +819,7 @@ def get_vm_state(vm_name):
     """
     try:
         command, log_message = build_command_and_log_message(vm_name, VMAction.SHOW_STATE)
-        result = execute_subprocess_command(command, log_message)  
+        result = execute_subprocess_command(command, log_message, timeout=get_command_timeout('query'))
         if result:
             vm_state = extract_vm_state(result.stdout)
             return vm_state
@@ -688,27 +847,31 @@ def extract_vm_state(stdout):
     return "VMState: Could not be found"
 
 ########## Get backup paths
-def get_backup_paths(Paths, network_drive):
+def get_backup_paths(Paths, nas_available):
     """
     Parses backup paths from paths data and creates directories if they don't exist.
 
+    Args:
+        Paths (PathsConfig): Paths section of the loaded configuration.
+        nas_available (bool): Whether the session to the NAS share could be opened.
+
     Returns:
         tuple: A tuple containing dictionaries for daily backup paths and monthly backup paths.
     """
     daily_backup_paths = {
-        'DAILY_LOCAL': Paths.get('source_daily_backup_path', ''),
-        'DAILY_OFFICE365': Paths.get('office365_daily_path', ''),
-        'DAILY_NAS': Paths.get('nas_daily_path', '') 
+        'DAILY_LOCAL': Paths.source_daily_backup_path,
+        'DAILY_OFFICE365': Paths.office365_daily_path,
+        'DAILY_NAS': Paths.nas_daily_path
     }
 
     monthly_backup_paths = {
-        'MONTHLY_LOCAL': Paths.get('source_monthly_backup_path', ''),
-        'MONTHLY_OFFICE365': Paths.get('office365_monthly_path', ''),
-        'MONTHLY_NAS': Paths.get('nas_monthly_path', '') 
+        'MONTHLY_LOCAL': Paths.source_monthly_backup_path,
+        'MONTHLY_OFFICE365': Paths.office365_monthly_path,
+        'MONTHLY_NAS': Paths.nas_monthly_path
     }
 
-    if not network_drive:  # Assuming network_drive is the result of map_network_drive
-        # Remove NAS paths if network drive mapping failed
+    if not nas_available:
+        # Remove NAS paths if the NAS share cannot be reached
         daily_backup_paths.pop('DAILY_NAS', None)
         monthly_backup_paths.pop('MONTHLY_NAS', None)
 
@@ -721,6 +884,20 @@ def get_backup_paths(Paths, network_drive):
     return daily_backup_paths, monthly_backup_paths
 
 ########## Export VM
+def get_export_file_name(vm_name, backup_date=None):
+    """
+    Build the file name of a VM export.
+
+    Parameters:
+        vm_name (str): Name of the Virtual Machine.
+        backup_date (datetime.date, optional): Date of the export. Defaults to today.
+
+    Returns:
+        str: File name in the form '<vm_name>_YYYY-MM-DD.ova'.
+    """
+    backup_date = backup_date or datetime.date.today()
+    return f"{vm_name}_{backup_date.strftime('%Y-%m-%d')}.ova"
+
 def export_vm(vm_name, daily_backup_path):
     """
     Export a Virtual Machine to the specified daily backup path.
@@ -731,50 +908,435 @@ def export_vm(vm_name, daily_backup_path):
     """
     try:
         logging.info(f"Initiating backup for VM '{vm_name}'.")
-        base_filename = f"{vm_name}_{datetime.date.today().strftime('%Y-%m-%d')}"
-        daily_output_path = os.path.join(daily_backup_path, f"{base_filename}.ova")
+        daily_output_path = os.path.join(daily_backup_path, get_export_file_name(vm_name))
         daily_export_command = [VM.VBOX_MANAGE.value, "export", vm_name, f"--output={daily_output_path}", "--ovf20", "--options", "manifest", "--options", "nomacs"]
-        execute_subprocess_command(daily_export_command, f"Backing up VM '{vm_name}' to '{daily_output_path}'.")
+        execute_subprocess_command(daily_export_command, f"Backing up VM '{vm_name}' to '{daily_output_path}'.",
+                                   progress=VBoxProgressParser(f"Export of VM '{vm_name}'"), timeout=get_command_timeout('export'),
+                                   stall_timeout=get_command_timeout('stall'), watch_path=daily_output_path)
         logging.info("Export process completed.")
         return True
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         logging.error(f"Error executing command: {e}")
         return False
 
+########## Export target and replication
+# Daily directories in the order an export is read from when no throughput history picks one.
+REPLICATION_ORDER = ('DAILY_LOCAL', 'DAILY_NAS', 'DAILY_OFFICE365')
+
+def is_directory_writable(directory):
+    """
+    Check a directory is reachable by creating it and writing a probe file.
+
+    Parameters:
+        directory (str): Directory to check.
+
+    Returns:
+        bool: True if a file could be written and removed.
+    """
+    probe_file = os.path.join(directory, f".vmbackup-probe-{os.getpid()}")
+    try:
+        create_directories(directory)
+        with open(probe_file, 'wb'):
+            pass
+        os.remove(probe_file)
+        return True
+    except OSError as e:
+        logging.warning(f"Directory '{directory}' is not writable: {e}")
+        return False
+
+def get_export_directory(config, daily_backup_paths):
+    """
+    Choose where a VM is exported to.
+
+    Exporting straight to the NAS or Office 365 folder saves writing the OVA to the local disk and
+    reading it back for the copy. If the target is unreachable the export is spooled to the local
+    daily folder instead and replicated from there as before.
+
+    Parameters:
+        config (AppConfig): Loaded configuration.
+        daily_backup_paths (dict): Daily backup directories from get_backup_paths.
+
+    Returns:
+        str: The directory to export to.
+    """
+    key = EXPORT_TARGETS[config.export.target]
+    directory = daily_backup_paths.get(key)
+    if key != 'DAILY_LOCAL':
+        if directory and ensure_share(directory) and is_directory_writable(directory):
+            return directory
+        get_metrics().increment('export_spooled')
+        logging.warning(f"Export target '{config.export.target}' is unreachable. Spooling the export to "
+                        f"{daily_backup_paths['DAILY_LOCAL']}.")
+    return daily_backup_paths['DAILY_LOCAL']
+
+def choose_replication_source(sources, planner=None):
+    """
+    Pick the copy of an export to read from.
+
+    Parameters:
+        sources (list): Directories holding the export, in REPLICATION_ORDER.
+        planner (RunPlanner, optional): Read throughput measured by earlier runs.
+
+    Returns:
+        str: The source with the highest measured throughput, or the first one unless every
+             source has history.
+    """
+    rates = {source: planner.read_throughput(source) for source in sources} if planner else {}
+    if rates and all(rate is not None for rate in rates.values()):
+        return max(sources, key=lambda source: rates[source])
+    return sources[0]
+
+def copy_export_file(source_file, destination):
+    """
+    Copy one export through the destination's storage target, which writes it under a temporary
+    name and renames it into place, so an interrupted copy never leaves a truncated OVA behind.
+
+    Parameters:
+        source_file (str): The export to copy.
+        destination (str): Destination directory.
+    """
+    from async_exec import hold_devices
+    try:
+        ensure_share(destination)
+        target = get_directory_target(get_config(), destination)
+        with phase_timer('copy', source=os.path.dirname(source_file), destination=destination) as phase, \
+                hold_devices(source_file, destination):
+            phase['bytes'] = target.put(source_file, os.path.basename(source_file))
+        record_copy(target, os.path.basename(source_file), source_file)
+        logging.info(f"Copied {source_file} to {destination}.")
+    except Exception as e:
+        get_metrics().increment('copy_failures')
+        logging.error(f"Could not copy {source_file} to {destination}: {e}")
+
+def copy_export_segment(source_file, segment, segments_directory):
+    """
+    Copy one segment of an export, timed as a copy to the segments directory's parent.
+
+    Parameters:
+        source_file (str): The export being copied.
+        segment (dict): Segment entry of its manifest.
+        segments_directory (str): Destination segments directory.
+    """
+    from async_exec import hold_devices
+    ensure_share(segments_directory)
+    with phase_timer('copy', source=os.path.dirname(source_file), destination=os.path.dirname(segments_directory)) as phase, \
+            hold_devices(source_file, segments_directory):
+        phase['bytes'] = write_segment(source_file, segment, segments_directory)
+
+def copy_export_segments(copies, segments_config):
+    """
+    Copy exports as fixed-size segments, all segments in parallel within the device budgets.
+
+    Segments that fail are retried on their own up to [Segments] retries times. A destination's
+    manifest is only completed once all of its segments are in place.
+
+    Parameters:
+        copies (list): (export file, destination directory) tuples.
+        segments_config (SegmentsConfig): Segment size and retries.
+    """
+    from async_exec import hold_devices, run_parallel
+    manifests, pending = {}, []
+    for source_file, destination in copies:
+        if source_file not in manifests:
+            with hold_devices(source_file):
+                manifests[source_file] = build_manifest(source_file, segments_config.segment_size_mb * 1024 * 1024)
+        segments_directory = get_segments_directory(destination, os.path.basename(source_file))
+        pending += [(source_file, segment, segments_directory)
+                    for segment in start_segmented_copy(segments_directory, manifests[source_file])]
+    for attempt in range(segments_config.retries + 1):
+        if not pending:
+            break
+        if attempt:
+            get_metrics().increment('segment_retries', len(pending))
+            logging.warning(f"Retrying {len(pending)} export segment(s) that failed to copy (attempt {attempt + 1}).")
+        results = run_parallel([(copy_export_segment, args) for args in pending])
+        pending = [args for args, result in zip(pending, results) if isinstance(result, Exception)]
+    failed = {segments_directory for _, _, segments_directory in pending}
+    for source_file, destination in copies:
+        segments_directory = get_segments_directory(destination, os.path.basename(source_file))
+        if segments_directory in failed:
+            get_metrics().increment('copy_failures')
+            logging.error(f"Segments of {source_file} could not all be copied to {destination}.")
+        else:
+            finish_segmented_copy(segments_directory)
+            logging.info(f"Copied {source_file} to {destination} as {len(manifests[source_file]['segments'])} segment(s).")
+
+def replicate_exports(config, daily_backup_paths, planner=None, deferred=()):
+    """
+    Copy today's exports to every daily directory that does not have them yet.
+
+    Used when [Export] target is not local or exports are segmented. Each export is read from its
+    fastest copy, which is the target unless the export was spooled locally. The local folder
+    always receives the whole OVA so retention and monthly promotion keep working from it; with
+    [Segments] enabled the other folders receive segments.
+
+    Parameters:
+        config (AppConfig): Loaded configuration.
+        daily_backup_paths (dict): Daily backup directories from get_backup_paths.
+        planner (RunPlanner, optional): Read throughput measured by earlier runs.
+        deferred (list): Categories of copies skipped tonight; 'offsite' skips Office 365.
+    """
+    from async_exec import run_parallel
+    directories = [daily_backup_paths[key] for key in REPLICATION_ORDER if key in daily_backup_paths]
+    destinations = [directory for directory in directories
+                    if not ('offsite' in deferred and directory == daily_backup_paths.get('DAILY_OFFICE365'))]
+    calls, segment_copies = [], []
+    for vm_name in config.vm_details.vm_names:
+        file_name = get_export_file_name(vm_name)
+        present = [directory for directory in directories if os.path.isfile(os.path.join(directory, file_name))]
+        if not present:
+            logging.warning(f"No export of VM '{vm_name}' found to replicate.")
+            continue
+        # Reading a cloud-only OneDrive copy would download it again.
+        sources = [directory for directory in present if not is_cloud_only_file(os.path.join(directory, file_name))] or present
+        source_file = os.path.join(choose_replication_source(sources, planner), file_name)
+        for destination in destinations:
+            if destination in present:
+                continue
+            if config.segments.enabled and destination != daily_backup_paths['DAILY_LOCAL']:
+                if not is_complete(get_segments_directory(destination, file_name), os.path.getsize(source_file)):
+                    segment_copies.append((source_file, destination))
+            else:
+                calls.append((copy_export_file, (source_file, destination)))
+    run_parallel(calls)
+    if segment_copies:
+        copy_export_segments(segment_copies, config.segments)
+
+########## Catalog
+def record_copy(target, key, source_file):
+    """
+    Record a file copied to a storage target in the catalog. A catalog that cannot be written
+    does not fail the copy.
+    """
+    from backup_catalog import get_catalog
+    try:
+        get_catalog(get_config()).record(target, key, source_file)
+    except Exception as e:
+        logging.warning(f"Could not record {key} on {target} in the catalog: {e}")
+
+def mark_verified(target, key):
+    from backup_catalog import get_catalog
+    try:
+        get_catalog(get_config()).mark_verified(target, key)
+    except Exception as e:
+        logging.warning(f"Could not mark {key} on {target} verified in the catalog: {e}")
+
+def forget_copy(location, key):
+    """
+    Remove a deleted copy from the catalog.
+
+    Parameters:
+        location (str or StorageTarget): The target or the directory the copy was in.
+        key (str): Key of the copy.
+    """
+    from backup_catalog import get_catalog
+    try:
+        get_catalog(get_config()).remove(location, key)
+    except Exception as e:
+        logging.warning(f"Could not remove {key} on {location} from the catalog: {e}")
+
+########## Extra storage targets
+def upload_to_target(source_file, target):
+    """
+    Put one file on a storage target, timed as a copy to that target.
+
+    Parameters:
+        source_file (str): File to upload.
+        target (StorageTarget): Destination.
+    """
+    from async_exec import hold_devices
+    try:
+        with phase_timer('copy', source=os.path.dirname(source_file), destination=str(target)) as phase, \
+                hold_devices(source_file):
+            phase['bytes'] = target.put(source_file, os.path.basename(source_file))
+        record_copy(target, os.path.basename(source_file), source_file)
+        logging.info(f"Copied {source_file} to target '{target.name}' ({target}).")
+    except Exception as e:
+        get_metrics().increment('copy_failures')
+        logging.error(f"Could not copy {source_file} to target '{target.name}': {e}")
+
+def get_files_to_upload(directory, target, max_age_days):
+    """
+    Files of directory younger than max_age_days that the target lacks or holds with another size.
+    """
+    today = datetime.date.today()
+    files = []
+    for file_name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        path = os.path.join(directory, file_name)
+        if not os.path.isfile(path) or file_name.endswith('.partial'):
+            continue
+        if (today - datetime.date.fromtimestamp(os.path.getmtime(path))).days >= max_age_days:
+            continue
+        copied = target.stat(file_name)
+        if copied is None or copied.size != os.path.getsize(path):
+            files.append(path)
+    return files
+
+def prune_target(target, max_age_days):
+    """
+    Delete objects older than max_age_days from a storage target.
+
+    Returns:
+        int: Objects deleted.
+    """
+    today = datetime.date.today()
+    deleted = 0
+    for info in list(target.list()):
+        if (today - datetime.date.fromtimestamp(info.modified)).days >= max_age_days:
+            target.delete(info.key)
+            forget_copy(target, info.key)
+            deleted += 1
+            logging.info(f"Deleted {info.key} from target '{target.name}'.")
+    return deleted
+
+def copy_to_extra_targets(config, is_last_day, deferred=()):
+    """
+    Bring the '[Target <name>]' targets up to date: daily targets get the exports of the local
+    daily folder, monthly targets the local monthly folder on the last working day. Objects older
+    than the target's retention (or [BackupDetails] retention) are deleted.
+
+    Parameters:
+        config (AppConfig): Loaded configuration.
+        is_last_day (bool): Whether it's the last working day of the month.
+        deferred (list): Categories of copies skipped tonight; extra targets count as 'offsite'.
+    """
+    from async_exec import run_parallel
+    if 'offsite' in deferred:
+        logging.warning("Copies to extra storage targets deferred to the next run.")
+        return
+    Paths, retention = config.paths, config.backup_details
+    schedules = [('daily', Paths.source_daily_backup_path, retention.daily_retention)]
+    if is_last_day:
+        schedules.append(('monthly', Paths.source_monthly_backup_path, retention.monthly_retention))
+    for schedule, directory, default_retention in schedules:
+        try:
+            targets = get_extra_targets(config, schedule)
+        except StorageError as e:
+            logging.error(f"Could not set up the {schedule} storage targets: {e}")
+            continue
+        for target, options in targets:
+            max_age_days = options.retention or default_retention
+            try:
+                run_parallel([(upload_to_target, (path, target)) for path in get_files_to_upload(directory, target, max_age_days)])
+                with phase_timer('cleanup', target=target.name):
+                    prune_target(target, max_age_days)
+            except Exception as e:
+                logging.error(f"Could not update target '{target.name}': {e}")
+
+########## Verify backups
+def verify_daily_backups(config, backup_date=None):
+    """
+    Check that every VM's export exists locally and at each daily destination and daily storage
+    target with the same size. Copies found intact are marked verified in the catalog.
+
+    Parameters:
+        config (AppConfig): Loaded configuration.
+        backup_date (datetime.date, optional): Date of the exports to check. Defaults to today.
+
+    Returns:
+        dict: Maps each VM name to a dictionary of destination path -> 'ok', 'missing', 'size mismatch'
+              or 'incomplete segments'. A complete segmented copy of the same size counts as 'ok'.
+    """
+    Paths = config.paths
+    destinations = [Paths.office365_daily_path, Paths.nas_daily_path]
+    targets = get_extra_targets(config, 'daily')
+    results = {}
+    for vm_name in config.vm_details.vm_names:
+        file_name = get_export_file_name(vm_name, backup_date)
+        local_file = os.path.join(Paths.source_daily_backup_path, file_name)
+        results[vm_name] = {}
+        if not os.path.isfile(local_file):
+            results[vm_name][Paths.source_daily_backup_path] = 'missing'
+            logging.error(f"Export '{file_name}' not found in {Paths.source_daily_backup_path}.")
+            continue
+        results[vm_name][Paths.source_daily_backup_path] = 'ok'
+        local_size = os.path.getsize(local_file)
+        for destination in destinations:
+            # The directory target reads a OneDrive copy's size from the folder listing without opening it.
+            target = get_directory_target(config, destination)
+            try:
+                copied = target.stat(file_name)
+            except StorageError:
+                copied = None
+            segments_directory = get_segments_directory(destination, file_name)
+            if copied is None and os.path.isdir(segments_directory):
+                status = 'ok' if is_complete(segments_directory, local_size) else 'incomplete segments'
+            elif copied is None:
+                status = 'missing'
+            elif copied.size != local_size:
+                status = 'size mismatch'
+            else:
+                status = 'ok'
+                mark_verified(target, file_name)
+            results[vm_name][destination] = status
+            logging.info(f"Verifying '{file_name}' in {destination}: {status}")
+        for target, _ in targets:
+            copied = target.stat(file_name)
+            status = 'missing' if copied is None else 'size mismatch' if copied.size != local_size else 'ok'
+            if status == 'ok':
+                mark_verified(target, file_name)
+            results[vm_name][str(target)] = status
+            logging.info(f"Verifying '{file_name}' in target '{target.name}': {status}")
+    return results
+
 ########## Copying files based on dates
-def copy_backups_based_on_date(is_last_day, Paths):
+def get_copy_tasks(Paths, is_last_day, include_exports=True):
     """
-    Copy backups based on the date condition.
+    List the copies of a run with the category of work each belongs to.
 
     Parameters:
+        Paths (PathsConfig): Paths section of the loaded configuration.
         is_last_day (bool): Whether it's the last day of the month.
-        Paths (dict): Dictionary containing source and destination paths.
-            Example:
-                {
-                    'source_daily_backup_path': str,
-                    'office365_daily_path': str,
-                    'nas_daily_path': str,
-                    'source_monthly_backup_path': str,
-                    'office365_monthly_path': str,
-                    'nas_monthly_path': str
-                }
-            where:
-                - 'source_daily_backup_path': Source path for daily backup.
-                - 'office365_daily_path': Destination path for daily backup (Office 365).
-                - 'nas_daily_path': Destination path for daily backup (NAS).
-                - 'source_monthly_backup_path': Source path for monthly backup.
-                - 'office365_monthly_path': Destination path for monthly backup (Office 365).
-                - 'nas_monthly_path': Destination path for monthly backup (NAS).
-    """
-    folder_copy_subprocess(Paths['source_daily_backup_path'], Paths['office365_daily_path'])
-    folder_copy_subprocess(Paths['source_daily_backup_path'], Paths['nas_daily_path'])
-    folder_copy_subprocess(Paths['vm_management_source_path'], Paths['nas_misc_path'])
-    folder_copy_subprocess(Paths['vm_management_source_path'], Paths['office365_misc_path'])
+        include_exports (bool): Whether to copy the local daily export folder; False when
+            replicate_exports distributes the exports.
 
+    Returns:
+        list: (category, source, destination) tuples. 'required' copies always run; 'offsite'
+              (Office 365) and 'monthly' copies may be deferred by the run planner.
+    """
+    tasks = [
+        ('offsite', Paths.source_daily_backup_path, Paths.office365_daily_path),
+        ('required', Paths.source_daily_backup_path, Paths.nas_daily_path),
+    ] if include_exports else []
+    tasks += [
+        ('required', Paths.vm_management_source_path, Paths.nas_misc_path),
+        ('offsite', Paths.vm_management_source_path, Paths.office365_misc_path),
+    ]
     if is_last_day:
-        copy_last_day_of_month(file_directory_list(Paths['source_daily_backup_path']), Paths['source_monthly_backup_path'])
-        folder_copy_subprocess(Paths['source_monthly_backup_path'], Paths['office365_monthly_path'])
-        folder_copy_subprocess(Paths['source_monthly_backup_path'], Paths['nas_monthly_path'])
+        tasks += [
+            ('monthly', Paths.source_monthly_backup_path, Paths.office365_monthly_path),
+            ('monthly', Paths.source_monthly_backup_path, Paths.nas_monthly_path),
+        ]
+    return tasks
+
+def copy_backups_based_on_date(is_last_day, Paths, deferred=(), include_exports=True):
+    """
+    Copy backups based on the date condition.
+
+    Parameters:
+        is_last_day (bool): Whether it's the last day of the month.
+        Paths (PathsConfig): Paths section of the loaded configuration, using:
+                - source_daily_backup_path: Source path for daily backup.
+                - office365_daily_path: Destination path for daily backup (Office 365).
+                - nas_daily_path: Destination path for daily backup (NAS).
+                - source_monthly_backup_path: Source path for monthly backup.
+                - office365_monthly_path: Destination path for monthly backup (Office 365).
+                - nas_monthly_path: Destination path for monthly backup (NAS).
+        deferred (list): Categories of copies skipped tonight, see get_copy_tasks.
+        include_exports (bool): Whether to copy the local daily export folder, see get_copy_tasks.
+    """
+    from async_exec import run_parallel
+    tasks = [task for task in get_copy_tasks(Paths, is_last_day, include_exports) if task[0] not in deferred]
+    for category in deferred:
+        logging.warning(f"Skipping {category} copies tonight to stay inside the maintenance window.")
+    # Copies to different destinations overlap; the engine's disk and network limits cap how many run at once.
+    run_parallel([(copy_folder, (src, dest)) for category, src, dest in tasks if category != 'monthly'])
+
+    if is_last_day and 'monthly' not in deferred:
+        copy_last_day_of_month(file_directory_list(Paths.source_daily_backup_path), Paths.source_monthly_backup_path)
+        run_parallel([(copy_folder, (src, dest)) for category, src, dest in tasks if category == 'monthly'])
+    elif is_last_day:
+        logging.warning("Monthly promotion was deferred. Run 'python vmbackup.py promote' once there is time.")
 
 def copy_backups(source_path, paths):
     """
@@ -847,6 +1409,79 @@ def folder_copy(src, dest):
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
 
+def copy_folder(src, dest):
+    """
+    Copy a folder with xcopy, or file by file when the destination is a OneDrive folder (see
+    sync_folder_to_onedrive).
+
+    Parameters:
+        src (str): The path to the source directory to be copied.
+        dest (str): The path to the destination directory.
+    """
+    target = get_onedrive_target(get_config(), dest)
+    if target is None:
+        if folder_copy_subprocess(src, dest):
+            record_folder_copy(src, dest)
+    else:
+        sync_folder_to_onedrive(src, target)
+
+def record_folder_copy(src, dest):
+    """
+    Record the files of a folder copied to a daily or monthly destination in the catalog.
+    """
+    config = get_config()
+    if not any(os.path.normpath(getattr(config.paths, key)) == os.path.normpath(dest) for keys in BUILTIN_TARGETS.values() for key in keys):
+        return
+    target = get_directory_target(config, dest)
+    for file_name in os.listdir(src):
+        if os.path.isfile(os.path.join(src, file_name)):
+            record_copy(target, file_name, os.path.join(src, file_name))
+
+def sync_folder_to_onedrive(src, target):
+    """
+    Copy the new and changed files of a folder to a OneDrive folder. Unlike 'xcopy /Y', files whose
+    copy already has the same size and modification time are not rewritten, so the OneDrive client
+    does not upload them again, and their copies are never opened even when they are cloud-only.
+
+    Parameters:
+        src (str): The path to the source directory to be copied.
+        target (OneDriveTarget): The OneDrive folder.
+
+    Returns:
+        tuple: (files written, files unchanged)
+    """
+    from async_exec import hold_devices
+    written = unchanged = 0
+    try:
+        ensure_share(src)
+        with phase_timer('copy', source=src, destination=str(target)) as phase, hold_devices(src, str(target)), \
+                SampledLog(f"Files copied from {src} to {target}") as items:
+            phase['bytes'] = 0
+            for root, dirs, files in os.walk(src):
+                folder = os.path.relpath(root, src)
+                folder = '' if folder == os.curdir else folder.replace(os.sep, '/')
+                copies = target.list_folder(folder)  # one listing per folder, not one per file
+                for file_name in files:
+                    source_file = os.path.join(root, file_name)
+                    key = f"{folder}/{file_name}" if folder else file_name
+                    try:
+                        if target.is_unchanged(source_file, key, copies):
+                            unchanged += 1
+                            continue
+                        items.item(f"Copying {file_name} from: {root} to Destination: {target}...")
+                        phase['bytes'] += target.put(source_file, key, checked=True)
+                        written += 1
+                        record_copy(target, key, source_file)
+                    except OSError as e:  # e.g. a log still being written; xcopy /C carries on too
+                        get_metrics().increment('copy_failures')
+                        logging.error(f"Could not copy {source_file} to {target}: {e}")
+        get_metrics().increment('onedrive_unchanged', unchanged)
+        logging.info(f"Copied {written} new or changed file(s) from {src} to {target}; {unchanged} unchanged.")
+    except Exception as e:
+        get_metrics().increment('copy_failures')
+        logging.error(f"An unexpected error occurred: {e}")
+    return written, unchanged
+
 def folder_copy_subprocess(src, dest):
     """
     Copy the entire contents of a folder from the source path to the destination path using xcopy via subprocess.
@@ -856,7 +1491,7 @@ def folder_copy_subprocess(src, dest):
         dest (str): The path to the destination directory where the contents will be copied.
 
     Returns:
-        None
+        bool: True if xcopy succeeded.
 
     Raises:
         Exception: For unexpected errors during the copying process.
@@ -874,44 +1509,103 @@ def folder_copy_subprocess(src, dest):
         # List files in the source directory
         src_files = os.listdir(src)
         
-        # Print each file being copied
-        for file in src_files:
-            logging.info(f"Copying {file} from: {src} to Destination: {dest}...")
-            file_path = os.path.join(src, file)
-            #remove_hidden_attribute(file_path)
+        # Log each file being copied at DEBUG, with a sampled count at INFO
+        with SampledLog(f"Files to copy from {src} to {dest}") as items:
+            for file in src_files:
+                items.item(f"Copying {file} from: {src} to Destination: {dest}...")
+                #remove_hidden_attribute(os.path.join(src, file))
             
+        ensure_share(src)
+        ensure_share(dest)
         command = ['xcopy', src, dest, '/E', '/I', '/Y', '/H', '/C', '/F']
         log_message = f"Copying from: {src} Destination: {dest}..."
-        execute_subprocess_command(command, log_message)
+        progress = CopyProgressParser.for_directory(f"Copy from {src} to {dest}", src)
+        with phase_timer('copy', source=src, destination=dest) as phase:
+            execute_subprocess_command(command, log_message, progress=progress, timeout=get_command_timeout('copy'),
+                                       stall_timeout=get_command_timeout('stall'), watch_path=dest)
+            phase['bytes'] = progress.total_bytes
+        return True
     except Exception as e:
+        get_metrics().increment('copy_failures')
         logging.error(f"An unexpected error occurred: {e}")
+        return False
 
-def file_management(Paths,daily_backup_paths, monthly_backup_paths):
+def file_management(config, daily_backup_paths, monthly_backup_paths, planner=None, deadline=None):
     """
     This function performs file management tasks including creating directories,
     copying backups based on date, and performing cleanup operations.
 
     Args:
-        Paths (dict): A dictionary containing various file paths used by the program.
-            * Paths['nas_misc_path']: Path to the NAS miscellaneous directory.
-            * Paths['office365_misc_path']: Path to the Office 365 miscellaneous directory.
-            * (Other paths can be added to the Paths dictionary as needed)
+        config (AppConfig): Loaded configuration. The Paths section provides the NAS and
+            Office 365 miscellaneous and log directories.
         daily_backup_paths (list): A list containing paths to directories that require daily backups.
         monthly_backup_paths (list): A list containing paths to directories that require monthly backups.
+        planner (RunPlanner, optional): Duration estimates used to defer optional copies.
+        deadline (datetime.datetime, optional): End of the maintenance window.
 
     Returns:
         None
     """
     try:
-        create_directories(Paths['nas_misc_path'])
-        create_directories(Paths['office365_misc_path'])
-        copy_backups_based_on_date(is_last_working_day_of_month(), Paths)
-        daily_backup_paths.update({'logs_nas': Paths['logs_nas'],'logs_office365': Paths['logs_office365'],'logs_location': Paths['logs_location']})
+        Paths = config.paths
+        is_last_day = is_last_working_day_of_month(config)
+        create_directories(Paths.nas_misc_path)
+        create_directories(Paths.office365_misc_path)
+        deferred = []
+        if planner and deadline:
+            deferred, _ = choose_deferrals(datetime.datetime.now(), deadline, estimate_copies(planner, Paths, is_last_day),
+                                           config.planning.safety_factor, config.planning.defer_optional)
+        archive_log_files(config)
+        replicate = config.export.target != 'local' or config.segments.enabled
+        if replicate:
+            replicate_exports(config, daily_backup_paths, planner, deferred)
+        copy_backups_based_on_date(is_last_day, Paths, deferred, include_exports=not replicate)
+        copy_to_extra_targets(config, is_last_day, deferred)
+        daily_backup_paths.update({'logs_nas': Paths.logs_nas, 'logs_office365': Paths.logs_office365, 'logs_location': Paths.logs_location})
         daily_backup_paths.pop('DAILY_NAS', None)
         monthly_backup_paths.pop('MONTHLY_NAS', None)
-        perform_cleanup_operations(is_last_working_day_of_month(), daily_backup_paths, monthly_backup_paths)
+        perform_cleanup_operations(is_last_day, daily_backup_paths, monthly_backup_paths, config.backup_details)
     except Exception as e:
         logging.error(f"An unexpected error occurred:{e}")
+
+def archive_log_files(config):
+    """
+    Compress finished logs and pack older ones into monthly archives before the logs are copied,
+    then drop expired archives from the copies on the NAS and Office 365. The run's own log, event
+    and summary files, and anything written to since the run started, are left alone.
+
+    Args:
+        config (AppConfig): Loaded configuration, using [Paths] and [LogArchive].
+    """
+    from async_exec import hold_devices
+    from log_archive import ARCHIVE_DIRECTORY, archive_logs, prune_archives
+    Paths = config.paths
+    try:
+        with phase_timer('archive', target='logs'):
+            log_file_path = get_log_file_path()
+            active_paths = [log_file_path, *get_event_paths(log_file_path)] if log_file_path else []
+            archive_logs(Paths.logs_location, config.log_archive, active_paths=active_paths,
+                         modified_since=get_metrics().started.timestamp())
+            for logs_copy in filter(None, (Paths.logs_nas, Paths.logs_office365)):
+                with hold_devices(logs_copy):
+                    prune_archives(os.path.join(logs_copy, ARCHIVE_DIRECTORY), config.log_archive.keep_months)
+    except Exception as e:
+        logging.error(f"Could not archive the logs: {e}")
+
+def index_log_files(config):
+    """
+    Add what the logs gained since the last update to the index searched by 'logs query'.
+
+    Args:
+        config (AppConfig): Loaded configuration, using [Paths] logs_location and [LogIndex].
+    """
+    from log_index import update_index
+    try:
+        flush_logging()
+        counts = update_index(config.log_index.database, config.paths.logs_location, config.vm_details.vm_names)
+        logging.info(f"Log index: {counts['entries']} entries added from {counts['sources']} logs, {counts['removed']} logs removed.")
+    except Exception as e:
+        logging.error(f"Could not update the log index: {e}")
 ########### file_modification
 def remove_hidden_attribute(file_path):
     """
@@ -928,22 +1622,21 @@ def remove_hidden_attribute(file_path):
     except subprocess.CalledProcessError as e:
         logging.error(f"Error removing hidden attribute from {file_path}: {e}")
 ########### File cleanup & helper functions
-def perform_cleanup_operations(is_last_day, daily_paths, monthly_paths):
+def perform_cleanup_operations(is_last_day, daily_paths, monthly_paths, retention):
     """
     Perform cleanup operations based on the date condition.
 
     Parameters:
         is_last_day (bool): Whether it's the last day of the month.
-        source_path (str): Source path for cleanup.
         daily_paths (dict): Dictionary containing daily destination paths.
         monthly_paths (dict): Dictionary containing monthly destination paths.
+        retention (BackupDetailsConfig): Daily and monthly retention in days.
     """
-    retention = read_config("BackupDetails")
-    if not is_last_day:  
-        cleanup_files_in_paths(daily_paths, int(retention.get('daily_retention', 0)))
-    else:
-        cleanup_files_in_paths(daily_paths, int(retention.get('daily_retention', 0)))
-        cleanup_files_in_paths(monthly_paths, int(retention.get('monthly_retention', 0)))
+    with phase_timer('cleanup', schedule='daily'):
+        cleanup_files_in_paths(daily_paths, retention.daily_retention)
+    if is_last_day:
+        with phase_timer('cleanup', schedule='monthly'):
+            cleanup_files_in_paths(monthly_paths, retention.monthly_retention)
 
 def cleanup_files_in_paths(paths, max_age_days):
     """
@@ -953,19 +1646,31 @@ def cleanup_files_in_paths(paths, max_age_days):
         paths (dict): Dictionary containing paths for cleanup.
         max_age_days (int): Maximum age (in days) of files to retain.
     """
+    from async_exec import hold_devices
+    from log_archive import ARCHIVE_DIRECTORY
     try:
         for destination_path in paths.values():
             logging.info(f"Cleaning up files in '{destination_path}' older than {max_age_days} days.")
-            for root, dirs, files in os.walk(destination_path):
-                logging.info(f"Entered subdirectory: {root}")  # Log change to subdirectory
-                for file_name in files:
-                    try:
-                        cleanup_file_path = file_path(root, file_name)
-                        cleanup_file_age = file_age(cleanup_file_path, file_name, max_age_days)
-                        if cleanup_file_age.days >= max_age_days:
-                            file_remove(cleanup_file_path, file_name)
-                    except Exception as e:
-                        logging.error(f"An error occurred while processing file '{file_name}': {str(e)}")
+            ensure_share(destination_path)
+            with hold_devices(destination_path), SampledLog(f"Files checked in '{destination_path}'") as checked:
+                # Ages come from the directory listing, so cloud-only OneDrive files are not opened.
+                for root, dirs, entries in scan_tree(destination_path):
+                    logging.debug(f"Entered subdirectory: {root}")  # Log change to subdirectory
+                    if root == destination_path and ARCHIVE_DIRECTORY in dirs:
+                        dirs.remove(ARCHIVE_DIRECTORY)  # log archives expire by [LogArchive] keep_months
+                    for entry in entries:
+                        file_name = entry.name
+                        try:
+                            checked.item()
+                            cleanup_file_path = file_path(root, file_name)
+                            cleanup_file_age = file_age(cleanup_file_path, file_name, max_age_days,
+                                                        entry.stat(follow_symlinks=False).st_mtime)
+                            if cleanup_file_age.days >= max_age_days:
+                                file_remove(cleanup_file_path, file_name)
+                        except Exception as e:
+                            logging.error(f"An error occurred while processing file '{file_name}': {str(e)}")
+                    if root.endswith(SEGMENTS_SUFFIX) and not os.listdir(root):
+                        os.rmdir(root)  # every segment of an old export has aged out
         logging.info("Finished cleaning up subdirectories in: " + destination_path)
     except Exception as e:
         logging.error(f"An error occurred during file cleanup: {str(e)}")
@@ -983,7 +1688,7 @@ def file_path(root, file_name):
     """
     return os.path.join(root, file_name)
 
-def file_age(file_path, filename, max_age_days):
+def file_age(file_path, filename, max_age_days, modified=None):
     """
     Calculate the age of the file in days.
 
@@ -991,14 +1696,15 @@ def file_age(file_path, filename, max_age_days):
         file_path (str): Path to the file.
         filename (str): Name of the file.
         max_age_days (int): Maximum allowed age of the file in days.
+        modified (float, optional): Modification time already read from a directory listing.
 
     Returns:
         datetime.timedelta: Age of the file.
     """
-    file_mtime = datetime.date.fromtimestamp(os.path.getmtime(file_path))
+    file_mtime = datetime.date.fromtimestamp(os.path.getmtime(file_path) if modified is None else modified)
     file_age = datetime.date.today() - file_mtime
     remaining_days = max_age_days - file_age.days
-    logging.info(f"Checking file '{filename}' with age {file_age.days} days. Days Remaining: {remaining_days}")
+    logging.debug(f"Checking file '{filename}' with age {file_age.days} days. Days Remaining: {remaining_days}")
     return file_age
 
 def file_remove(file_path, file_name):
@@ -1010,6 +1716,8 @@ def file_remove(file_path, file_name):
         file_name (str): Name of the file.
     """
     os.remove(file_path)
+    forget_copy(os.path.dirname(file_path), file_name)
+    get_metrics().increment('files_deleted')
     logging.info(f"Deleted file '{file_name}'.")
 
 def file_directory_list(directory):
@@ -1036,6 +1744,7 @@ def copy_last_day_of_month(files, destination_folder):
         files (list): A list of file paths.
         destination_folder (str): The destination directory path.
     """
+    from async_exec import hold_devices
     # Get a list of unique instances
     instances = set(file.split('_')[0] for file in files)
     
@@ -1048,30 +1757,34 @@ def copy_last_day_of_month(files, destination_folder):
         recent_file = max(instance_files, key=os.path.getctime)
         
         # Copy the most recent file to the destination directory
-        shutil.copy(recent_file, destination_folder)
+        ensure_share(destination_folder)
+        with hold_devices(recent_file, destination_folder):
+            shutil.copy(recent_file, destination_folder)
         logging.info(f"This is the recent file: {recent_file}")
 
 
 ############## Function that gets the log contents, loads it into an email and then sends the email
-def get_log_content(log_file_path):
+def get_log_content(log_file_path, max_lines=None):
     """
-    Read the content of a log file.
+    Read the end of a log file, newest line first, without loading the whole file.
     Args:
         log_file_path (str): The path to the log file.
+        max_lines (int, optional): Number of lines to read. Defaults to run_digest.TAIL_LINES.
 
     Returns:
-        str: The content of the log file.
+        str: The last lines of the log file.
     """
+    from run_digest import TAIL_LINES, tail_lines
     try:
-        with open(log_file_path, 'r') as log_file:
-            return ''.join(reversed(log_file.readlines()))
+        flush_logging()
+        return '\n'.join(reversed(tail_lines(log_file_path, max_lines or TAIL_LINES)))
     except FileNotFoundError as e:
         logging.error(f"File not found error: {e}")
         return None
 
-def send_email(subject, from_email, to_email, body, smtp_server, smtp_port, smtp_username, smtp_password):
+def send_email(subject, from_email, to_email, body, smtp_server, smtp_port, smtp_username, smtp_password, html_body=None, attachments=()):
     """
-    Send an email.
+    Send an email straight away, bypassing the notification outbox.
     Args:
         subject (str): The subject of the email.
         from_email (str): The sender's email address.
@@ -1081,47 +1794,59 @@ def send_email(subject, from_email, to_email, body, smtp_server, smtp_port, smtp
         smtp_port (int): The SMTP server port.
         smtp_username (str): The SMTP username for authentication.
         smtp_password (str): The SMTP password for authentication.
+        html_body (str, optional): HTML version of the body, shown instead of the text by mail clients that can.
+        attachments (list, optional): (file name, bytes) tuples.
     """
-    msg = MIMEMultipart()
-    msg['From'] = from_email
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
-    try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.sendmail(from_email, to_email, msg.as_string())
+    channel = SMTPChannel(smtp_server, smtp_port, smtp_username, smtp_password, from_email, to_email)
+    error, = channel.send_batch([create_message('smtp', subject, body, html_body, attachments)])
+    if error is None:
         logging.info("Email sent successfully.")
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while sending email: {e}")
+    else:
+        logging.error(f"An unexpected error occurred while sending email: {error}")
 
-def send_log_email(log_file_path):
+def send_log_email(log_file_path, config=None, summary=None):
     """
-    Send log file content via email.
+    Email the run digest with the full log attached gzip-compressed.
+
+    The digest lists errors first, then each VM's status, duration and bytes, and the last log
+    lines. Only the end of the log is read for it, so the email costs the same however long the
+    log grows.
     Args:
         log_file_path (str): The path to the log file.
+        config (AppConfig, optional): Loaded configuration. Defaults to the process wide config.
+        summary (dict, optional): Run summary from run_events. Defaults to the summary written
+            next to the log, if any.
     """
+    from run_digest import tail_lines, gzip_file, build_digest
     try:
-        SMTP = read_config("SMTP")
-        smtp_server = SMTP["server"]
-        smtp_username = os.getenv("email_username")
-        smtp_password = os.getenv("email_password")
-        from_email = os.getenv("email_from")
-        to_email = os.getenv("email_to")
-        smtp_port = os.getenv("email_port")
-
-        subject = f"Log file for {datetime.date.today().strftime('%Y-%m-%d')}"
-
-        log_content = get_log_content(log_file_path)
-        if log_content is not None:
-            send_email(subject, from_email, to_email, log_content, smtp_server, smtp_port, smtp_username, smtp_password)
-        else:
-            send_email("VM Restart", from_email, to_email, log_content, smtp_server, smtp_port, smtp_username, smtp_password)
+        flush_logging()
+        title = f"Log file for {datetime.date.today().strftime('%Y-%m-%d')}"
+        if not os.path.isfile(log_file_path):
+            send_notification("VM Restart", f"Log file {log_file_path} not found.", config)
+            return
+        summary = summary or read_run_summary(log_file_path)
+        subject, body, html_body = build_digest(summary, tail_lines(log_file_path), title)
+        compressed_log = gzip_file(log_file_path)
+        attachments = [(os.path.basename(log_file_path) + '.gz', compressed_log)] if compressed_log else []
+        if not compressed_log:
+            body += "\n\nThe log was too large to attach; it is kept at " + log_file_path
+        send_notification(subject, body, config, html_body, attachments)
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
 
+def send_notification(subject, body, config=None, html_body=None, attachments=()):
+    """
+    Queue a notification for the [Notifications] channels. It is delivered in the background and
+    retried from the outbox if delivery fails, see notifications.
+    Args:
+        subject (str): The subject of the email.
+        body (str): The body/content of the email.
+        config (AppConfig, optional): Loaded configuration. Defaults to the process wide config.
+        html_body (str, optional): HTML version of the body.
+        attachments (list, optional): (file name, bytes) tuples.
+    """
+    notify(subject, body, config or get_config(), html_body, attachments)
+
 ############## Snapshot Management 
 def create_snapshot(vm_name):
     """
@@ -1198,7 +1923,7 @@ def list_snapshots(vm_name):
     """
     command = [VM.VBOX_MANAGE.value, "snapshot", vm_name, SnapshotAction.LIST.value, "--machinereadable"]
     log_message = f"Checking snapshots for {vm_name}..."
-    result = execute_subprocess_command(command, log_message)
+    result = execute_subprocess_command(command, log_message, timeout=get_command_timeout('query'))
     lines = result.stdout.split('\n')
     snapshot_lines = []
     existing_snapshots = set()  # To keep track of existing snapshot names
@@ -1219,12 +1944,12 @@ def list_snapshots(vm_name):
 def take_snapshot(vm_name, snapshot_name):
     command = [VM.VBOX_MANAGE.value, "snapshot", vm_name, SnapshotAction.TAKE.value, snapshot_name]
     log_message = f"Taking snapshot '{snapshot_name}' for {vm_name}..."
-    execute_subprocess_command(command, log_message)
+    execute_subprocess_command(command, log_message, timeout=get_command_timeout('snapshot'))
 
 def delete_snapshot(vm_name, snapshot_name):
     command = [VM.VBOX_MANAGE.value, "snapshot", vm_name, SnapshotAction.DELETE.value, snapshot_name]
     log_message = f"Deleting snapshot '{snapshot_name}' for {vm_name}..."
-    execute_subprocess_command(command, log_message)
+    execute_subprocess_command(command, log_message, timeout=get_command_timeout('snapshot'))
 
 def get_snapshot_date(snapshot_name):
     """
@@ -1256,13 +1981,13 @@ def get_snapshot_name():
     new_snapshot_name = f"Snapshot-{current_date.strftime('%d%m%y')}"
     return new_snapshot_name
 
-def manage_snapshot_retention(vm_name):
+def manage_snapshot_retention(vm_name, daily_retention):
     """
     Manages snapshot retention for the specified virtual machine.
 
     Parameters:
         vm_name (str): The name of the virtual machine.
-        snapshot_names (list): List of snapshot names for the VM.
+        daily_retention (int): Maximum age in days of snapshots to keep.
 
     Returns:
         None
@@ -1272,15 +1997,16 @@ def manage_snapshot_retention(vm_name):
         logging.info(f"Managing {vm_name} Snapshots retention...")
         if snapshot_names:
             current_date = datetime.datetime.now()
+            checked = SampledLog(f"{vm_name} snapshots checked")
             for snapshot_name in snapshot_names:
                 snapshot_date = get_snapshot_date(snapshot_name)
                 if snapshot_date:
                     days_difference = (current_date - snapshot_date).days
-                    daily_retention = int(read_config("SnapshotDetails")['daily_retention'])
-                    logging.info(f"Snapshot: {snapshot_name}, Current Age: {days_difference} days, Max Age {daily_retention} days, Days Remaining: {daily_retention - days_difference}")
+                    checked.item(f"Snapshot: {snapshot_name}, Current Age: {days_difference} days, Max Age {daily_retention} days, Days Remaining: {daily_retention - days_difference}")
                     if days_difference > daily_retention:
                         manage_snapshot(vm_name, snapshot_name, SnapshotAction.DELETE)
                         logging.info(f"Deleted snapshot: {snapshot_name}")
+            checked.close()
         logging.info(f"{vm_name}'s Snapshot retention management completed.")
     except Exception as e:
         logging.critical(f"An unexpected error occurred: {e}")
@@ -1296,4 +2022,5 @@ def manage_snapshot(vm_name, snapshot_name, action):
         logging.error(f"Unsupported action: {action}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    main(resume='--resume' in sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+Restores a VM from its exports.
+
+    python vmbackup.py restore VM [--date YYYY-MM-DD] [--name NAME] [--source TARGET] [--list]
+
+1. Every copy of the VM's exports is listed: whole OVAs and complete segmented copies in the daily
+   and monthly folders of the local, nas and office365 destinations, and objects on the extra
+   storage targets. The export used is the newest one, or with --date the newest one taken on or
+   before that day.
+2. Only verified copies are used: the local exports (the originals 'verify' compares against),
+   segmented copies, whose segments are hash-checked while they are read, and copies the catalog
+   marks verified at their current size. --unverified also uses the others.
+3. Of the copies of that export, the one read fastest by earlier runs is used; without history the
+   local copy comes first, then nas, office365 and the extra targets. Cloud-only OneDrive copies
+   come last since they have to be downloaded first.
+4. A whole OVA in a folder is read where it is. Segmented copies are reassembled and objects on
+   S3 targets downloaded in parallel ranges into the [Restore] directory.
+5. The OVA is a tar archive of the OVF descriptor, its manifest and the disk images. Its members are
+   extracted in parallel chunks, [Restore] streams at a time, and the OVF is imported with
+   'VBoxManage import' under a new name, so a VM that still exists is left alone. VBoxManage checks
+   the disks against the manifest while it imports them.
+
+Every step is timed and the total reported as the restore time, the RTO of that VM.
+"""
+import os
+import re
+import time
+import shutil
+import logging
+import tarfile
+import subprocess
+import datetime
+from collections import namedtuple
+from contextlib import contextmanager
+from vm_config import BUILTIN_TARGETS, get_config
+from run_metrics import load_previous_summaries
+from run_planner import RunPlanner
+from share_sessions import open_shares, close_shares
+from storage_targets import (PARTIAL_SUFFIX, LocalTarget, OneDriveTarget, SMBTarget, StorageError, get_builtin_target,
+                             get_chunks, get_extra_targets, run_in_threads)
+from ova_segments import SEGMENTS_SUFFIX, SegmentError, is_complete, reassemble
+
+EXPORT_PATTERN = r'^{vm_name}_(\d{{4}}-\d{{2}}-\d{{2}})\.ova({segments})?$'
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+Artifact = namedtuple('Artifact', 'backup_date target key segmented size verified')
+
+class RestoreError(Exception):
+    """Raised when no usable export is found or a restore step fails."""
+
+####### Finding exports
+def get_restore_targets(config, source=None):
+    """
+    The destinations a restore may read from: the daily and monthly folders of the built-in
+    targets, then the extra storage targets, optionally only those named source.
+    """
+    targets = []
+    for name in BUILTIN_TARGETS:
+        for schedule in ('daily', 'monthly'):
+            target = get_builtin_target(config, name, schedule)
+            if target.root and (source is None or source == name):
+                targets.append(target)
+    try:
+        targets += [target for target, _ in get_extra_targets(config) if source is None or source == target.name]
+    except StorageError as e:
+        logging.warning(f"Skipping the extra storage targets: {e}")
+    return targets
+
+def list_exports(target, vm_name):
+    """
+    The exports of a VM on one target, as (date, key, segmented, size) tuples. Directory targets
+    are read from the folder listing, so no export is opened.
+    """
+    pattern = re.compile(EXPORT_PATTERN.format(vm_name=re.escape(vm_name), segments=re.escape(SEGMENTS_SUFFIX)))
+    if not isinstance(target, LocalTarget):
+        return [(datetime.date.fromisoformat(match.group(1)), info.key, False, info.size)
+                for info in target.list(vm_name + '_') for match in [pattern.match(info.key)] if match and not match.group(2)]
+    if isinstance(target, SMBTarget):
+        target.ensure()
+    exports = []
+    with os.scandir(target.root) as entries:
+        for entry in entries:
+            match = pattern.match(entry.name)
+            if not match:
+                continue
+            backup_date = datetime.date.fromisoformat(match.group(1))
+            if match.group(2) and entry.is_dir() and is_complete(entry.path):
+                exports.append((backup_date, entry.name, True, None))
+            elif not match.group(2) and entry.is_file():
+                exports.append((backup_date, entry.name, False, entry.stat().st_size))
+    return exports
+
+def find_artifacts(config, vm_name, source=None, catalog=None):
+    """
+    Every copy of a VM's exports on the reachable destinations.
+
+    Returns:
+        list: Artifact tuples, in destination order.
+    """
+    originals = {os.path.normpath(config.paths.source_daily_backup_path), os.path.normpath(config.paths.source_monthly_backup_path)}
+    artifacts = []
+    for target in get_restore_targets(config, source):
+        try:
+            exports = list_exports(target, vm_name)
+        except (OSError, StorageError) as e:
+            logging.warning(f"Skipping {target}: {e}")
+            continue
+        for backup_date, key, segmented, size in exports:
+            if segmented or (isinstance(target, LocalTarget) and os.path.normpath(target.root) in originals):
+                verified = True
+            else:
+                row = catalog.lookup(target, key) if catalog else None
+                verified = bool(row and row['verified'] and row['size'] == size)
+            artifacts.append(Artifact(backup_date, target, key, segmented, size, verified))
+    return artifacts
+
+def choose_artifact(artifacts, backup_date=None, planner=None, allow_unverified=False):
+    """
+    Pick the copy to restore from: the newest export on or before backup_date that has a usable
+    copy, read from its fastest copy.
+
+    Args:
+        artifacts (list): Artifact tuples from find_artifacts.
+        backup_date (datetime.date, optional): Latest export date wanted.
+        planner (RunPlanner, optional): Read throughput measured by earlier runs.
+        allow_unverified (bool): Also use copies that were never verified.
+
+    Returns:
+        Artifact: The copy, or None.
+    """
+    usable = [artifact for artifact in artifacts if (artifact.verified or allow_unverified)
+              and (backup_date is None or artifact.backup_date <= backup_date)]
+    if not usable:
+        return None
+    newest = max(artifact.backup_date for artifact in usable)
+    copies = [artifact for artifact in usable if artifact.backup_date == newest]
+
+    def rank(artifact):
+        rate = planner.read_throughput(str(artifact.target)) if planner else None
+        cloud_only = isinstance(artifact.target, OneDriveTarget) and not artifact.segmented and artifact.target.is_cloud_only(artifact.key)
+        return (cloud_only, rate is None, -(rate or 0), copies.index(artifact))
+    return min(copies, key=rank)
+
+####### Extracting
+def list_ova_members(ova_file):
+    """
+    The files in an OVA with where their data starts.
+
+    Returns:
+        list: (name, data offset, size) tuples.
+
+    Raises:
+        RestoreError: If a member would be written outside the extraction directory.
+    """
+    with tarfile.open(ova_file, 'r:') as archive:
+        members = [(member.name, member.offset_data, member.size) for member in archive.getmembers() if member.isfile()]
+    for name, _, _ in members:
+        if os.path.basename(name) != name or name in ('', '.', '..'):
+            raise RestoreError(f"{ova_file} holds an unexpected path '{name}'")
+    return members
+
+def copy_member_range(ova_file, data_offset, partial_file, offset, length):
+    with open(ova_file, 'rb') as source, open(partial_file, 'r+b') as destination:
+        source.seek(data_offset + offset)
+        destination.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = source.read(min(READ_BUFFER_SIZE, remaining))
+            if not data:
+                raise RestoreError(f"{ova_file} ends inside a member")
+            destination.write(data)
+            remaining -= len(data)
+
+def extract_ova(ova_file, directory, streams=4, chunk_size=64 * 1024 * 1024):
+    """
+    Extract the members of an OVA, the chunks of all members streams at a time, each member
+    through a '.partial' file that is renamed once it is complete.
+
+    Args:
+        ova_file (str): The OVA, which may be on a share.
+        directory (str): Folder to extract into.
+        streams (int): Chunks copied at once.
+        chunk_size (int): Bytes per chunk.
+
+    Returns:
+        list: Paths of the extracted files, in archive order.
+    """
+    members = list_ova_members(ova_file)
+    os.makedirs(directory, exist_ok=True)
+    chunks = []
+    for name, data_offset, size in members:
+        partial_file = os.path.join(directory, name + PARTIAL_SUFFIX)
+        with open(partial_file, 'wb') as f:
+            f.truncate(size)
+        chunks += [(data_offset, partial_file, offset, length) for offset, length in get_chunks(size, chunk_size) if length]
+    try:
+        run_in_threads(lambda *chunk: copy_member_range(ova_file, *chunk), chunks, streams)
+    except BaseException:
+        for name, _, _ in members:
+            if os.path.exists(os.path.join(directory, name + PARTIAL_SUFFIX)):
+                os.remove(os.path.join(directory, name + PARTIAL_SUFFIX))
+        raise
+    extracted = []
+    for name, _, _ in members:
+        os.replace(os.path.join(directory, name + PARTIAL_SUFFIX), os.path.join(directory, name))
+        extracted.append(os.path.join(directory, name))
+    return extracted
+
+####### Restoring
+def get_restore_directory(config):
+    return config.restore.directory or os.path.join(os.path.dirname(os.path.normpath(config.paths.source_daily_backup_path)), 'Restore')
+
+@contextmanager
+def timed(report, step):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        report['steps'][step] = time.monotonic() - started
+
+def fetch_artifact(artifact, directory):
+    """
+    Get a local path of the artifact's OVA: the copy itself when it is a whole OVA in a folder,
+    otherwise a reassembled or downloaded file in directory.
+
+    Returns:
+        tuple: (OVA path, whether the file was written by the restore)
+    """
+    if artifact.segmented:
+        ova_file = os.path.join(directory, artifact.key[:-len(SEGMENTS_SUFFIX)])
+        reassemble(os.path.join(artifact.target.root, artifact.key), ova_file)
+        return ova_file, True
+    if isinstance(artifact.target, LocalTarget):
+        return artifact.target.get_path(artifact.key), False
+    ova_file = os.path.join(directory, os.path.basename(artifact.key))
+    artifact.target.get(artifact.key, ova_file)
+    return ova_file, True
+
+def import_appliance(ovf_file, vm_name, timeout=None):
+    """
+    Run 'VBoxManage import' for an extracted OVF.
+
+    Raises:
+        RestoreError: If VBoxManage fails.
+    """
+    from async_exec import run_command
+    command = ['VBoxManage', 'import', ovf_file, '--vsys', '0', '--vmname', vm_name]
+    result = run_command(command, timeout=timeout)
+    if result.returncode != 0:
+        raise RestoreError(f"VBoxManage import failed with return code {result.returncode}: {result.stderr.strip()}")
+
+def restore_vm(config, vm_name, backup_date=None, new_name=None, source=None, allow_unverified=False, keep_files=False):
+    """
+    Restore a VM from its newest usable export and time each step.
+
+    Args:
+        config (AppConfig): Loaded configuration.
+        vm_name (str): VM whose export is restored.
+        backup_date (datetime.date, optional): Restore the newest export on or before this day.
+        new_name (str, optional): Name of the imported VM. Defaults to '<vm>-restored-<date>'.
+        source (str, optional): Only read from this target, e.g. 'nas'.
+        allow_unverified (bool): Also use copies that were never verified.
+        keep_files (bool): Keep the extracted files after the import.
+
+    Returns:
+        dict: The artifact used, the imported name, bytes extracted, seconds per step and the
+              total seconds.
+
+    Raises:
+        RestoreError: If no usable export is found or a step fails.
+    """
+    from backup_catalog import get_catalog
+    started = time.monotonic()
+    planner = RunPlanner(load_previous_summaries(config.metrics.summary_directory, config.metrics.history_runs))
+    artifact = choose_artifact(find_artifacts(config, vm_name, source, get_catalog(config)), backup_date, planner, allow_unverified)
+    if artifact is None:
+        raise RestoreError(f"No {'' if allow_unverified else 'verified '}export of '{vm_name}' found"
+                           + (f" on or before {backup_date}" if backup_date else ''))
+    new_name = new_name or f"{vm_name}-restored-{artifact.backup_date}"
+    directory = os.path.join(get_restore_directory(config), new_name)
+    report = {'vm': vm_name, 'name': new_name, 'backup_date': artifact.backup_date, 'source': f"{artifact.target}",
+              'key': artifact.key, 'steps': {}}
+    logging.info(f"Restoring '{vm_name}' as '{new_name}' from {artifact.key} in {artifact.target}.")
+    os.makedirs(directory, exist_ok=True)
+    staged = None
+    try:
+        with timed(report, 'fetch'):
+            ova_file, written = fetch_artifact(artifact, directory)
+            staged = ova_file if written else None
+        with timed(report, 'extract'):
+            extracted = extract_ova(ova_file, os.path.join(directory, 'extracted'), config.restore.streams,
+                                    config.restore.chunk_size_mb * 1024 * 1024)
+        report['bytes'] = sum(os.path.getsize(path) for path in extracted)
+        ovf_file = next((path for path in extracted if path.lower().endswith('.ovf')), None)
+        if ovf_file is None:
+            raise RestoreError(f"{artifact.key} holds no OVF descriptor")
+        with timed(report, 'import'):
+            import_appliance(ovf_file, new_name, config.timeouts.export or None)
+    except (OSError, StorageError, SegmentError, tarfile.TarError, subprocess.SubprocessError) as e:
+        raise RestoreError(f"Restoring '{vm_name}' from {artifact.target} failed: {e}")
+    finally:
+        if not keep_files:
+            shutil.rmtree(directory, ignore_errors=True)
+        elif staged:
+            os.remove(staged)
+    report['seconds'] = time.monotonic() - started
+    logging.info(f"Restored '{vm_name}' as '{new_name}' in {report['seconds']:.1f}s (RTO): "
+                 + ', '.join(f"{step} {seconds:.1f}s" for step, seconds in report['steps'].items()))
+    return report
+
+def main(vm_name, backup_date=None, new_name=None, source=None, allow_unverified=False, keep_files=False, list_only=False):
+    """
+    Entry point of 'vmbackup.py restore'.
+
+    Returns:
+        int: Exit code.
+    """
+    from vm_process import configure_logging
+    from backup_catalog import get_catalog
+    configure_logging("vmrestore")
+    config = get_config()
+    os.chdir(config.paths.virtual_box_path)
+    try:
+        open_shares(config, config.paths.nas_path)
+        if list_only:
+            artifacts = find_artifacts(config, vm_name, source, get_catalog(config))
+            for artifact in sorted(artifacts, key=lambda artifact: artifact.backup_date, reverse=True):
+                kind = 'segments' if artifact.segmented else 'ova'
+                print(f"{artifact.backup_date} {kind:<8} {'verified' if artifact.verified else 'unverified':<10} {artifact.target}: {artifact.key}")
+            return 0 if artifacts else 1
+        report = restore_vm(config, vm_name, backup_date, new_name, source, allow_unverified, keep_files)
+    except RestoreError as e:
+        logging.error(str(e))
+        print(e)
+        return 1
+    finally:
+        close_shares()
+    print(f"Restored '{vm_name}' as '{report['name']}' from the {report['backup_date']} export in {report['source']}.")
+    for step, seconds in report['steps'].items():
+        print(f"  {step:<8} {seconds:8.1f}s")
+    print(f"  {'total':<8} {report['seconds']:8.1f}s  ({report['bytes'] / 1024 / 1024:.1f} MB extracted)")
+    return 0
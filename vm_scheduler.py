@@ -0,0 +1,111 @@
+"""
+Orders and runs the per VM pipelines (power off, snapshot, export, retention, power on).
+
+Each VM gets a job with its priority, dependencies and expected downtime, estimated by run_planner
+from earlier runs' phase timings. Jobs run on up to [Scheduling] max_parallel_vms threads. Whenever
+a slot is free the next job is picked by Smith's rule (highest priority / expected downtime first),
+which minimises the priority weighted time until every VM is back up, among the jobs whose
+dependencies are already running again.
+"""
+import logging
+import concurrent.futures
+from dataclasses import dataclass
+from vm_config import get_vm_options
+
+@dataclass
+class VMJob:
+    name: str
+    priority: int = 1
+    depends_on: tuple = ()
+    max_downtime: int = 0
+    estimate: float = 0.0
+
+    def sort_key(self):
+        return self.priority / max(self.estimate, 1.0)
+
+def build_jobs(config, planner):
+    """
+    Build one job per configured VM.
+
+    Args:
+        config (AppConfig): Loaded configuration.
+        planner (RunPlanner): Duration estimates from earlier runs.
+
+    Returns:
+        list: VMJob per VM in vm_names order.
+    """
+    jobs = []
+    for vm_name in config.vm_details.vm_names:
+        options = get_vm_options(config, vm_name)
+        estimate = planner.vm_downtime(vm_name)
+        job = VMJob(vm_name, options.priority, options.depends_on, options.max_downtime,
+                    config.scheduling.default_estimate if estimate is None else estimate)
+        if job.max_downtime and job.estimate > job.max_downtime:
+            logging.warning(f"VM '{vm_name}' is expected to be down for {job.estimate:.0f}s, "
+                            f"more than its max_downtime of {job.max_downtime}s.")
+        jobs.append(job)
+    return jobs
+
+def pick_next(ready):
+    """
+    Choose the ready job to start next. Ties keep the vm_names order.
+    """
+    return max(ready, key=lambda job: (job.sort_key(), -ready.index(job)))
+
+def plan_order(jobs):
+    """
+    The order the jobs start in when run one at a time.
+
+    Args:
+        jobs (list): VMJobs.
+
+    Returns:
+        list: The jobs in start order.
+    """
+    remaining, finished, order = list(jobs), set(), []
+    while remaining:
+        ready = [job for job in remaining if all(dependency in finished for dependency in job.depends_on)]
+        job = pick_next(ready)
+        remaining.remove(job)
+        finished.add(job.name)
+        order.append(job)
+    return order
+
+def run_jobs(jobs, worker, max_parallel=1):
+    """
+    Run worker(vm_name) for every job, respecting dependencies and the parallel limit.
+
+    A job starts only once all its dependencies have finished, so the VMs it depends on are
+    running again before it is taken down. A failed dependency is logged and does not block it.
+
+    Args:
+        jobs (list): VMJobs, e.g. from build_jobs.
+        worker (callable): Processes one VM.
+        max_parallel (int): Jobs allowed to run at once.
+
+    Returns:
+        dict: VM name -> the worker's result, or the exception it raised.
+    """
+    logging.info("VM schedule: " + ', '.join(f"{job.name} (priority {job.priority}, ~{job.estimate / 60:.0f} min)"
+                                             for job in plan_order(jobs)))
+    remaining, running, results = list(jobs), {}, {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='vm') as executor:
+        while remaining or running:
+            ready = [job for job in remaining if all(dependency in results for dependency in job.depends_on)]
+            while ready and len(running) < max_parallel:
+                job = pick_next(ready)
+                ready.remove(job)
+                remaining.remove(job)
+                running[executor.submit(worker, job.name)] = job
+            if not running:
+                logging.error(f"Cannot schedule {', '.join(job.name for job in remaining)}: unresolved dependencies.")
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    results[job.name] = future.result()
+                except Exception as e:
+                    logging.error(f"Processing VM '{job.name}' failed: {e}")
+                    results[job.name] = e
+    return results
@@ -0,0 +1,204 @@
+import os
+import re
+import time
+import logging
+import subprocess
+from collections import deque
+from dataclasses import dataclass, field
+from vm_config import get_config
+from log_pipeline import apply_logging_config
+from notifications import resume_delivery
+from vm_process import VM, VMAction, configure_logging, load_environment_variables, execute_vm_action, is_maintenance_running, send_notification, get_command_timeout
+
+RUNNING_VM_PATTERN = re.compile(r'^"(.*)" \{[0-9a-fA-F-]+\}$')
+
+####### Polling & actions
+def parse_running_vms(output):
+    """
+    Parse the output of 'VBoxManage list runningvms'.
+
+    Args:
+        output (str): Command output, one '"name" {uuid}' line per running VM.
+
+    Returns:
+        set: Names of the running VMs.
+    """
+    names = set()
+    for line in output.splitlines():
+        match = RUNNING_VM_PATTERN.match(line.strip())
+        if match:
+            names.add(match.group(1))
+    return names
+
+def list_running_vms():
+    """
+    Get every running VM with a single VBoxManage call.
+
+    Returns:
+        set: Names of the running VMs.
+
+    Raises:
+        subprocess.CalledProcessError: If VBoxManage fails.
+        subprocess.TimeoutExpired: If VBoxManage does not answer within the query timeout.
+    """
+    result = subprocess.run([VM.VBOX_MANAGE.value, "list", "runningvms"], capture_output=True, text=True, check=True,
+                            timeout=get_command_timeout('query'))
+    return parse_running_vms(result.stdout)
+
+def start_vm(vm_name):
+    """
+    Start a VM in headless mode without first querying its state again.
+
+    Args:
+        vm_name (str): The name of the virtual machine.
+
+    Returns:
+        bool: True if VBoxManage reported success, False otherwise.
+    """
+    return execute_vm_action(vm_name, VMAction.START_HEADLESS)
+
+####### Watchdog
+@dataclass
+class VMWatchState:
+    state: str = 'unknown'
+    restarts: deque = field(default_factory=deque)
+    next_attempt: float = 0.0
+    last_alert: str = ''
+
+class VMWatchdog:
+    """
+    Keeps VMs running from one resident process.
+
+    Each cycle polls all VM states with one call, starts stopped VMs with exponential backoff and
+    stops trying once a VM restarts too often within the crash loop window. Alerts are only sent when
+    a VM's situation changes, so a VM that keeps failing to start produces one email, not one per poll.
+    """
+
+    def __init__(self, vm_names, settings, poll=list_running_vms, start=start_vm, alert=None,
+                 maintenance_running=lambda: False, clock=time.monotonic, sleep=time.sleep):
+        self.settings = settings
+        self.poll = poll
+        self.start = start
+        self.alert = alert or (lambda subject, body: None)
+        self.maintenance_running = maintenance_running
+        self.clock = clock
+        self.sleep = sleep
+        self.states = {vm_name: VMWatchState() for vm_name in vm_names}
+
+    def backoff(self, attempts):
+        """
+        Seconds to wait after a restart attempt before trying the same VM again.
+
+        Args:
+            attempts (int): Restart attempts within the crash loop window, including this one.
+
+        Returns:
+            float: The delay, doubling per attempt and capped at backoff_max.
+        """
+        return min(self.settings.backoff_max, self.settings.backoff_initial * 2 ** max(attempts - 1, 0))
+
+    def check_vm(self, vm_name, running, now):
+        """
+        Update one VM's state and restart it if needed.
+
+        Args:
+            vm_name (str): The name of the virtual machine.
+            running (bool): Whether the VM appeared in the running list.
+            now (float): Current clock value in seconds.
+
+        Returns:
+            str or None: Alert message if the VM's situation changed, else None.
+        """
+        watch = self.states[vm_name]
+        if running:
+            previous, watch.state = watch.state, 'running'
+            if previous in ('stopped', 'crash-loop'):
+                return f"'{vm_name}' is running again."
+            return None
+
+        while watch.restarts and now - watch.restarts[0] > self.settings.crash_loop_window:
+            watch.restarts.popleft()
+        if watch.state == 'crash-loop':
+            return None
+        if len(watch.restarts) >= self.settings.crash_loop_restarts:
+            watch.state = 'crash-loop'
+            return (f"'{vm_name}' stopped {len(watch.restarts)} times within {self.settings.crash_loop_window} seconds. "
+                    "Automatic restarts are paused until it is started manually.")
+
+        previous = watch.state
+        watch.state = 'stopped'
+        if now < watch.next_attempt:
+            return f"'{vm_name}' is not running." if previous == 'running' else None
+
+        watch.restarts.append(now)
+        watch.next_attempt = now + self.backoff(len(watch.restarts))
+        if self.start(vm_name):
+            watch.state = 'restarting'
+            return f"'{vm_name}' was not running and has been started."
+        return f"'{vm_name}' is not running and could not be started. Retrying with backoff."
+
+    def poll_once(self):
+        """
+        Run one watchdog cycle.
+
+        Returns:
+            list: Alert messages that were sent this cycle.
+        """
+        if self.maintenance_running():
+            logging.debug("Maintenance run in progress. Skipping VM checks.")
+            return []
+        try:
+            running_vms = self.poll()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            logging.error(f"Could not poll VM states: {e}")
+            return []
+
+        now = self.clock()
+        alerts = []
+        for vm_name, watch in self.states.items():
+            message = self.check_vm(vm_name, vm_name in running_vms, now)
+            if message and message != watch.last_alert:
+                logging.warning(message)
+                watch.last_alert = message
+                alerts.append(message)
+            elif watch.state == 'running':
+                watch.last_alert = ''
+        if alerts:
+            self.alert(f"VM watchdog: {len(alerts)} state change(s)", "\n".join(alerts))
+        return alerts
+
+    def run(self, cycles=None):
+        """
+        Poll until interrupted.
+
+        Args:
+            cycles (int, optional): Stop after this many cycles. Runs forever if omitted.
+        """
+        logging.info(f"Watching {', '.join(self.states)} every {self.settings.poll_interval} seconds.")
+        completed = 0
+        try:
+            while cycles is None or completed < cycles:
+                self.poll_once()
+                completed += 1
+                if cycles is None or completed < cycles:
+                    self.sleep(self.settings.poll_interval)
+        except KeyboardInterrupt:
+            logging.info("Watchdog stopped.")
+
+def main():
+    configure_logging("vmwatchdog")
+    load_environment_variables()
+    config = get_config()
+    apply_logging_config(config.logging)
+    resume_delivery(config)
+    os.chdir(config.paths.virtual_box_path)
+    watchdog = VMWatchdog(
+        config.vm_details.vm_names,
+        config.watchdog,
+        alert=lambda subject, body: send_notification(subject, body, config),
+        maintenance_running=lambda: is_maintenance_running(config.watchdog.maintenance_lock_hours),
+    )
+    watchdog.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Single command line entry point for the VM maintenance scripts.
+
+    python vmbackup.py run|status|watch|snapshots|promote|restart|verify|reassemble|restore|logs|bench|init
+
+Only argparse is imported up front. Each subcommand names the module holding its implementation
+and that module is imported when the subcommand runs, so a quick probe such as 'status' does not
+load the email, dotenv or export code used by the nightly run.
+"""
+import sys
+import time
+import argparse
+import importlib
+
+# Cold start budget in milliseconds for 'bench', measured from process spawn to exit.
+DEFAULT_COLD_START_BUDGET_MS = 250
+
+####### Subcommand handlers
+def run_command(args):
+    import vm_process
+    vm_process.main(resume=args.resume)
+
+def status_command(args):
+    import checkvmrunning
+    if args.no_start:
+        checkvmrunning.report_states()
+    else:
+        checkvmrunning.main()
+
+def watch_command(args):
+    import vm_watchdog
+    vm_watchdog.main()
+
+def snapshots_command(args):
+    import os
+    from vm_config import get_config
+    from vm_process import list_snapshots
+    config = get_config()
+    os.chdir(config.paths.virtual_box_path)
+    for vm_name in args.vm or config.vm_details.vm_names:
+        print(f"{vm_name}: {', '.join(list_snapshots(vm_name)) or 'no snapshots'}")
+
+def promote_command(args):
+    import monthlycopy
+    monthlycopy.main()
+
+def restart_command(args):
+    import restart
+    restart.main()
+
+def verify_command(args):
+    import datetime
+    from vm_config import get_config
+    from vm_process import verify_daily_backups
+    backup_date = datetime.date.fromisoformat(args.date) if args.date else None
+    results = verify_daily_backups(get_config(), backup_date)
+    failed = False
+    for vm_name, destinations in results.items():
+        for destination, status in destinations.items():
+            print(f"{vm_name}: {destination}: {status}")
+            failed = failed or status != 'ok'
+    return 1 if failed else 0
+
+def reassemble_command(args):
+    import os
+    from ova_segments import SEGMENTS_SUFFIX, SegmentError, reassemble
+    segments_directory = os.path.normpath(args.segments_directory)
+    output_file = args.output
+    if not output_file and segments_directory.endswith(SEGMENTS_SUFFIX):
+        output_file = segments_directory[:-len(SEGMENTS_SUFFIX)]
+    if not output_file:
+        print("--output is required when the directory does not end in " + SEGMENTS_SUFFIX)
+        return 2
+    try:
+        size = reassemble(segments_directory, output_file)
+    except (SegmentError, OSError) as e:
+        print(f"Could not reassemble {segments_directory}: {e}")
+        return 1
+    print(f"Reassembled {output_file} ({size / 1024 / 1024:.1f} MB), hashes verified.")
+    return 0
+
+def restore_command(args):
+    import datetime
+    import vm_restore
+    backup_date = datetime.date.fromisoformat(args.date) if args.date else None
+    return vm_restore.main(args.vm, backup_date, args.name, args.source, args.unverified, args.keep, args.list)
+
+def logs_command(args):
+    import datetime
+    from vm_config import get_config
+    import log_archive
+    config = get_config()
+    if args.logs_command == 'archive':
+        counts = log_archive.archive_logs(config.paths.logs_location, config.log_archive)
+        print(f"{counts['compressed']} logs compressed, {counts['packed']} packed, {counts['pruned']} archives removed.")
+        return 0
+    since = datetime.date.fromisoformat(args.since) if args.since else None
+    until = datetime.date.fromisoformat(args.until) if args.until else None
+    if args.logs_command == 'query':
+        return query_logs(config, args, since, until)
+    found = 0
+    for source, line in log_archive.search_logs(config.paths.logs_location, args.pattern, args.name, since, until):
+        print(f"{source}: {line}")
+        found += 1
+    return 0 if found else 1
+
+def query_logs(config, args, since, until):
+    import sqlite3
+    import log_index
+    log_index.update_index(config.log_index.database, config.paths.logs_location, config.vm_details.vm_names)
+    try:
+        entries = log_index.query_index(config.log_index.database, ' '.join(args.text) or None, args.vm, args.phase,
+                                        args.level, since, until, args.name, args.limit)
+    except sqlite3.OperationalError as e:
+        print(f"Invalid search '{' '.join(args.text)}': {e}")
+        return 2
+    for entry in entries:
+        context = ' '.join(filter(None, (entry['name'], entry['vm'], entry['phase'])))
+        print(f"{entry['time']} [{entry['level']}] {context}: {entry['message']}")
+    return 0 if entries else 1
+
+def init_command(args):
+    import settings_schema
+    return settings_schema.main(args)
+
+def bench_command(args):
+    if args.pipeline:
+        import bench_pipeline
+        return bench_pipeline.main(args)
+    commands = args.commands or [name for name in SUBCOMMANDS if name != 'bench']
+    baseline = measure_cold_start([sys.executable, '-c', 'pass'], args.repeat)
+    print(f"{'interpreter':<12} {baseline:8.1f} ms")
+    over_budget = []
+    for name in commands:
+        elapsed = measure_cold_start([sys.executable, __file__, '--import-only', name], args.repeat)
+        flag = '' if elapsed <= args.budget_ms else '  OVER BUDGET'
+        print(f"{name:<12} {elapsed:8.1f} ms{flag}")
+        if flag:
+            over_budget.append(name)
+    return 1 if over_budget else 0
+
+def measure_cold_start(command, repeat):
+    """
+    Time how long a fresh process takes to start and exit.
+
+    Args:
+        command (list): Command to spawn.
+        repeat (int): Number of runs; the fastest is reported to filter out scheduling noise.
+
+    Returns:
+        float: Fastest wall clock time in milliseconds.
+    """
+    import subprocess
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+# Maps each subcommand to its handler and the modules it needs, imported only when it runs.
+SUBCOMMANDS = {
+    'run': (run_command, ['vm_process'], "Run the nightly snapshot, export, copy and cleanup."),
+    'status': (status_command, ['checkvmrunning'], "Start any configured VM that is not running."),
+    'watch': (watch_command, ['vm_watchdog'], "Keep VMs running from a resident process (run-check daemon mode)."),
+    'snapshots': (snapshots_command, ['vm_process'], "List snapshots for each VM."),
+    'promote': (promote_command, ['monthlycopy'], "Copy the newest daily exports to the monthly folder."),
+    'restart': (restart_command, ['restart'], "Power off all VMs, email the log and restart the host."),
+    'verify': (verify_command, ['vm_process'], "Check exports exist at every daily destination."),
+    'reassemble': (reassemble_command, ['ova_segments'], "Rebuild a segmented export into a single OVA."),
+    'restore': (restore_command, ['vm_restore'], "Import a VM from its newest verified export and report the restore time."),
+    'logs': (logs_command, ['log_archive', 'log_index'], "Compress and archive finished logs, or search and query them."),
+    'bench': (bench_command, [], "Measure subcommand cold starts, or full runs with --pipeline."),
+    'init': (init_command, ['settings_schema'], "Generate config.ini and .env from the settings schema."),
+}
+
+def build_parser():
+    """
+    Build the argument parser with one subparser per subcommand.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(prog='vmbackup', description="VirtualBox VM maintenance.")
+    parser.add_argument('--import-only', action='store_true', help=argparse.SUPPRESS)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parsers = {name: subparsers.add_parser(name, help=help_text) for name, (_, _, help_text) in SUBCOMMANDS.items()}
+
+    parsers['run'].add_argument('--resume', action='store_true', help="Continue an interrupted run: start VMs it left off and skip finished steps.")
+    parsers['status'].add_argument('--no-start', action='store_true', help="Only report VM states.")
+    parsers['snapshots'].add_argument('vm', nargs='*', help="VM names. Defaults to vm_names from config.ini.")
+    parsers['verify'].add_argument('--date', help="Export date as YYYY-MM-DD. Defaults to today.")
+    parsers['reassemble'].add_argument('segments_directory', help="A '<export>.ova.segments' directory.")
+    parsers['reassemble'].add_argument('--output', help="OVA to write. Defaults to the directory name without '.segments'.")
+    parsers['restore'].add_argument('vm', help="VM whose export is restored.")
+    parsers['restore'].add_argument('--date', help="Restore the newest export taken on or before this day (YYYY-MM-DD).")
+    parsers['restore'].add_argument('--name', help="Name of the imported VM. Defaults to '<vm>-restored-<export date>'.")
+    parsers['restore'].add_argument('--source', help="Only read from this target, e.g. nas, office365 or an extra target's name.")
+    parsers['restore'].add_argument('--unverified', action='store_true', help="Also use copies that 'verify' has not checked.")
+    parsers['restore'].add_argument('--keep', action='store_true', help="Keep the extracted OVF and disks after the import.")
+    parsers['restore'].add_argument('--list', action='store_true', help="Only list the VM's exports on every destination.")
+    logs_commands = parsers['logs'].add_subparsers(dest='logs_command', required=True)
+    logs_commands.add_parser('archive', help="Compress finished logs and pack older ones into monthly archives now.")
+    search = logs_commands.add_parser('search', help="Print log lines matching a regular expression, archived logs included.")
+    search.add_argument('pattern', help="Regular expression.")
+    query = logs_commands.add_parser('query', help="Query the indexed logs and run events by words, VM, phase, level and date.")
+    query.add_argument('text', nargs='*', help="Words to find, in SQLite FTS5 syntax, e.g. export AND failed.")
+    query.add_argument('--vm', help="Only lines and events of this VM.")
+    query.add_argument('--phase', help="Only events of this phase, e.g. export or copy.")
+    query.add_argument('--level', type=str.upper, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Minimum level.")
+    query.add_argument('--limit', type=int, default=200, help="Most recent matches shown.")
+    for logs_parser in (search, query):
+        logs_parser.add_argument('--name', help="Only this script's logs, e.g. vmmaintenance.")
+        logs_parser.add_argument('--since', help="First day as YYYY-MM-DD.")
+        logs_parser.add_argument('--until', help="Last day as YYYY-MM-DD.")
+    parsers['bench'].add_argument('commands', nargs='*', help="Subcommands to measure. Defaults to all.")
+    parsers['bench'].add_argument('--repeat', type=int, default=5, help="Runs per subcommand.")
+    parsers['bench'].add_argument('--budget-ms', type=float, default=DEFAULT_COLD_START_BUDGET_MS, help="Cold start budget per subcommand.")
+    parsers['bench'].add_argument('--pipeline', action='store_true', help="Time full runs against the VBoxManage simulator instead.")
+    parsers['bench'].add_argument('--vm-counts', type=int, nargs='+', default=[1, 10, 50], help="VM counts for --pipeline.")
+    parsers['bench'].add_argument('--latency', nargs='*', metavar='OP=SECONDS', help="Simulated latency per operation for --pipeline, e.g. export=1.5.")
+    parsers['bench'].add_argument('--export-size-mb', type=int, default=16, help="Size of each simulated export for --pipeline.")
+    parsers['bench'].add_argument('--real-writes', action='store_true', help="Write every byte of each simulated export.")
+    add_init_arguments(parsers['init'])
+    return parser
+
+def add_init_arguments(parser):
+    """
+    Add the init arguments here so settings_schema is only imported when init runs.
+
+    Args:
+        parser (argparse.ArgumentParser): The init subparser.
+    """
+    parser.add_argument('--config', help="Path of config.ini to write.")
+    parser.add_argument('--env', help="Path of .env to write.")
+    parser.add_argument('--defaults', action='store_true', help="Write defaults and current environment values without prompting.")
+    parser.add_argument('--force', action='store_true', help="Overwrite existing files.")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    if argv[:1] == ['--import-only'] and len(argv) == 2 and argv[1] in SUBCOMMANDS:
+        # Cold start probe from 'bench', without the arguments some subcommands require.
+        for module in SUBCOMMANDS[argv[1]][1]:
+            importlib.import_module(module)
+        return 0
+    args = parser.parse_args(argv)
+    handler, modules, _ = SUBCOMMANDS[args.command]
+    if args.import_only:
+        for module in modules:
+            importlib.import_module(module)
+        return 0
+    return handler(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())